@@ -0,0 +1,634 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import urllib.parse
+from dotenv import load_dotenv
+
+# Асинхронный режим сервера (ASGI): те же /callback и /payment, что и во Flask
+# (server.py), на asyncpg и httpx. Обработчики методов общие – payme_handlers.
+# Запуск: uvicorn asgi_server:app --host 0.0.0.0 --port $PORT
+
+load_dotenv()
+
+import asyncpg
+import httpx
+import db_pool
+import outbox
+import expiry
+import partitions
+import telegram_client
+import migrations
+import transitions
+import order_queries
+import payment_page
+import payme_handlers
+import response_cache
+import client_cache
+import product_catalog
+import rpc_log
+import rpc_codec
+import metrics
+import tracing
+import audit
+
+GROUP_CHAT_ID = os.getenv("GROUP_CHAT_ID")
+
+rpc_log.setup_logging()
+
+# SQL в стиле psycopg2 -> позиционные $1, $2 ... asyncpg (см. order_queries.to_positional)
+to_asyncpg = order_queries.to_positional
+
+
+_transition_sql = {}
+
+
+def transition_sql(transition, scope="hot"):
+    converted = _transition_sql.get((transition.name, scope))
+    if converted is None:
+        converted = _transition_sql[(transition.name, scope)] = to_asyncpg(transitions.build_sql(transition, scope))
+    return converted
+
+
+# asyncpg сам готовит выражения и кэширует их на соединении – берём готовый SQL с $n.
+# Поиск по ключу – горячие секции, остальные, архив одним запросом (см. order_queries.Lookup)
+def lookup_sql(lookup):
+    return lookup.row, lookup.statement.sql
+
+
+ORDER_BY_MERCHANT_TRANS_ID_SQL = lookup_sql(order_queries.ORDER_BY_MERCHANT_TRANS_ID)
+ORDER_BY_TRANSACTION_SQL = lookup_sql(order_queries.ORDER_BY_TRANSACTION)
+ORDER_FOR_RECEIPT_SQL = lookup_sql(order_queries.ORDER_FOR_RECEIPT)
+STATEMENT_SQL = to_asyncpg(order_queries.STATEMENT_SQL)[0]
+RESTORE_SQL = {
+    column: to_asyncpg(order_queries.RESTORE_SQL.format(key_column=column))[0]
+    for column in {transition.key_column for transition in (transitions.CREATE, transitions.PERFORM, transitions.CANCEL)}
+}
+ENQUEUE_SQL = "INSERT INTO notification_outbox (order_id, chat_id, kind, next_attempt_at) VALUES ($1, $2, $3, $4)"
+CLAIM_SQL = to_asyncpg(outbox.CLAIM_SQL)[0]
+CLAIM_DIGEST_SQL = to_asyncpg(outbox.CLAIM_DIGEST_SQL)[0]
+ORDERS_SQL = to_asyncpg(outbox.ORDERS_SQL)[0]
+CLIENTS_SQL = to_asyncpg(client_cache.CLIENTS_SQL)[0]
+MARK_SENT_SQL = to_asyncpg(outbox.MARK_SENT_SQL)[0]
+MARK_FAILED_SQL = to_asyncpg(outbox.MARK_FAILED_SQL)[0]
+EXPIRE_SQL, EXPIRE_NAMES = to_asyncpg(expiry.EXPIRE_SQL)
+EXPIRY_LOCK_SQL = to_asyncpg(expiry.LOCK_SQL)[0]
+
+
+# fetchrow с записью медленного запроса (дольше tracing.SLOW_SQL_MS) и его
+# плана EXPLAIN в трассу – как order_queries.execute в синхронном режиме.
+# Внутри conn.transaction() вложенная транзакция asyncpg – это SAVEPOINT:
+# ошибка EXPLAIN не обрывает транзакцию перехода.
+async def fetchrow_traced(conn, sql, *args):
+    started = time.perf_counter()
+    row = await conn.fetchrow(sql, *args)
+    duration = time.perf_counter() - started
+    if tracing.is_slow(duration):
+        try:
+            async with conn.transaction():
+                plan = await conn.fetchval("EXPLAIN (FORMAT JSON) " + sql, *args)
+        except Exception as e:
+            plan = f"EXPLAIN не выполнен: {e}"
+        tracing.record_slow_sql(sql, args, duration, plan)
+    return row
+
+
+# Асинхронный бэкенд для обработчиков payme_handlers
+class AsyncpgBackend:
+    def __init__(self, pool, outbox_wakeup):
+        self.pool = pool
+        self.outbox_wakeup = outbox_wakeup
+
+    async def _find_order(self, lookup, key):
+        row_class, sql = lookup
+        async with self.pool.acquire() as conn:
+            row = await fetchrow_traced(conn, sql, key)
+        if row is None:
+            order_queries.count_lookup("missing")
+            return None
+        values = tuple(row.values())
+        order_queries.count_lookup(values[0])
+        return row_class._make(values[1:])
+
+    @metrics.timed_db("get_order_by_merchant_trans_id")
+    async def get_order_by_merchant_trans_id(self, merchant_trans_id):
+        return await self._find_order(ORDER_BY_MERCHANT_TRANS_ID_SQL, merchant_trans_id)
+
+    @metrics.timed_db("get_order_by_transaction")
+    async def get_order_by_transaction(self, transaction_id):
+        return await self._find_order(ORDER_BY_TRANSACTION_SQL, transaction_id)
+
+    @metrics.timed_db("get_order_for_receipt")
+    async def get_order_for_receipt(self, merchant_trans_id):
+        return await self._find_order(ORDER_FOR_RECEIPT_SQL, merchant_trans_id)
+
+    # Курсор asyncpg серверный: строки приходят пачками по STATEMENT_FETCH_SIZE,
+    # соединение держится, пока ответ не отправлен
+    @metrics.timed_db("open_statement")
+    async def open_statement(self, from_time, to_time):
+        return self._iter_statement(from_time, to_time)
+
+    async def _iter_statement(self, from_time, to_time):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                cursor = conn.cursor(STATEMENT_SQL, from_time, to_time, prefetch=order_queries.STATEMENT_FETCH_SIZE)
+                async for row in cursor:
+                    yield order_queries.OrderRow._make(row.values())
+
+    # Переход в одной транзакции: горячие секции, остальные, затем возврат из архива,
+    # если выражение остальных секций нашло заказ там (как transitions.apply_transition)
+    async def _transition_row(self, conn, transition, key, values):
+        for scope in ("hot", "cold"):
+            sql, names = transition_sql(transition, scope)
+            row = await fetchrow_traced(conn, sql, *[values[name] for name in names])
+            if row is not None and row[0] is not None:
+                order_queries.count_lookup(scope)
+                return row
+        if row is None:
+            order_queries.count_lookup("missing")
+            return None
+        await conn.execute(RESTORE_SQL[transition.key_column], key)
+        order_queries.count_lookup("archive")
+        for scope in ("cold", "hot"):
+            sql, names = transition_sql(transition, scope)
+            row = await fetchrow_traced(conn, sql, *[values[name] for name in names])
+            if row is not None:
+                return row
+        return None
+
+    @metrics.timed_db("apply_transition")
+    async def apply_transition(self, transition, key, params, notify=False):
+        values = dict(params, key=key, from_states=list(transition.from_states))
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                row = await self._transition_row(conn, transition, key, values)
+                if row is None:
+                    return False, None
+                applied = row[0]
+                order = order_queries.OrderRow._make(tuple(row.values())[1:])
+                if applied and notify:
+                    notifications = outbox.notification_rows(order, GROUP_CHAT_ID)
+                    if notifications:
+                        await conn.executemany(ENQUEUE_SQL, notifications)
+        if applied:
+            response_cache.cache.invalidate(order.get("transaction_id"))
+            if notify:
+                self.outbox_wakeup.set()
+        return applied, order
+
+
+# Доставка outbox в асинхронном режиме: та же таблица, те же правила
+# повторов и сводок, что и у outbox.OutboxWorker, отправка через httpx.AsyncClient
+# с тем же ограничителем частоты telegram_client.RateLimiter.
+class AsyncOutboxWorker:
+    def __init__(self, pool, client, wakeup, workers=outbox.OUTBOX_WORKERS, batch_size=outbox.OUTBOX_BATCH_SIZE):
+        self.pool = pool
+        self.client = client
+        self.limiter = telegram_client.RateLimiter()
+        self.wakeup = wakeup
+        self.workers = workers
+        self.batch_size = batch_size
+
+    async def run(self):
+        await asyncio.gather(*(self._loop() for _ in range(self.workers)))
+
+    async def _loop(self):
+        while True:
+            try:
+                processed = await self.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("Outbox: ошибка обработки пакета: %s", e)
+                processed = 0
+            if processed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), outbox.OUTBOX_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+
+    async def send(self, chat_id, text):
+        with tracing.span("telegram.send", chat_id=str(chat_id)) as span:
+            return await self._send(span, chat_id, text)
+
+    async def _send(self, span, chat_id, text):
+        wait = self.limiter.reserve(chat_id)
+        if wait:
+            span.set(rate_wait_ms=round(wait * 1000, 1))
+            await asyncio.sleep(wait)
+        payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+        started = time.perf_counter()
+        try:
+            response = await self.client.post(telegram_client.telegram_url(), json=payload,
+                                              timeout=telegram_client.TELEGRAM_TIMEOUT)
+        except httpx.HTTPError as e:
+            metrics.observe_telegram_send(started, "retryable")
+            raise telegram_client.RetryableError(str(e))
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"description": response.text[:200]}
+        try:
+            result = telegram_client.check_telegram_response(response.status_code, body)
+        except telegram_client.RetryableError as e:
+            metrics.observe_telegram_send(started, "retryable")
+            if e.retry_after:
+                self.limiter.block(chat_id, e.retry_after)
+            raise
+        except telegram_client.PermanentError:
+            metrics.observe_telegram_send(started, "permanent")
+            raise
+        metrics.observe_telegram_send(started)
+        return result
+
+    async def _deliver(self, row, orders, clients):
+        try:
+            await self.send(row["chat_id"], outbox.message_for(row, orders, clients))
+            return outbox.delivery_outcome(row)
+        except Exception as e:
+            return outbox.delivery_outcome(row, e)
+
+    async def _deliver_digest(self, chat_id, parts):
+        sent = 0
+        try:
+            for text, _ in parts:
+                await self.send(chat_id, text)
+                sent += 1
+        except Exception as e:
+            return outbox.digest_outcomes(parts, sent, e)
+        return outbox.digest_outcomes(parts, sent)
+
+    # Профили клиентов – через client_cache: в БД идут только отсутствующие в кэше
+    @metrics.timed_db("clients_lookup")
+    async def _load_clients(self, conn, user_ids):
+        clients, missing = client_cache.cache.lookup(user_ids)
+        if not missing:
+            return clients
+        generation = client_cache.cache.generation
+        try:
+            rows = await conn.fetch(CLIENTS_SQL, missing)
+        except Exception as e:
+            logging.error("Outbox: ошибка чтения clients: %s", e)
+            return clients
+        loaded = {row[0]: client_cache.row_to_profile(row) for row in rows}
+        client_cache.cache.store(missing, loaded, generation)
+        clients.update(loaded)
+        return clients
+
+    # Пачка – отдельная трасса, как в outbox.OutboxWorker.process_batch
+    async def process_batch(self):
+        trace = tracing.start_trace("outbox.batch")
+        try:
+            processed = await self._process_batch()
+        except Exception:
+            tracing.finish_trace(trace, error=True)
+            raise
+        tracing.finish_trace(trace, discard=not processed, rows=processed)
+        return processed
+
+    async def _process_batch(self):
+        async with self.pool.acquire() as conn:
+            rows = [dict(r) for r in await conn.fetch(CLAIM_SQL, outbox.OUTBOX_LEASE, self.batch_size)]
+            digest_rows = [dict(r) for r in await conn.fetch(
+                CLAIM_DIGEST_SQL, outbox.OUTBOX_DIGEST_LOCK_ID, outbox.OUTBOX_LEASE, outbox.OUTBOX_DIGEST_MAX
+            )]
+            if not rows and not digest_rows:
+                return 0
+            order_ids = list({r["order_id"] for r in rows + digest_rows})
+            orders = {o["order_id"]: dict(o) for o in await conn.fetch(ORDERS_SQL, order_ids)}
+            user_ids = list({o["user_id"] for o in orders.values() if o.get("user_id") is not None})
+            clients = await self._load_clients(conn, user_ids) if user_ids else {}
+
+        digests, missing = outbox.plan_digests(digest_rows, orders, clients)
+        results = list(await asyncio.gather(*(self._deliver(row, orders, clients) for row in rows)))
+        for chat_results in await asyncio.gather(*(self._deliver_digest(*digest) for digest in digests)):
+            results.extend(chat_results)
+        for row in missing:
+            results.append(outbox.delivery_outcome(row, telegram_client.PermanentError("Заказ %s не найден" % row["order_id"])))
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for row_id, status, next_delay, error in results:
+                    if status == "sent":
+                        await conn.execute(MARK_SENT_SQL, row_id)
+                    else:
+                        await conn.execute(MARK_FAILED_SQL, status, error, float(next_delay or 0), row_id)
+        return len(rows) + len(digest_rows)
+
+
+# Отмена просроченных транзакций: те же пачки и advisory lock, что у expiry.sweep()
+async def expiry_sweep(pool, batch_size=expiry.EXPIRY_BATCH_SIZE):
+    started = time.perf_counter()
+    expired = 0
+    async with pool.acquire() as conn:
+        while True:
+            async with conn.transaction():
+                if not await conn.fetchval(EXPIRY_LOCK_SQL, expiry.EXPIRY_LOCK_ID):
+                    expiry._count("skipped_locked")
+                    break
+                params = expiry.sweep_params(batch_size=batch_size)
+                rows = await conn.fetch(EXPIRE_SQL, *[params[name] for name in EXPIRE_NAMES])
+            expired += len(rows)
+            if rows:
+                logging.info("Отменены просроченные транзакции (%s): %s", len(rows), [row[0] for row in rows])
+            if len(rows) < batch_size:
+                break
+    expiry.record_sweep(started, expired)
+    return expired
+
+
+async def expiry_loop(pool, interval=expiry.EXPIRY_SWEEP_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await expiry_sweep(pool)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            expiry._count("errors")
+            logging.error("Ошибка отмены просроченных транзакций: %s", e)
+
+
+# LISTEN через выделенное соединение asyncpg; интерфейс subscribe() как у pg_listener.Listener
+class AsyncListener:
+    def __init__(self, dsn, ssl):
+        self.dsn = dsn
+        self.ssl = ssl
+        self._handlers = {}
+
+    def subscribe(self, channel, callback, on_reset=None):
+        self._handlers.setdefault(channel, []).append((callback, on_reset))
+
+    def _reset_all(self):
+        for handlers in self._handlers.values():
+            for _, on_reset in handlers:
+                if on_reset:
+                    on_reset()
+
+    async def run(self):
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn, ssl=self.ssl)
+                for channel, handlers in self._handlers.items():
+                    for callback, _ in handlers:
+                        await conn.add_listener(channel, lambda _c, _pid, _ch, payload, cb=callback: cb(payload))
+                self._reset_all()
+                logging.info("Listener: подписка на NOTIFY активна")
+                while not conn.is_closed():
+                    await asyncio.sleep(5)
+                    await conn.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("Listener: соединение потеряно: %s", e)
+                self._reset_all()
+                await asyncio.sleep(5)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+
+
+class AsyncServer:
+    def __init__(self):
+        self.pool = None
+        self.client = None
+        self.backend = None
+        self.outbox_wakeup = None
+        self._tasks = []
+
+    async def startup(self):
+        dsn = os.getenv("DATABASE_URL")
+        ssl = db_pool.DB_SSLMODE
+        self.pool = await asyncpg.create_pool(
+            dsn, ssl=ssl,
+            min_size=db_pool.DB_POOL_MIN,
+            max_size=db_pool.DB_POOL_MAX,
+            max_inactive_connection_lifetime=db_pool.DB_POOL_MAX_LIFETIME,
+            timeout=db_pool.DB_POOL_TIMEOUT
+        )
+        version = await self.pool.fetchval("SELECT coalesce(max(version), 0) FROM schema_version")
+        if version < migrations.SCHEMA_VERSION:
+            raise migrations.SchemaVersionError(
+                f"Схема БД версии {version}, требуется {migrations.SCHEMA_VERSION}. Выполните: python migrations.py upgrade"
+            )
+        logging.info("Версия схемы БД: %s", version)
+
+        limits = httpx.Limits(max_keepalive_connections=outbox.OUTBOX_WORKERS, max_connections=outbox.OUTBOX_WORKERS * 2)
+        self.client = httpx.AsyncClient(limits=limits, timeout=telegram_client.TELEGRAM_TIMEOUT)
+        self.outbox_wakeup = asyncio.Event()
+        self.backend = AsyncpgBackend(self.pool, self.outbox_wakeup)
+
+        await self.reload_catalog()
+        listener = AsyncListener(dsn, ssl)
+        response_cache.subscribe(listener)
+        client_cache.subscribe(listener)
+        product_catalog.subscribe(listener, lambda: asyncio.ensure_future(self.reload_catalog()))
+        worker = AsyncOutboxWorker(self.pool, self.client, self.outbox_wakeup)
+        self._tasks = [asyncio.create_task(listener.run()), asyncio.create_task(worker.run())]
+        if expiry.EXPIRY_SWEEP_INTERVAL > 0:
+            self._tasks.append(asyncio.create_task(expiry_loop(self.pool)))
+        # Секции orders проверяет поток со своим соединением psycopg2, как и в server.py
+        partitions.start_keeper()
+
+    # Справочник товаров для чеков (product_catalog.py): целиком, одним запросом
+    async def reload_catalog(self):
+        try:
+            rows = await self.pool.fetch(product_catalog.PRODUCTS_SQL)
+        except Exception as e:
+            logging.error("Справочник товаров не загружен: %s", e)
+            return
+        product_catalog.catalog.replace([tuple(row.values()) for row in rows])
+        logging.info("Справочник товаров загружен: %s", len(rows))
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # Дописывает буфер аудита (поток записи со своим соединением psycopg2)
+        await asyncio.get_running_loop().run_in_executor(None, audit.shutdown)
+        if self.client is not None:
+            await self.client.aclose()
+        if self.pool is not None:
+            await self.pool.close()
+
+    # Каждый вызов – трасса (tracing.py), как callback() в server.py
+    async def handle_callback(self, body, headers):
+        trace = tracing.start_trace("callback")
+        try:
+            response = await self._handle_callback(trace, body, headers)
+        except Exception:
+            tracing.finish_trace(trace, error=True)
+            raise
+        tracing.finish_trace(trace)
+        return response
+
+    async def _handle_callback(self, trace, body, headers):
+        started = time.perf_counter()
+        try:
+            with tracing.span("json_parse", bytes=len(body)):
+                payload = rpc_codec.loads(body)
+        except Exception as e:
+            logging.error("JSON parse error: %s (%d bytes)", e, len(body))
+            response = payme_handlers.error_invalid_json()
+            rpc_log.log_call(None, response, started)
+            metrics.observe_rpc(None, response, started)
+            audit.record(None, response, started, body)
+            return response
+
+        auth_header = headers.get("authorization", "")
+        response = await payme_handlers.run_async(payme_handlers.dispatch(payload, auth_header), self.backend)
+
+        rpc_log.log_call(payload, response, started, headers)
+        metrics.observe_rpc(payload, response, started)
+        audit.record(payload, response, started)
+        trace.attrs.update(tracing.rpc_attrs(payload, response))
+        return response
+
+    # Готовность: БД отвечает, справочник товаров загружен (при необходимости –
+    # загружается здесь же). Ошибки – только в лог.
+    async def ready(self):
+        if self.pool is None:
+            return False
+        try:
+            await self.pool.fetchval("SELECT 1")
+        except Exception:
+            logging.exception("Сервер не готов")
+            return False
+        if not product_catalog.catalog.loaded:
+            await self.reload_catalog()
+        return product_catalog.catalog.loaded
+
+    async def metrics(self):
+        if metrics.order_statuses_due():
+            try:
+                metrics.set_order_statuses(await self.pool.fetch(metrics.ORDER_STATUS_SQL))
+            except Exception as e:
+                logging.error("Метрики: ошибка подсчёта заказов по статусам: %s", e)
+        metrics.set_partitions(partitions.stats())
+        return metrics.render()
+
+    def stats(self, name):
+        if name == "db":
+            return {"size": self.pool.get_size(), "idle": self.pool.get_idle_size(), "size_max": self.pool.get_max_size()}
+        if name == "outbox":
+            return outbox.stats()
+        if name == "cache":
+            return response_cache.cache.stats()
+        if name == "clients":
+            return client_cache.cache.stats()
+        if name == "payment":
+            return payment_page.stats()
+        if name == "orders":
+            return order_queries.lookup_stats()
+        if name == "expiry":
+            return expiry.stats()
+        if name == "partitions":
+            return partitions.stats()
+        if name == "catalog":
+            return product_catalog.catalog.stats()
+        if name == "audit":
+            return audit.stats()
+        if name == "tracing":
+            return tracing.stats()
+        return None
+
+
+server = AsyncServer()
+
+
+async def _send(send, status, body, content_type, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())] + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+# Тело кусками (Transfer-Encoding: chunked – без content-length). Ошибка посреди
+# потока обрывает соединение, чтобы клиент не принял неполный JSON за ответ.
+async def _send_stream(send, chunks, content_type):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+    try:
+        async for chunk in chunks:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        await chunks.aclose()
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _send_json(send, data, status=200):
+    await _send(send, status, json.dumps(data).encode(), b"application/json")
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await server.startup()
+            except Exception as e:
+                logging.error("Ошибка запуска: %s", e)
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await server.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    if path == "/callback" and method == "POST":
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        response = await server.handle_callback(await _read_body(receive), headers)
+        if isinstance(response, rpc_codec.StreamedResponse):
+            await _send_stream(send, rpc_codec.aiter_encoded(response), b"application/json")
+        else:
+            await _send(send, 200, rpc_codec.encode_response(response), b"application/json")
+    elif path == "/payment" and method == "GET":
+        query = urllib.parse.parse_qs(scope.get("query_string", b"").decode(), keep_blank_values=True)
+        args = {key: values[0] for key, values in query.items()}
+        headers = dict(scope["headers"])
+        status, page_headers, body = payment_page.respond(
+            args,
+            headers.get(b"if-none-match", b"").decode("latin-1"),
+            headers.get(b"accept-encoding", b"").decode("latin-1"),
+        )
+        extra = [(k.lower().encode(), v.encode("latin-1")) for k, v in page_headers if k != "Content-Type"]
+        await _send(send, status, body, b"text/html; charset=utf-8", extra)
+    elif path == "/ready" and method == "GET":
+        if await server.ready():
+            await _send_json(send, {"ready": True, "partitions_missing": partitions.stats()["missing_count"]})
+        else:
+            await _send_json(send, {"ready": False}, 503)
+    elif path == "/metrics" and method == "GET":
+        body, content_type = await server.metrics()
+        await _send(send, 200, body, content_type.encode())
+    elif path.startswith("/stats/") and method == "GET":
+        stats = server.stats(path[len("/stats/"):])
+        if stats is None:
+            await _send(send, 404, b"Not Found", b"text/plain")
+        else:
+            await _send_json(send, stats)
+    else:
+        await _send(send, 404, b"Not Found", b"text/plain")
@@ -0,0 +1,466 @@
+import io
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import argparse
+import datetime
+import threading
+from collections import deque
+import psycopg2
+from dotenv import load_dotenv
+import partitions
+import rpc_log
+import tracing
+
+# Журнал аудита вызовов PayMe для разбора споров: каждый запрос /callback и
+# ответ на него (время, метод, транзакция, заказ, код, задержка, trace_id).
+#
+# Запись не добавляет запросов к БД на горячем пути: record() только кладёт
+# запись в буфер процесса (не больше AUDIT_BUFFER_SIZE, лишние считаются в
+# dropped), фоновый поток раз в AUDIT_FLUSH_INTERVAL секунд или при
+# накоплении AUDIT_BATCH_SIZE записей пишет пачку одним COPY по своему
+# соединению. Ошибка записи – пачка остаётся в буфере до следующей попытки.
+# Пачку, которую COPY отверг из-за данных (DataError, IntegrityError), поток
+# пишет по одной записи: отклонённые БД записи отбрасываются и считаются в
+# rejected, чтобы одна плохая запись не блокировала журнал. NUL (\x00 в теле
+# и \u0000 в JSON) не принимают ни text, ни jsonb – он заменяется на U+FFFD.
+# При завершении процесса буфер дописывается (atexit, worker_exit gunicorn).
+#
+# payme_audit – только для добавления (триггер запрещает UPDATE и DELETE),
+# секционирована по месяцам ts: payme_audit_pYYYYMM создаются заранее на
+# AUDIT_PARTITIONS_AHEAD месяцев (миграция 11, python audit.py ensure на
+# release и сам поток записи при смене месяца). Старые секции удаляются
+# только вручную (DROP TABLE), если срок хранения истёк.
+#
+# История транзакции: python audit.py history --transaction <id>
+# (вместе с вызовами по её заказу до CreateTransaction) или --order <order_id>.
+
+AUDIT_LOG = os.getenv("AUDIT_LOG", "on")  # on | off
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "1000"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1"))  # сек.
+AUDIT_PARTITIONS_AHEAD = int(os.getenv("AUDIT_PARTITIONS_AHEAD", "2"))  # месяцев вперёд
+
+AUDIT_TABLE = "payme_audit"
+COLUMNS = (
+    "ts", "method", "rpc_id", "transaction_id", "merchant_trans_id", "code",
+    "latency_ms", "trace_id", "pid", "request", "response",
+)
+COPY_SQL = f"COPY {AUDIT_TABLE} ({', '.join(COLUMNS)}) FROM STDIN"
+
+AUDIT_DDL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {AUDIT_TABLE} (
+        ts TIMESTAMPTZ NOT NULL,
+        method TEXT,
+        rpc_id TEXT,
+        transaction_id TEXT,
+        merchant_trans_id TEXT,
+        code INTEGER,
+        latency_ms REAL,
+        trace_id TEXT,
+        pid INTEGER,
+        request JSONB,
+        response JSONB
+    ) PARTITION BY RANGE (ts);
+    """,
+    f"CREATE INDEX IF NOT EXISTS {AUDIT_TABLE}_transaction_id_idx ON {AUDIT_TABLE} (transaction_id, ts) "
+    "WHERE transaction_id IS NOT NULL",
+    f"CREATE INDEX IF NOT EXISTS {AUDIT_TABLE}_merchant_trans_id_idx ON {AUDIT_TABLE} (merchant_trans_id, ts) "
+    "WHERE merchant_trans_id IS NOT NULL",
+    """
+    CREATE OR REPLACE FUNCTION payme_audit_append_only() RETURNS trigger AS $$
+    BEGIN
+        RAISE EXCEPTION 'payme_audit: только добавление, % запрещён', TG_OP;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+    f"DROP TRIGGER IF EXISTS {AUDIT_TABLE}_append_only ON {AUDIT_TABLE};",
+    f"""
+    CREATE TRIGGER {AUDIT_TABLE}_append_only
+        BEFORE UPDATE OR DELETE ON {AUDIT_TABLE}
+        FOR EACH ROW
+        EXECUTE FUNCTION payme_audit_append_only();
+    """,
+    f"DROP TRIGGER IF EXISTS {AUDIT_TABLE}_no_truncate ON {AUDIT_TABLE};",
+    f"""
+    CREATE TRIGGER {AUDIT_TABLE}_no_truncate
+        BEFORE TRUNCATE ON {AUDIT_TABLE}
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION payme_audit_append_only();
+    """,
+]
+
+_stats_lock = threading.Lock()
+_stats = {"recorded": 0, "written": 0, "dropped": 0, "rejected": 0, "flushes": 0, "errors": 0, "last_flush_ms": 0.0}
+
+# Ошибки COPY, вызванные содержимым записи, а не соединением
+REJECTED_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError, ValueError)
+NUL_REPLACEMENT = "\ufffd"
+
+
+def _count(key, value=1):
+    with _stats_lock:
+        _stats[key] += value
+
+
+def enabled():
+    return AUDIT_LOG == "on"
+
+
+# --- Секции ---
+
+def _month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+# Секции текущего месяца (UTC) и months_ahead следующих; идемпотентна, коммит – за вызывающим
+def ensure_partitions(cur, months_ahead=AUDIT_PARTITIONS_AHEAD, now=None):
+    month = _month_start(now or datetime.datetime.now(datetime.timezone.utc))
+    for offset in range(months_ahead + 1):
+        start = partitions.add_months(month, offset)
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS {AUDIT_TABLE}_p{start:%Y%m} PARTITION OF {AUDIT_TABLE} "
+            "FOR VALUES FROM (%s) TO (%s)",
+            (start, partitions.add_months(start, 1))
+        )
+
+
+# --- Запись ---
+
+# Запись аудита – кортеж в порядке COLUMNS; JSON сериализуется в потоке записи.
+# payload может быть None (тело не разобралось) – тогда сохраняется raw.
+def make_entry(payload, response, started, raw=None):
+    if isinstance(payload, dict):
+        params = payload.get("params")
+        params = params if isinstance(params, dict) else {}
+        account = params.get("account")
+        account = account if isinstance(account, dict) else {}
+        request = rpc_log.redact_payload(payload)
+    else:
+        params, account = {}, {}
+        payload = {}
+        request = {"raw": raw.decode("utf-8", "replace") if isinstance(raw, bytes) else raw}
+    if hasattr(response, "rows"):
+        # Выписка GetStatement отдаётся потоком – в аудит идёт только конверт
+        response = {"id": response.get("id"), "result": {response.key: "streamed"}, "error": None}
+    return (
+        time.time(),
+        payload.get("method"),
+        _text(payload.get("id")),
+        _text(params.get("id")),
+        _text(account.get("order_id")),
+        rpc_log.result_code(response),
+        round((time.perf_counter() - started) * 1000, 3),
+        tracing.current_id(),
+        os.getpid(),
+        request,
+        response,
+    )
+
+
+def _text(value):
+    return str(value) if value is not None else None
+
+
+# Строки запроса и ответа без NUL: jsonb не принимает \u0000
+def _strip_nul(value):
+    if isinstance(value, str):
+        return value.replace("\x00", NUL_REPLACEMENT) if "\x00" in value else value
+    if isinstance(value, dict):
+        return {_strip_nul(key): _strip_nul(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_strip_nul(item) for item in value]
+    return value
+
+
+# Поле COPY в текстовом формате: NULL – \N, служебные символы экранируются, NUL заменяется
+def _copy_field(value):
+    if value is None:
+        return "\\N"
+    return str(value).replace("\x00", NUL_REPLACEMENT).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy_line(entry):
+    ts, *fields, request, response = entry
+    values = [datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat()] + fields + [
+        json.dumps(_strip_nul(request), ensure_ascii=False, default=str),
+        json.dumps(_strip_nul(response), ensure_ascii=False, default=str),
+    ]
+    return "\t".join(_copy_field(value) for value in values) + "\n"
+
+
+def copy_entries(cur, entries):
+    buffer = io.StringIO("".join(_copy_line(entry) for entry in entries))
+    cur.copy_expert(COPY_SQL, buffer)
+
+
+# Пачка, которую COPY не принял: по одной записи под точкой сохранения,
+# отклонённые БД записи отбрасываются. Возвращает число записанных.
+def copy_rows(cur, entries):
+    written = 0
+    for entry in entries:
+        cur.execute("SAVEPOINT audit_row")
+        try:
+            copy_entries(cur, [entry])
+        except REJECTED_ERRORS as e:
+            cur.execute("ROLLBACK TO SAVEPOINT audit_row")
+            _count("rejected")
+            logging.error("Аудит: запись %s (транзакция %s) отклонена: %s", entry[1], entry[3], e)
+            continue
+        cur.execute("RELEASE SAVEPOINT audit_row")
+        written += 1
+    return written
+
+
+class AuditWriter:
+    def __init__(self, dsn=None, sslmode=None, buffer_size=AUDIT_BUFFER_SIZE,
+                 batch_size=AUDIT_BATCH_SIZE, flush_interval=AUDIT_FLUSH_INTERVAL):
+        self.dsn = dsn or os.getenv("DATABASE_URL")
+        self.sslmode = sslmode or os.getenv("DB_SSLMODE", "require")
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._conn = None
+        self._partitions_month = None
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, entry):
+        with self._cond:
+            if len(self._buffer) >= self.buffer_size:
+                _count("dropped")
+                return
+            self._buffer.append(entry)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+        _count("recorded")
+
+    def _take(self):
+        with self._cond:
+            count = min(len(self._buffer), self.batch_size)
+            return [self._buffer.popleft() for _ in range(count)]
+
+    # Неудавшаяся пачка возвращается в начало буфера, если в нём есть место
+    def _restore(self, batch):
+        with self._cond:
+            room = max(0, self.buffer_size - len(self._buffer))
+            if room < len(batch):
+                _count("dropped", len(batch) - room)
+            self._buffer.extendleft(reversed(batch[:room]))
+
+    # После ошибки записи следующая попытка – не раньше чем через flush_interval
+    def _run(self):
+        failed = False
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopping or (not failed and len(self._buffer) >= self.batch_size),
+                    self.flush_interval
+                )
+                stopping = self._stopping
+            failed = False
+            while True:
+                batch = self._take()
+                if not batch:
+                    break
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    _count("errors")
+                    logging.error("Аудит: ошибка записи %s записей: %s", len(batch), e)
+                    self._close_conn()
+                    if stopping:
+                        _count("dropped", len(batch))
+                    else:
+                        self._restore(batch)
+                        failed = True
+                        break
+            if stopping:
+                self._close_conn()
+                return
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(self.dsn, sslmode=self.sslmode)
+            self._partitions_month = None
+        return self._conn
+
+    def _close_conn(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        conn = self._connection()
+        cur = conn.cursor()
+        try:
+            month = _month_start(datetime.datetime.now(datetime.timezone.utc))
+            if self._partitions_month != month:
+                ensure_partitions(cur)
+                conn.commit()
+                self._partitions_month = month
+            try:
+                copy_entries(cur, batch)
+                written = len(batch)
+            except REJECTED_ERRORS as e:
+                conn.rollback()
+                logging.warning("Аудит: пачка из %s записей отклонена (%s), запись по одной", len(batch), e)
+                written = copy_rows(cur, batch)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+        with _stats_lock:
+            _stats["written"] += written
+            _stats["flushes"] += 1
+            _stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    def buffered(self):
+        with self._cond:
+            return len(self._buffer)
+
+    # Дописывает буфер и останавливает поток
+    def stop(self, timeout=10):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+# Поток записи создаётся лениво в каждом процессе (после fork у воркера gunicorn его нет)
+def get_writer():
+    global _writer
+    writer = _writer
+    if writer is None or writer.pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer.pid != os.getpid():
+                _writer = AuditWriter()
+            writer = _writer
+    return writer
+
+
+def record(payload, response, started, raw=None):
+    if not enabled():
+        return
+    try:
+        entry = make_entry(payload, response, started, raw)
+    except Exception as e:
+        logging.error("Аудит: запись не сформирована: %s", e)
+        return
+    get_writer().put(entry)
+
+
+def shutdown(timeout=10):
+    if _writer is not None and _writer.pid == os.getpid():
+        _writer.stop(timeout)
+
+
+atexit.register(shutdown)
+
+
+def stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    writer = _writer
+    stats["buffered"] = writer.buffered() if writer is not None and writer.pid == os.getpid() else 0
+    stats["enabled"] = enabled()
+    return stats
+
+
+# --- Просмотр ---
+
+# Вызовы по транзакции – и по её заказу (CheckPerformTransaction до создания транзакции)
+HISTORY_BY_TRANSACTION_SQL = f"""
+SELECT {', '.join(COLUMNS)} FROM {AUDIT_TABLE}
+WHERE transaction_id = %(key)s
+   OR merchant_trans_id IN (
+       SELECT merchant_trans_id FROM {AUDIT_TABLE}
+       WHERE transaction_id = %(key)s AND merchant_trans_id IS NOT NULL
+   )
+ORDER BY ts
+LIMIT %(limit)s
+"""
+HISTORY_BY_ORDER_SQL = f"""
+SELECT {', '.join(COLUMNS)} FROM {AUDIT_TABLE}
+WHERE merchant_trans_id = %(key)s
+   OR transaction_id IN (
+       SELECT transaction_id FROM {AUDIT_TABLE}
+       WHERE merchant_trans_id = %(key)s AND transaction_id IS NOT NULL
+   )
+ORDER BY ts
+LIMIT %(limit)s
+"""
+
+
+def history(conn, transaction_id=None, merchant_trans_id=None, limit=1000):
+    sql = HISTORY_BY_TRANSACTION_SQL if transaction_id is not None else HISTORY_BY_ORDER_SQL
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, {"key": transaction_id if transaction_id is not None else merchant_trans_id, "limit": limit})
+        return [dict(zip(COLUMNS, row)) for row in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def format_row(row):
+    error = (row["response"] or {}).get("error")
+    outcome = f"ошибка {row['code']}: {error.get('message')}" if error else "ok"
+    return (f"{row['ts']:%Y-%m-%d %H:%M:%S.%f} {row['method'] or '-':<24} {outcome:<40} "
+            f"{row['latency_ms']:>8.1f} мс  trace={row['trace_id'] or '-'}\n"
+            f"    запрос:  {json.dumps(row['request'], ensure_ascii=False)}\n"
+            f"    ответ:   {json.dumps(row['response'], ensure_ascii=False)}")
+
+
+def main(argv=None):
+    load_dotenv()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Журнал аудита вызовов PayMe")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("ensure", help="создать секции payme_audit")
+    show = commands.add_parser("history", help="история вызовов по транзакции или заказу")
+    key = show.add_mutually_exclusive_group(required=True)
+    key.add_argument("--transaction", help="id транзакции PayMe")
+    key.add_argument("--order", help="merchant_trans_id заказа (account.order_id)")
+    show.add_argument("--limit", type=int, default=1000)
+    show.add_argument("--json", action="store_true", help="строка JSON на вызов")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"), sslmode=os.getenv("DB_SSLMODE", "require"))
+    try:
+        if args.command == "ensure":
+            cur = conn.cursor()
+            ensure_partitions(cur)
+            conn.commit()
+            cur.close()
+            print(f"Секции {AUDIT_TABLE}: текущий месяц и {AUDIT_PARTITIONS_AHEAD} вперёд")
+            return
+        rows = history(conn, args.transaction, args.order, args.limit)
+        for row in rows:
+            print(json.dumps(row, ensure_ascii=False, default=str) if args.json else format_row(row))
+        if not args.json:
+            print(f"Вызовов: {len(rows)}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
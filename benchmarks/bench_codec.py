@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import base64
+import timeit
+
+# Микробенчмарк пути /callback без сети и БД: разбор тела, проверка
+# авторизации и сериализация ответа-ошибки. Сравнивает прежнюю реализацию
+# (decode + json.loads, base64 на каждый запрос, новый dict ошибки, json.dumps)
+# с rpc_codec.
+#   python benchmarks/bench_codec.py [число итераций]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MERCHANT_KEY", "bench-key")
+
+import rpc_codec
+import payme_handlers
+
+MERCHANT_KEY = os.environ["MERCHANT_KEY"]
+AUTH_HEADER = "Basic " + base64.b64encode(f"Paycom:{MERCHANT_KEY}".encode()).decode()
+BODY = json.dumps({
+    "method": "CheckTransaction",
+    "params": {"id": "5305e3bab097f420a62ced0b"},
+    "id": 123456
+}).encode()
+
+
+def legacy_request():
+    payload = json.loads(BODY.decode('utf-8'))
+    expected_auth = "Basic " + base64.b64encode(f"Paycom:{MERCHANT_KEY}".encode()).decode()
+    if AUTH_HEADER.strip() != expected_auth.strip():
+        raise AssertionError
+    response = {
+        "error": {"code": -31003, "message": {"ru": "Transaction number is wrong", "uz": "Transaction number is wrong", "en": "Transaction number is wrong"}, "data": "id"},
+        "result": None,
+        "id": payload.get("id", 0)
+    }
+    return json.dumps(response, sort_keys=True).encode()
+
+
+def codec_request():
+    payload = rpc_codec.loads(BODY)
+    if not rpc_codec.auth_matches(AUTH_HEADER, payme_handlers.EXPECTED_AUTH):
+        raise AssertionError
+    return rpc_codec.encode_response(payme_handlers.error_transaction(payload))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    assert json.loads(legacy_request()) == json.loads(codec_request())
+    print(f"JSON backend: {rpc_codec.BACKEND}, итераций: {number}")
+    results = {}
+    for name, func in (("legacy", legacy_request), ("codec", codec_request)):
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        results[name] = best / number * 1e6
+        print(f"{name:>8}: {results[name]:.2f} мкс/запрос")
+    print(f" speedup: {results['legacy'] / results['codec']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import gzip
+import timeit
+
+# Микробенчмарк /payment без сети: прежний f-string (рендер на каждый запрос,
+# без экранирования) против payment_page – рендера по скомпилированному
+# шаблону, ответа из кэша и ответа 304 по If-None-Match.
+#   python benchmarks/bench_payment_page.py [число итераций]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CHECKOUT_URL", "https://checkout.paycom.uz")
+os.environ.setdefault("CALLBACK_BASE_URL", "https://example.com/done")
+
+import payment_page
+
+ARGS = {
+    "order_id": "4f1c2a8e-9b7d-4c3e-8a51-0d2f6b9e7c10",
+    "amount": "100000",
+    "merchant": "5e730e8e0b852a417aa49ceb",
+    "lang": "ru",
+    "description": "Оплата за Кружку",
+}
+CHECKOUT_URL = os.environ["CHECKOUT_URL"]
+CALLBACK_BASE_URL = os.environ["CALLBACK_BASE_URL"]
+
+
+def legacy_render():
+    order_id_param = ARGS.get("order_id", "")
+    amount = ARGS.get("amount", "")
+    merchant = ARGS.get("merchant", "")
+    callback = ARGS.get("callback", "")
+    lang = ARGS.get("lang", "ru")
+    description = ARGS.get("description", "Оплата заказа")
+    signature = ARGS.get("signature", "")
+    if not callback or callback.lower() == "none":
+        callback = CALLBACK_BASE_URL if CALLBACK_BASE_URL else ""
+    html_form = f"""<!DOCTYPE html>
+<html lang="ru">
+<head>
+    <meta charset="UTF-8">
+    <title>Оплата за заказ</title>
+    <script>
+      document.addEventListener("DOMContentLoaded", function() {{
+         setTimeout(function() {{
+            document.forms[0].submit();
+         }}, 100);
+      }});
+    </script>
+</head>
+<body>
+    <h1>Оплата за заказ</h1>
+    <form action="{CHECKOUT_URL}" method="POST">
+        <input type="hidden" name="account[order_id]" value="{order_id_param}">
+        <input type="hidden" name="amount" value="{amount}">
+        <input type="hidden" name="merchant" value="{merchant}">
+        <input type="hidden" name="callback" value="{callback}">
+        <input type="hidden" name="lang" value="{lang}">
+        <input type="hidden" name="description" value="{description}">
+        <input type="hidden" name="signature" value="{signature}">
+        <button type="submit" style="display:none;">Оплатить</button>
+    </form>
+    <p>Order ID (merchant_trans_id): {order_id_param}</p>
+</body>
+</html>"""
+    return html_form.encode("utf-8")
+
+
+def legacy_gzip():
+    return gzip.compress(legacy_render(), 6)
+
+
+def compiled_render():
+    return payment_page.render_payment_form(ARGS).encode("utf-8")
+
+
+def cached_response():
+    return payment_page.respond(ARGS, None, "gzip, deflate, br")
+
+
+def not_modified():
+    return payment_page.respond(ARGS, ETAG, "gzip, deflate, br")
+
+
+ETAG = payment_page.get_page(ARGS).etag
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    assert legacy_render() == compiled_render()
+    assert not_modified()[0] == 304
+    page = payment_page.get_page(ARGS)
+    print(f"итераций: {number}; страница {len(page.body)} байт, gzip {len(page.gzip_body)} байт")
+    results = {}
+    for name, func in (("legacy", legacy_render), ("legacy+gz", legacy_gzip), ("compiled", compiled_render),
+                       ("cached", cached_response), ("304", not_modified)):
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        results[name] = best / number * 1e6
+        print(f"{name:>10}: {results[name]:.2f} мкс/запрос")
+    print(f"   speedup: {results['legacy+gz'] / results['cached']:.2f}x (cached vs legacy+gzip)")
+
+
+if __name__ == "__main__":
+    main()
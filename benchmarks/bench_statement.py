@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+
+# Бенчмарк GetStatement на синтетических заказах (по умолчанию 1M): потоковая
+# выдача (именованный курсор + rpc_codec.iter_encoded, как в /callback) против
+# прежнего подхода «fetchall + json.dumps всего списка». Печатает время, размер
+# ответа и пиковую память процесса (ru_maxrss) после каждого прогона; потоковый
+# прогон идёт первым, чтобы пик загрузки целиком не маскировал его.
+#
+# Нужны DATABASE_URL и применённые миграции (индекс orders_create_time_idx).
+# Строки бенчмарка живут в отдельном диапазоне create_time и удаляются в конце
+# (если не указан --keep).
+#   python benchmarks/bench_statement.py --orders 1000000
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import psycopg2
+import rpc_codec
+import order_queries
+import payme_handlers
+
+BASE_TIME = 946684800000  # 2000-01-01 в мс: заведомо раньше настоящих транзакций
+PREFIX = "bench-statement-"
+
+SEED_SQL = f"""
+INSERT INTO orders (user_id, merchant_trans_id, product, quantity, status, payment_amount,
+                    payme_amount, payment_system, create_time, perform_time, transaction_id)
+SELECT 1, '{PREFIX}' || i, 'bench', 1,
+       CASE WHEN i %% 10 = 0 THEN 'refunded' ELSE 'completed' END,
+       1000, 100000, 'payme', {BASE_TIME} + i, {BASE_TIME} + i + 1000, '{PREFIX}' || i
+FROM generate_series(1, %s) AS i
+"""
+CLEANUP_SQL = "DELETE FROM orders WHERE transaction_id LIKE %s"
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def connect():
+    return psycopg2.connect(os.getenv("DATABASE_URL"), sslmode=os.getenv("DB_SSLMODE", "require"))
+
+
+def seed(conn, count):
+    cur = conn.cursor()
+    cur.execute(CLEANUP_SQL, (PREFIX + "%",))
+    started = time.perf_counter()
+    cur.execute(SEED_SQL, (count,))
+    conn.commit()
+    cur.execute("ANALYZE orders")
+    conn.commit()
+    cur.close()
+    print(f"Создано заказов: {count} за {time.perf_counter() - started:.1f} сек.")
+
+
+def streamed(conn, from_time, to_time):
+    cur = conn.cursor(name="bench_statement")
+    cur.itersize = order_queries.STATEMENT_FETCH_SIZE
+    cur.execute(order_queries.STATEMENT_SQL, {"from": from_time, "to": to_time})
+    rows = (order_queries.OrderRow._make(row) for row in cur)
+    response = rpc_codec.StreamedResponse(1, "transactions", rows, payme_handlers.statement_transaction)
+    size = sum(len(chunk) for chunk in rpc_codec.iter_encoded(response))
+    cur.close()
+    conn.rollback()
+    return size
+
+
+def legacy(conn, from_time, to_time):
+    cur = conn.cursor()
+    cur.execute(order_queries.STATEMENT_SQL, {"from": from_time, "to": to_time})
+    rows = cur.fetchall()
+    cur.close()
+    conn.rollback()
+    transactions = [payme_handlers.statement_transaction(order_queries.OrderRow._make(row)) for row in rows]
+    return len(json.dumps({"result": {"transactions": transactions}, "error": None, "id": 1}).encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк GetStatement")
+    parser.add_argument("--orders", type=int, default=1000000)
+    parser.add_argument("--skip-seed", action="store_true", help="использовать уже созданные строки")
+    parser.add_argument("--keep", action="store_true", help="не удалять строки после прогона")
+    parser.add_argument("--no-legacy", action="store_true", help="только потоковый прогон")
+    args = parser.parse_args()
+
+    conn = connect()
+    if not args.skip_seed:
+        seed(conn, args.orders)
+    from_time, to_time = BASE_TIME, BASE_TIME + args.orders
+
+    runs = [("streamed", streamed)] + ([] if args.no_legacy else [("legacy", legacy)])
+    try:
+        for name, func in runs:
+            started = time.perf_counter()
+            size = func(conn, from_time, to_time)
+            elapsed = time.perf_counter() - started
+            print(f"{name:>9}: {elapsed:.2f} сек., ответ {size / 1e6:.1f} МБ, "
+                  f"{args.orders / elapsed:.0f} строк/сек., пик памяти процесса {max_rss_mb():.0f} МБ")
+    finally:
+        if not args.keep:
+            cur = conn.cursor()
+            cur.execute(CLEANUP_SQL, (PREFIX + "%",))
+            conn.commit()
+            cur.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import time
+import math
+import uuid
+import itertools
+import base64
+import random
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# Нагрузочный прогон полного жизненного цикла PayMe против сервера:
+#   CheckPerformTransaction -> CreateTransaction -> PerformTransaction
+#   -> CheckTransaction -> CancelTransaction (для доли заказов)
+# с параллельными заказами и повторными (дублирующими) вызовами, как это
+# делает PayMe. Итог – p50/p95/p99 и RPS по методам, сохраняется в JSON
+# для сравнения прогонов (--compare).
+#
+# Заказы создаются прямо в БД (DATABASE_URL). Сервер либо уже запущен
+# (--url), либо поднимается в этом процессе (--serve) вместе с заглушкой
+# Telegram (telegram_stub.py).
+#
+# --memory – без БД: сервер в этом процессе с ORDER_REPOSITORY=memory, заказы
+# кладутся в его MemoryRepository (order_repository.py). С --direct обработчики
+# вызываются напрямую (payme_handlers.dispatch), без HTTP и Flask – чистая
+# стоимость обработчиков.
+#
+#   python benchmarks/payme_load.py --serve --orders 500 --concurrency 16
+#   python benchmarks/payme_load.py --memory --direct --orders 20000 --concurrency 4
+#   python benchmarks/payme_load.py --url http://127.0.0.1:5000 --compare benchmarks/results/prev.json
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from telegram_stub import TelegramStub
+
+METHODS = ["CheckPerformTransaction", "CreateTransaction", "PerformTransaction", "CheckTransaction", "CancelTransaction"]
+AMOUNT = 100000  # тийины
+BENCH_MERCHANT_KEY = "bench-merchant-key"  # для --memory без MERCHANT_KEY
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, method, seconds, response):
+        with self._lock:
+            self.latencies[method].append(seconds)
+            if response.get("error"):
+                self.errors[method] += 1
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class PaymeClient:
+    def __init__(self, url, merchant_key, recorder):
+        self.url = url.rstrip("/") + "/callback"
+        self.headers = {
+            "Authorization": "Basic " + base64.b64encode(f"Paycom:{merchant_key}".encode()).decode(),
+            "Content-Type": "application/json",
+        }
+        self.recorder = recorder
+        self.local = threading.local()
+        self.rpc_ids = itertools.count(1)
+
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        return session
+
+    def call(self, method, params):
+        body = json.dumps({"id": next(self.rpc_ids), "method": method, "params": params})
+        started = time.perf_counter()
+        response = self.session().post(self.url, data=body, headers=self.headers, timeout=30).json()
+        self.recorder.add(method, time.perf_counter() - started, response)
+        return response
+
+
+# Жизненный цикл одного заказа. retry_ratio – доля вызовов, которые повторяются
+# с теми же параметрами (дубликаты PayMe), cancel_ratio – доля возвратов.
+def run_order(client, merchant_trans_id, retry_ratio, cancel_ratio):
+    transaction_id = uuid.uuid4().hex[:24]
+    now = int(time.time() * 1000)
+    account = {"order_id": merchant_trans_id}
+
+    def call(method, params):
+        response = client.call(method, params)
+        if random.random() < retry_ratio:
+            response = client.call(method, params)
+        return response
+
+    call("CheckPerformTransaction", {"amount": AMOUNT, "account": account})
+    created = call("CreateTransaction", {"id": transaction_id, "time": now, "amount": AMOUNT, "account": account})
+    if created.get("error"):
+        return False
+    call("PerformTransaction", {"id": transaction_id})
+    call("CheckTransaction", {"id": transaction_id})
+    if random.random() < cancel_ratio:
+        call("CancelTransaction", {"id": transaction_id, "reason": 5})
+        call("CheckTransaction", {"id": transaction_id})
+    return True
+
+
+# Вызовы в обработчики этого процесса, минуя HTTP (--memory --direct)
+class DirectClient:
+    def __init__(self, backend, merchant_key, recorder):
+        import payme_handlers
+        self.handlers = payme_handlers
+        self.backend = backend
+        self.auth_header = "Basic " + base64.b64encode(f"Paycom:{merchant_key}".encode()).decode()
+        self.recorder = recorder
+        self.rpc_ids = itertools.count(1)
+
+    def call(self, method, params):
+        payload = {"id": next(self.rpc_ids), "method": method, "params": params}
+        started = time.perf_counter()
+        response = self.handlers.run_sync(self.handlers.dispatch(payload, self.auth_header), self.backend)
+        self.recorder.add(method, time.perf_counter() - started, response)
+        return response
+
+
+def seed_orders(count, user_id):
+    import psycopg2
+    import psycopg2.extras
+    merchant_trans_ids = [str(uuid.uuid4()) for _ in range(count)]
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"), sslmode=os.getenv("DB_SSLMODE", "require"))
+    cur = conn.cursor()
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO orders (user_id, merchant_trans_id, product, quantity, status, "
+        "payment_amount, payme_amount, payment_system) VALUES %s",
+        [(user_id, m, "bench", 1, "pending", AMOUNT // 100, AMOUNT, "payme") for m in merchant_trans_ids],
+        page_size=1000
+    )
+    conn.commit()
+    cur.close()
+    conn.close()
+    return merchant_trans_ids
+
+
+# Заказы в хранилище в памяти; справочник товаров без БД – одна запись для "bench"
+def seed_memory_orders(repository, count, user_id):
+    import product_catalog
+    product_catalog.catalog.replace([("bench", "bench", "06912001036000000", "1184747", 796, 12)])
+    merchant_trans_ids = [str(uuid.uuid4()) for _ in range(count)]
+    repository.add_client(user_id, name="bench", username="bench")
+    for m in merchant_trans_ids:
+        repository.add_order(user_id=user_id, merchant_trans_id=m, product="bench", quantity=1,
+                             payment_amount=AMOUNT // 100, payme_amount=AMOUNT)
+    return merchant_trans_ids
+
+
+# Заказы в памяти процесса вместо БД; до импорта server (он выбирает хранилище при импорте)
+def use_memory_repository():
+    os.environ["ORDER_REPOSITORY"] = "memory"
+    import server
+    server.create_app()
+    return server.backend
+
+
+# Поднимает Flask-приложение в этом процессе (нужны DATABASE_URL и применённые
+# миграции, либо use_memory_repository() перед вызовом)
+def serve_in_process(telegram_url):
+    from werkzeug.serving import make_server
+    os.environ["TELEGRAM_API_URL"] = telegram_url
+    import server
+    app = server.create_app()
+    server.start_background()
+    httpd = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, name="bench-server", daemon=True).start()
+    return f"http://127.0.0.1:{httpd.server_port}", httpd
+
+
+def summarize(recorder, wall_seconds):
+    summary = {}
+    for method in METHODS:
+        values = sorted(recorder.latencies.get(method, []))
+        if not values:
+            continue
+        summary[method] = {
+            "count": len(values),
+            "errors": recorder.errors.get(method, 0),
+            "rps": round(len(values) / wall_seconds, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    return summary
+
+
+def print_summary(summary, baseline=None):
+    print(f"{'method':<24}{'count':>8}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for method, row in summary.items():
+        line = (f"{method:<24}{row['count']:>8}{row['errors']:>8}{row['rps']:>10.1f}"
+                f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}")
+        old = (baseline or {}).get(method)
+        if old and old.get("p95_ms"):
+            delta = (row["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+            line += f"   p95 {delta:+.1f}% vs baseline"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон жизненного цикла PayMe")
+    parser.add_argument("--url", help="адрес запущенного сервера")
+    parser.add_argument("--serve", action="store_true", help="поднять Flask-сервер в этом процессе")
+    parser.add_argument("--memory", action="store_true", help="заказы в памяти процесса, без БД (вместе с --serve)")
+    parser.add_argument("--direct", action="store_true", help="с --memory: вызывать обработчики без HTTP")
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--retry-ratio", type=float, default=0.3, help="доля дублирующих вызовов")
+    parser.add_argument("--cancel-ratio", type=float, default=0.2, help="доля заказов с возвратом")
+    parser.add_argument("--user-id", type=int, default=1, help="user_id заказов (получатель уведомлений)")
+    parser.add_argument("--telegram-delay", type=float, default=0.05, help="задержка заглушки Telegram, сек.")
+    parser.add_argument("--output", help="JSON с результатами (по умолчанию benchmarks/results/<время>.json)")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    if args.direct and not args.memory:
+        parser.error("--direct работает только с --memory")
+    # Сервер этого процесса (--memory) читает MERCHANT_KEY при импорте payme_handlers:
+    # без него ключ задаётся здесь, до импорта, – один и тот же для сервера и клиента.
+    # Для внешнего сервера ключ должен совпадать с его MERCHANT_KEY.
+    if not os.getenv("MERCHANT_KEY"):
+        if not args.memory:
+            parser.error("MERCHANT_KEY не задан: нужен ключ кассы, с которым запущен сервер")
+        os.environ["MERCHANT_KEY"] = BENCH_MERCHANT_KEY
+    merchant_key = os.environ["MERCHANT_KEY"]
+    repository = use_memory_repository() if args.memory else None
+
+    stub = TelegramStub(delay=args.telegram_delay).start()
+    httpd = None
+    if args.direct:
+        url = "direct"
+    elif args.serve or args.memory:
+        url, httpd = serve_in_process(stub.url)
+    elif args.url:
+        url = args.url
+        print(f"Telegram stub: {stub.url} (задайте TELEGRAM_API_URL серверу, чтобы он писал в заглушку)")
+    else:
+        parser.error("нужен --url, --serve или --memory")
+
+    if repository is not None:
+        merchant_trans_ids = seed_memory_orders(repository, args.orders, args.user_id)
+    else:
+        merchant_trans_ids = seed_orders(args.orders, args.user_id)
+    print(f"Создано заказов: {len(merchant_trans_ids)}; сервер: {url}")
+
+    recorder = Recorder()
+    if args.direct:
+        client = DirectClient(repository, merchant_key, recorder)
+    else:
+        client = PaymeClient(url, merchant_key, recorder)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        completed = sum(executor.map(
+            lambda m: run_order(client, m, args.retry_ratio, args.cancel_ratio), merchant_trans_ids
+        ))
+    wall_seconds = time.perf_counter() - started
+
+    summary = summarize(recorder, wall_seconds)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["methods"]
+    print_summary(summary, baseline)
+    total = sum(row["count"] for row in summary.values())
+    print(f"Заказов проведено: {completed}/{len(merchant_trans_ids)}, вызовов: {total}, "
+          f"{total / wall_seconds:.1f} RPS за {wall_seconds:.2f} сек., сообщений в Telegram: {stub.messages}")
+    if repository is not None:
+        print(f"Хранилище в памяти: {repository.stats()}")
+
+    output = args.output or os.path.join(BENCH_DIR, "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "url": url,
+            "config": vars(args),
+            "wall_seconds": round(wall_seconds, 3),
+            "total_rps": round(total / wall_seconds, 2),
+            "methods": summary,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены: {output}")
+
+    if httpd is not None:
+        httpd.shutdown()
+    stub.stop()
+
+
+if __name__ == "__main__":
+    main()
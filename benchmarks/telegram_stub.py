@@ -0,0 +1,75 @@
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Локальная заглушка Telegram Bot API для бенчмарков: принимает
+# POST /bot<token>/sendMessage, отвечает {"ok": true} с настраиваемой
+# задержкой и долей ответов 429. Запуск вручную:
+#   python benchmarks/telegram_stub.py --port 8081
+# и TELEGRAM_API_URL=http://127.0.0.1:8081 для сервера.
+
+
+class TelegramStub:
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, error_rate=0.0):
+        self.delay = delay
+        self.error_rate = error_rate
+        self.messages = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if stub.delay:
+                    time.sleep(stub.delay)
+                if stub.error_rate and random.random() < stub.error_rate:
+                    with stub._lock:
+                        stub.rejected += 1
+                    self._reply(429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                      "parameters": {"retry_after": 1}})
+                    return
+                with stub._lock:
+                    stub.messages += 1
+                message = json.loads(body or b"{}")
+                self._reply(200, {"ok": True, "result": {"message_id": stub.messages, "chat": {"id": message.get("chat_id")}}})
+
+            def _reply(self, status, data):
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="telegram-stub", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--delay", type=float, default=0.0, help="задержка ответа, сек.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    args = parser.parse_args()
+    stub = TelegramStub(port=args.port, delay=args.delay, error_rate=args.error_rate)
+    print(f"Telegram stub: {stub.url}")
+    stub.server.serve_forever()
@@ -0,0 +1,125 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+# Кэш профилей клиентов (имя, username, контакт) для текста уведомлений об
+# оплате: постоянные покупатели не читаются из clients на каждый платёж.
+# Кэшируется и отсутствие профиля – новый клиент появится в кэше по NOTIFY.
+#
+# Инвалидация: бот обновляет clients, триггер (миграция 7) шлёт
+# NOTIFY client_changes с user_id, подписка – через pg_listener (как у кэша
+# ответов). Пачка уведомлений загружает недостающие профили одним запросом.
+
+CLIENT_CACHE_SIZE = int(os.getenv("CLIENT_CACHE_SIZE", "5000"))
+CLIENT_CACHE_TTL = float(os.getenv("CLIENT_CACHE_TTL", "600"))  # сек.
+CLIENT_CHANGES_CHANNEL = "client_changes"
+
+CLIENTS_SQL = "SELECT user_id, name, username, contact FROM clients WHERE user_id = ANY(%s)"
+
+_MISSING = object()  # профиль не найден в clients
+
+
+class ClientCache:
+    def __init__(self, maxsize=CLIENT_CACHE_SIZE, ttl=CLIENT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # user_id -> (expires_at, профиль или _MISSING)
+        self._lock = threading.Lock()
+        # Растёт при каждой инвалидации: профили, прочитанные до неё, не сохраняются
+        self.generation = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0, "prefetched": 0}
+
+    # Возвращает (найденные профили {user_id: профиль}, user_id, которых нет в кэше)
+    def lookup(self, user_ids):
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._data.get(user_id)
+                if entry is not None and entry[0] < now:
+                    del self._data[user_id]
+                    self._stats["expired"] += 1
+                    entry = None
+                if entry is None:
+                    self._stats["misses"] += 1
+                    missing.append(user_id)
+                    continue
+                self._data.move_to_end(user_id)
+                self._stats["hits"] += 1
+                if entry[1] is not _MISSING:
+                    found[user_id] = entry[1]
+        return found, missing
+
+    # Сохраняет результат загрузки requested: отсутствующие в clients – как _MISSING
+    def store(self, requested, clients, generation=None):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            for user_id in requested:
+                self._data[user_id] = (expires_at, clients.get(user_id, _MISSING))
+                self._data.move_to_end(user_id)
+            self._stats["prefetched"] += len(requested)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self.generation += 1
+            if self._data.pop(user_id, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._data)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+cache = ClientCache()
+
+
+def row_to_profile(row):
+    return {"user_id": row[0], "name": row[1], "username": row[2], "contact": row[3]}
+
+
+# Профили для пачки уведомлений: из кэша, недостающие – одним запросом к clients
+def get_clients(conn, user_ids):
+    clients, missing = cache.lookup(user_ids)
+    if not missing:
+        return clients
+    generation = cache.generation
+    cur = conn.cursor()
+    try:
+        cur.execute(CLIENTS_SQL, (missing,))
+        loaded = {row[0]: row_to_profile(row) for row in cur.fetchall()}
+    finally:
+        cur.close()
+    cache.store(missing, loaded, generation)
+    clients.update(loaded)
+    return clients
+
+
+# Обработчик NOTIFY client_changes: payload – user_id изменённого клиента
+def on_client_change(payload):
+    try:
+        user_id = int(payload)
+    except ValueError:
+        logging.warning("Кэш клиентов: некорректное уведомление %r", payload)
+        cache.clear()
+        return
+    cache.invalidate(user_id)
+
+
+def subscribe(listener):
+    listener.subscribe(CLIENT_CHANGES_CHANNEL, on_client_change, on_reset=cache.clear)
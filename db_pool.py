@@ -0,0 +1,182 @@
+import os
+import time
+import logging
+import threading
+import psycopg2
+import psycopg2.extensions
+
+# Пул соединений с PostgreSQL (один на процесс gunicorn-воркера).
+# Соединение выдаётся на время одного Flask-запроса и возвращается в пул
+# в teardown, поэтому все хелперы запроса работают через одно соединение.
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))  # сек. ожидания свободного соединения
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # сек. жизни соединения
+DB_POOL_HEALTH_CHECK_IDLE = float(os.getenv("DB_POOL_HEALTH_CHECK_IDLE", "30"))  # проверка после простоя, сек.
+DB_SSLMODE = os.getenv("DB_SSLMODE", "require")
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, dsn, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 max_lifetime=DB_POOL_MAX_LIFETIME, health_check_idle=DB_POOL_HEALTH_CHECK_IDLE,
+                 **connect_kwargs):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_idle = health_check_idle
+        self.connect_kwargs = connect_kwargs
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = []  # стек (conn, время создания, время возврата)
+        self._born = {}  # id(conn) -> время создания для выданных соединений
+        self._stats = {
+            "acquired": 0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "broken": 0,
+            "wait_total_ms": 0.0,
+            "wait_max_ms": 0.0,
+        }
+        self._closed = False
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        with self._lock:
+            self._stats["created"] += 1
+        return conn
+
+    def _discard(self, conn, reason):
+        with self._lock:
+            self._stats[reason] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_alive(self, conn):
+        if conn.closed:
+            return False
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def prefill(self):
+        # Открываем minconn соединений заранее, чтобы первый запрос не ждал handshake
+        while True:
+            with self._lock:
+                if len(self._idle) >= self.minconn:
+                    return
+            conn = self._connect()
+            with self._lock:
+                self._idle.append((conn, time.monotonic(), time.monotonic()))
+
+    def getconn(self):
+        if self._closed:
+            raise PoolTimeout("Пул соединений закрыт")
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout("Нет свободного соединения за %.1f сек." % self.timeout)
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    conn, born = self._connect(), time.monotonic()
+                    break
+                conn, born, returned = entry
+                now = time.monotonic()
+                if now - born > self.max_lifetime:
+                    self._discard(conn, "recycled")
+                    conn = None
+                elif (conn.closed or now - returned > self.health_check_idle) and not self._is_alive(conn):
+                    self._discard(conn, "broken")
+                    conn = None
+        except Exception:
+            self._slots.release()
+            raise
+        waited_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self._born[id(conn)] = born
+            self._stats["acquired"] += 1
+            self._stats["wait_total_ms"] += waited_ms
+            self._stats["wait_max_ms"] = max(self._stats["wait_max_ms"], waited_ms)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        with self._lock:
+            born = self._born.pop(id(conn), None)
+        if born is None:
+            return
+        try:
+            if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            discard = True
+        try:
+            if discard or conn.closed or self._closed:
+                self._discard(conn, "broken")
+            elif time.monotonic() - born > self.max_lifetime:
+                self._discard(conn, "recycled")
+            else:
+                with self._lock:
+                    self._idle.append((conn, born, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = len(self._born)
+        stats["size_max"] = self.maxconn
+        stats["timeout_sec"] = self.timeout
+        stats["max_lifetime_sec"] = self.max_lifetime
+        stats["wait_avg_ms"] = round(stats["wait_total_ms"] / stats["acquired"], 3) if stats["acquired"] else 0.0
+        stats["wait_total_ms"] = round(stats["wait_total_ms"], 3)
+        stats["wait_max_ms"] = round(stats["wait_max_ms"], 3)
+        return stats
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+# Пул создаётся лениво и пересоздаётся после fork, чтобы воркеры
+# не делили между собой сокеты родительского процесса.
+def get_pool():
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(os.getenv("DATABASE_URL"), sslmode=DB_SSLMODE)
+            _pool_pid = os.getpid()
+            logging.info("Создан пул соединений: min=%s max=%s timeout=%s", DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT)
+    return _pool
@@ -0,0 +1,143 @@
+import os
+import time
+import logging
+import threading
+import db_pool
+import order_states
+
+# Отмена просроченных транзакций. По правилам PayMe транзакция в состоянии 1
+# (processing) без PerformTransaction дольше PAYME_TRANSACTION_TIMEOUT отменяется
+# с причиной 4 (тайм-аут). Без этого заказ висел бы в processing, и
+# CreateTransaction с новым id получал бы error_has_another_transaction вечно.
+#
+# Раз в EXPIRY_SWEEP_INTERVAL секунд один из воркеров (pg_try_advisory_xact_lock)
+# отменяет просроченные заказы пачками: одна выборка FOR UPDATE SKIP LOCKED и один
+# UPDATE на пачку, по частичным индексам *_created_idx секций orders (state = 1).
+# Кэш ответов сбрасывается триггером NOTIFY order_changes, как при обычной отмене.
+
+PAYME_TRANSACTION_TIMEOUT = int(os.getenv("PAYME_TRANSACTION_TIMEOUT", str(12 * 3600 * 1000)))  # мс
+EXPIRY_SWEEP_INTERVAL = float(os.getenv("EXPIRY_SWEEP_INTERVAL", "60"))  # сек.; 0 – не запускать
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "500"))
+
+CANCEL_REASON_TIMEOUT = 4
+EXPIRY_LOCK_ID = 7350003  # ключ pg_advisory_xact_lock
+
+# create_time и cancel_time – миллисекунды, как в ответах PayMe
+EXPIRE_SQL = f"""
+WITH expired AS (
+    SELECT order_id, order_time FROM orders
+    WHERE state = {order_states.CREATED} AND create_time < %(deadline)s
+    ORDER BY create_time
+    LIMIT %(limit)s
+    FOR UPDATE SKIP LOCKED
+)
+UPDATE orders o SET status = 'cancelled', cancel_time = %(now)s, cancel_reason = %(reason)s
+FROM expired e
+WHERE o.order_id = e.order_id AND o.order_time = e.order_time
+RETURNING o.transaction_id
+"""
+LOCK_SQL = "SELECT pg_try_advisory_xact_lock(%s)"
+
+_stats_lock = threading.Lock()
+_stats = {"sweeps": 0, "expired": 0, "skipped_locked": 0, "errors": 0, "last_sweep_ms": 0.0}
+
+
+def current_timestamp():
+    return int(round(time.time() * 1000))
+
+
+def sweep_params(now=None, batch_size=EXPIRY_BATCH_SIZE):
+    now = current_timestamp() if now is None else now
+    return {
+        "deadline": now - PAYME_TRANSACTION_TIMEOUT, "now": now,
+        "reason": CANCEL_REASON_TIMEOUT, "limit": batch_size,
+    }
+
+
+def _count(key, value=1):
+    with _stats_lock:
+        _stats[key] += value
+
+
+# Один проход: пачки по batch_size, каждая в своей транзакции под advisory lock.
+# Если блокировку держит другой процесс – проход пропускается. Возвращает число
+# отменённых заказов.
+def sweep(conn, batch_size=EXPIRY_BATCH_SIZE):
+    started = time.perf_counter()
+    expired = 0
+    cur = conn.cursor()
+    try:
+        while True:
+            cur.execute(LOCK_SQL, (EXPIRY_LOCK_ID,))
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                _count("skipped_locked")
+                break
+            cur.execute(EXPIRE_SQL, sweep_params(batch_size=batch_size))
+            transaction_ids = [row[0] for row in cur.fetchall()]
+            conn.commit()
+            expired += len(transaction_ids)
+            if transaction_ids:
+                logging.info("Отменены просроченные транзакции (%s): %s", len(transaction_ids), transaction_ids)
+            if len(transaction_ids) < batch_size:
+                break
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    record_sweep(started, expired)
+    return expired
+
+
+def record_sweep(started, expired):
+    with _stats_lock:
+        _stats["sweeps"] += 1
+        _stats["expired"] += expired
+        _stats["last_sweep_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+class ExpirySweeper:
+    def __init__(self, interval=EXPIRY_SWEEP_INTERVAL, batch_size=EXPIRY_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="expiry-sweeper", daemon=True)
+        self._thread.start()
+        logging.info("Отмена просроченных транзакций: каждые %s сек.", self.interval)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            pool = db_pool.get_pool()
+            conn = pool.getconn()
+            try:
+                sweep(conn, self.batch_size)
+            except Exception as e:
+                _count("errors")
+                logging.error("Ошибка отмены просроченных транзакций: %s", e)
+            finally:
+                pool.putconn(conn)
+
+
+_sweeper = None
+
+
+def start_sweeper():
+    global _sweeper
+    if _sweeper is None and EXPIRY_SWEEP_INTERVAL > 0:
+        _sweeper = ExpirySweeper()
+        _sweeper.start()
+    return _sweeper
@@ -1,6 +1,14 @@
+import io
 import os
+import sys
+import csv
+import json
 import time
 import uuid
+import base64
+import decimal
+import argparse
+from urllib.parse import urlencode
 import psycopg2
 from dotenv import load_dotenv
 
@@ -12,21 +20,64 @@ MERCHANT_ID = os.getenv("MERCHANT_ID")
 CHECKOUT_URL = os.getenv("CHECKOUT_URL")
 CALLBACK_BASE_URL = os.getenv("CALLBACK_BASE_URL")
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Адрес нашей страницы /payment; если не задан, ссылки ведут прямо в checkout PayMe (GET-вариант)
+PAYMENT_PAGE_URL = os.getenv("PAYMENT_PAGE_URL")
 
-# Генерируем уникальный order_id (например, по времени)
-order_id = str(int(time.time()))
-# При необходимости можно использовать UUID:
-# order_id = uuid.uuid4().hex
+AMOUNT = 100000  # 1000 сум = 100000 тийинов
+LANG = "ru"
+DESCRIPTION = "Оплата за Кружку"
+COPY_CHUNK_SIZE = 10000
 
-amount = 100000  # 1000 сум = 100000 тийинов
-lang = "ru"
-description = "Оплата за Кружку"
+# Пакетный режим (маркетинговые кампании):
+#   python generate_payment_link.py --count 5000 --output links.txt
+#   python generate_payment_link.py --input orders.csv --format csv > links.csv
+# Входной CSV (с заголовком) или JSONL: user_id, product, quantity, amount (тийины,
+# кратно 100 – payment_amount хранится в сумах), description – все поля необязательны.
+# Настройки ссылок проверяются до вставки. Вход читается потоком: пачки по
+# COPY_CHUNK_SIZE строк идут через COPY во временную таблицу, затем одним
+# INSERT ... SELECT в orders и коммит; ссылки пишутся после коммита из временной
+# таблицы серверным курсором – в памяти не больше одной пачки.
+# merchant_trans_id – UUID. Без аргументов – как раньше: один заказ и payment.html
+# рядом со скриптом.
 
-# Формируем callback URL с параметром order_id
-callback_url = f"{CALLBACK_BASE_URL}?order_id={order_id}"
+STAGING_TABLE = "payment_links_staging"
+STAGING_COLUMNS = ("merchant_trans_id", "user_id", "product", "quantity", "amount", "description")
+STAGING_DDL = f"""
+CREATE TEMP TABLE {STAGING_TABLE} (
+    seq BIGSERIAL,
+    merchant_trans_id TEXT NOT NULL,
+    user_id BIGINT,
+    product TEXT,
+    quantity INTEGER,
+    amount INTEGER NOT NULL,
+    description TEXT
+)
+"""
+COPY_SQL = f"COPY {STAGING_TABLE} ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+INSERT_SQL = f"""
+INSERT INTO orders (user_id, merchant_trans_id, product, quantity, status,
+                    payment_amount, payme_amount, payment_system)
+SELECT user_id, merchant_trans_id, product, quantity, 'pending', amount / 100, amount, 'payme'
+FROM {STAGING_TABLE} ORDER BY seq
+"""
+LINKS_SQL = f"SELECT {', '.join(STAGING_COLUMNS)} FROM {STAGING_TABLE} ORDER BY seq"
+
+
+def create_single_order():
+    # Генерируем уникальный order_id (например, по времени)
+    order_id = str(int(time.time()))
+    # При необходимости можно использовать UUID:
+    # order_id = uuid.uuid4().hex
+
+    amount = AMOUNT
+    lang = LANG
+    description = DESCRIPTION
 
-# Генерируем HTML-код формы для оплаты
-html_form = f"""<!DOCTYPE html>
+    # Формируем callback URL с параметром order_id
+    callback_url = f"{CALLBACK_BASE_URL}?order_id={order_id}"
+
+    # Генерируем HTML-код формы для оплаты
+    html_form = f"""<!DOCTYPE html>
 <html lang="ru">
 <head>
     <meta charset="UTF-8">
@@ -48,32 +99,242 @@ html_form = f"""<!DOCTYPE html>
 </html>
 """
 
-# Подключаемся к PostgreSQL и создаём заказ
-try:
-    conn = psycopg2.connect(DATABASE_URL, sslmode='require')
+    # Подключаемся к PostgreSQL и создаём заказ
+    try:
+        conn = psycopg2.connect(DATABASE_URL, sslmode='require')
+        cur = conn.cursor()
+        # Без ON CONFLICT: занятый order_id (в любой секции или архиве, см. order_keys
+        # в partitions.py) – ошибка вставки, а не молча не созданный заказ
+        insert_query = """
+       INSERT INTO orders (order_id, payment_amount, status)
+    VALUES (%s, %s, %s);
+        """
+        cur.execute(insert_query, (order_id, amount, 'pending'))
+        conn.commit()
+        cur.close()
+        conn.close()
+        print("Заказ создан в базе данных с id:", order_id)
+    except Exception as e:
+        print("Ошибка при вставке заказа в базу данных:", e)
+
+    # Определяем директорию, где находится скрипт, и сохраняем файл там
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    filename = os.path.join(script_dir, "payment.html")
+
+    try:
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(html_form)
+        print(f"Форма оплаты сгенерирована в файле: {filename}")
+        print("Откройте этот файл в браузере для проведения оплаты.")
+    except Exception as e:
+        print("Ошибка при записи файла:", e)
+
+
+# Строки входного файла как dict: CSV с заголовком или JSONL (по расширению)
+def read_orders(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+# Целое положительное число из CSV (строка) или JSONL (int, float, строка);
+# дробные, нулевые, отрицательные и нечисловые значения – ошибка, а не округление
+def positive_int(value, field):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{field} {value!r} – не целое число")
+    try:
+        number = decimal.Decimal(value.strip() if isinstance(value, str) else value)
+    except decimal.InvalidOperation:
+        raise ValueError(f"{field} {value!r} – не целое число") from None
+    if not number.is_finite() or number != number.to_integral_value():
+        raise ValueError(f"{field} {value!r} – не целое число")
+    if number <= 0:
+        raise ValueError(f"{field} {value!r} должно быть больше нуля")
+    return int(number)
+
+
+def _given(row, field):
+    value = row.get(field)
+    return value is not None and value != ""
+
+
+# Нормализует входную строку в заказ; merchant_trans_id всегда новый UUID.
+# Сумма в тийинах должна делиться на 100: payment_amount заказа – целые сумы.
+# Пустые поля берутся из defaults (quantity – 1), заданные проверяются.
+def make_order(row, defaults):
+    amount = positive_int(row["amount"], "сумма") if _given(row, "amount") else defaults["amount"]
+    if amount <= 0 or amount % 100:
+        raise ValueError(f"сумма {amount} тийинов не кратна 100 (целые сумы)")
+    return {
+        "merchant_trans_id": str(uuid.uuid4()),
+        "user_id": int(row["user_id"]) if _given(row, "user_id") else defaults["user_id"],
+        "product": row.get("product") or defaults["product"],
+        "quantity": positive_int(row["quantity"], "количество") if _given(row, "quantity") else 1,
+        "amount": amount,
+        "description": row.get("description") or defaults["description"],
+    }
+
+
+# Поток заказов из входных строк; ошибка – с номером строки, до коммита
+def make_orders(rows, defaults):
+    for number, row in enumerate(rows, 1):
+        try:
+            yield make_order(row, defaults)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"строка {number}: {e}") from e
+
+
+def payment_link(order):
+    callback = f"{CALLBACK_BASE_URL}?order_id={order['merchant_trans_id']}" if CALLBACK_BASE_URL else ""
+    if PAYMENT_PAGE_URL:
+        return PAYMENT_PAGE_URL + "?" + urlencode({
+            "order_id": order["merchant_trans_id"],
+            "amount": order["amount"],
+            "merchant": MERCHANT_ID or "",
+            "callback": callback,
+            "lang": LANG,
+            "description": order["description"],
+        })
+    # GET-ссылка PayMe: base64 от "m=...;ac.order_id=...;a=...;l=...;c=..."
+    params = f"m={MERCHANT_ID};ac.order_id={order['merchant_trans_id']};a={order['amount']};l={LANG}"
+    if callback:
+        params += f";c={callback}"
+    return CHECKOUT_URL.rstrip("/") + "/" + base64.b64encode(params.encode()).decode()
+
+
+# Ссылки без адреса checkout или страницы /payment строить не из чего –
+# проверяется до создания заказов. Возвращает текст ошибки или None.
+def config_error():
+    if not DATABASE_URL:
+        return "DATABASE_URL не задан"
+    if not MERCHANT_ID:
+        return "MERCHANT_ID не задан"
+    if not PAYMENT_PAGE_URL and not CHECKOUT_URL:
+        return "не задан ни PAYMENT_PAGE_URL, ни CHECKOUT_URL"
+    return None
+
+
+# COPY одной пачки заказов во временную таблицу
+def copy_orders(cur, orders):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for order in orders:
+        writer.writerow(tuple("" if order[column] is None else order[column] for column in STAGING_COLUMNS))
+    buffer.seek(0)
+    cur.copy_expert(COPY_SQL, buffer)
+
+
+# Вставляет все заказы из потока orders в одной транзакции: пачки по
+# COPY_CHUNK_SIZE строк во временную таблицу, затем одним INSERT в orders.
+# Возвращает число созданных заказов.
+def insert_orders(conn, orders):
     cur = conn.cursor()
-    insert_query = """
-   INSERT INTO orders (order_id, payment_amount, status)
-VALUES (%s, %s, %s)
-ON CONFLICT (order_id) DO NOTHING;
-
-    """
-    cur.execute(insert_query, (order_id, amount, 'pending'))
-    conn.commit()
-    cur.close()
-    conn.close()
-    print("Заказ создан в базе данных с id:", order_id)
-except Exception as e:
-    print("Ошибка при вставке заказа в базу данных:", e)
-
-# Определяем директорию, где находится скрипт, и сохраняем файл там
-script_dir = os.path.dirname(os.path.abspath(__file__))
-filename = os.path.join(script_dir, "payment.html")
-
-try:
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(html_form)
-    print(f"Форма оплаты сгенерирована в файле: {filename}")
-    print("Откройте этот файл в браузере для проведения оплаты.")
-except Exception as e:
-    print("Ошибка при записи файла:", e)
+    try:
+        cur.execute(STAGING_DDL)
+        chunk = []
+        for order in orders:
+            chunk.append(order)
+            if len(chunk) >= COPY_CHUNK_SIZE:
+                copy_orders(cur, chunk)
+                chunk = []
+        if chunk:
+            copy_orders(cur, chunk)
+        cur.execute(INSERT_SQL)
+        count = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return count
+
+
+# Созданные заказы в порядке входа – серверным курсором из временной таблицы
+# (она живёт до закрытия соединения)
+def iter_created(conn):
+    cur = conn.cursor(name="payment_links")
+    cur.itersize = COPY_CHUNK_SIZE
+    try:
+        cur.execute(LINKS_SQL)
+        for row in cur:
+            yield dict(zip(STAGING_COLUMNS, row))
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def write_links(out, orders, fmt):
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(("merchant_trans_id", "user_id", "amount", "link"))
+        for order in orders:
+            writer.writerow((order["merchant_trans_id"], order["user_id"], order["amount"], payment_link(order)))
+    elif fmt == "jsonl":
+        for order in orders:
+            out.write(json.dumps(dict(order, link=payment_link(order)), ensure_ascii=False) + "\n")
+    else:
+        for order in orders:
+            out.write(payment_link(order) + "\n")
+
+
+def bulk_main(args):
+    defaults = {
+        "amount": args.amount,
+        "user_id": args.user_id,
+        "product": args.product,
+        "description": args.description,
+    }
+    rows = read_orders(args.input) if args.input else ({} for _ in range(args.count))
+    orders = make_orders(rows, defaults)
+
+    conn = psycopg2.connect(DATABASE_URL, sslmode=os.getenv("DB_SSLMODE", "require"))
+    try:
+        started = time.perf_counter()
+        try:
+            count = insert_orders(conn, orders)
+        except ValueError as e:
+            sys.exit(f"Заказы не созданы: {e}")
+        elapsed = time.perf_counter() - started
+
+        # Ссылки выдаём только после коммита – все они указывают на существующие заказы
+        if args.output:
+            with open(args.output, "w", encoding="utf-8", newline="") as out:
+                write_links(out, iter_created(conn), args.format)
+        else:
+            write_links(sys.stdout, iter_created(conn), args.format)
+    finally:
+        conn.close()
+
+    rate = count / elapsed if elapsed else 0.0
+    print(f"Создано заказов: {count} за {elapsed:.2f} сек. ({rate:.0f} строк/сек.)", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Создание заказов и ссылок на оплату PayMe")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--count", type=int, help="создать N одинаковых заказов")
+    source.add_argument("--input", help="CSV (с заголовком) или JSONL с заказами")
+    parser.add_argument("--output", help="файл для ссылок (по умолчанию stdout)")
+    parser.add_argument("--format", choices=["link", "csv", "jsonl"], default="link")
+    parser.add_argument("--amount", type=int, default=AMOUNT, help="сумма по умолчанию, тийины")
+    parser.add_argument("--user-id", type=int, help="user_id по умолчанию")
+    parser.add_argument("--product", default="Кружка")
+    parser.add_argument("--description", default=DESCRIPTION)
+    args = parser.parse_args()
+
+    if args.count is None and args.input is None:
+        create_single_order()
+    else:
+        error = config_error()
+        if error:
+            parser.error(error)
+        bulk_main(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import os
+import multiprocessing
+
+# Конфигурация gunicorn для Flask-режима:
+#   gunicorn -c gunicorn_conf.py "server:create_app()"
+#
+# preload_app: server импортируется и create_app() выполняется один раз в
+# мастере (логирование, проверка схемы), воркеры получают готовое приложение
+# через fork. Фоновые потоки (outbox, LISTEN) fork не переживают, поэтому
+# запускаются в post_fork каждого воркера; автопинг – один, в мастере.
+#
+# Модель воркеров – GUNICORN_WORKER_CLASS:
+#   gthread (по умолчанию) – процессы × потоки, пул БД на процесс;
+#   gevent – зелёные потоки (pip install -r requirements-gevent.txt),
+#     psycopg2 переключается в кооперативный режим через psycogreen.
+#     С preload_app приложение (threading, psycopg2, блокировки модулей)
+#     импортируется в мастере до запуска воркеров, поэтому monkey-patching
+#     выполняется здесь, при загрузке конфигурации – раньше импорта приложения,
+#     а не в воркере gevent, когда модули уже загружены непропатченными.
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+if worker_class == "gevent":
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        import logging
+        logging.warning("psycogreen не установлен: запросы к БД будут блокировать gevent-воркер")
+
+CPU_COUNT = multiprocessing.cpu_count()
+
+workers = int(os.getenv("WEB_CONCURRENCY", os.getenv("GUNICORN_WORKERS", str(min(2 * CPU_COUNT + 1, 8)))))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))  # только gevent
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+preload_app = True
+
+# PayMe ждёт ответ несколько секунд – зависший запрос дольше timeout
+# означает зависший воркер. graceful_timeout – на дописывание текущих запросов
+# и outbox при перезапуске.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Плановый перезапуск воркеров против утечек памяти; jitter разносит их во времени
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "200"))
+
+# Соединений в пуле процесса должно хватать всем, кто берёт их из пула одновременно:
+#   запросы – threads в gthread, worker_connections в gevent (зелёных потоков
+#     запросов в воркере столько же; включая /metrics, /ready и /stats);
+#   воркеры outbox – OUTBOX_WORKERS;
+#   отмена просроченных транзакций (expiry.py) – 1, если EXPIRY_SWEEP_INTERVAL > 0;
+#   фоновые загрузки справочника товаров (LISTEN on_reset, прогрев STARTUP_MODE=fast) – 1.
+# Аудит, LISTEN и проверка секций orders (partitions.py) держат собственные
+# соединения вне пула – OUT_OF_POOL_CONNECTIONS на процесс.
+#
+# Всего приложение открывает до workers × (DB_POOL_MAX + OUT_OF_POOL_CONNECTIONS)
+# соединений, и это должно укладываться в лимит БД (max_connections или лимит
+# тарифа минус запас на миграции, psql и бота). Под gevent с
+# worker_connections=100 и 8 воркерами это больше 800 – поэтому:
+#   DB_POOL_MAX, если задан, – потолок пула процесса;
+#   DB_CONNECTION_BUDGET (0 – не ограничен) – сколько соединений отдано всему
+#     приложению; пул урезается до DB_CONNECTION_BUDGET / workers минус соединения
+#     вне пула. Запросы сверх пула ждут соединение до DB_POOL_TIMEOUT.
+# Итог пишется в лог при старте (when_ready), превышение бюджета – предупреждением.
+OUT_OF_POOL_CONNECTIONS = 3
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "0"))
+
+if worker_class == "gevent":
+    request_connections = worker_connections
+elif worker_class == "gthread":
+    request_connections = threads
+else:
+    request_connections = 1
+expiry_connections = 1 if float(os.getenv("EXPIRY_SWEEP_INTERVAL", "60")) > 0 else 0
+db_pool_max = request_connections + int(os.getenv("OUTBOX_WORKERS", "2")) + expiry_connections + 1
+if os.getenv("DB_POOL_MAX"):
+    db_pool_max = min(db_pool_max, int(os.environ["DB_POOL_MAX"]))
+if DB_CONNECTION_BUDGET:
+    db_pool_max = min(db_pool_max, max(DB_CONNECTION_BUDGET // workers - OUT_OF_POOL_CONNECTIONS, 1))
+os.environ["DB_POOL_MAX"] = str(db_pool_max)
+
+
+def when_ready(server):
+    import server as app_module
+    app_module.start_auto_ping()
+    server.log.info("gunicorn: %s воркеров %s, потоков %s", workers, worker_class, threads)
+    total = workers * (db_pool_max + OUT_OF_POOL_CONNECTIONS)
+    server.log.info("БД: пул %s на воркер, всего до %s соединений (бюджет %s)",
+                    db_pool_max, total, DB_CONNECTION_BUDGET or "не задан")
+    if DB_CONNECTION_BUDGET and total > DB_CONNECTION_BUDGET:
+        server.log.warning("БД: %s соединений больше бюджета %s – уменьшите WEB_CONCURRENCY", total, DB_CONNECTION_BUDGET)
+
+
+def post_fork(server, worker):
+    import server as app_module
+    app_module.start_background()
+
+
+def worker_exit(server, worker):
+    import outbox
+    import expiry
+    import partitions
+    import pg_listener
+    import audit
+    if outbox._worker is not None:
+        outbox._worker.stop()
+    if expiry._sweeper is not None:
+        expiry._sweeper.stop()
+    if partitions._keeper is not None:
+        partitions._keeper.stop()
+    pg_listener.get_listener().stop()
+    audit.shutdown()
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,202 @@
+import os
+import time
+import fcntl
+import inspect
+import logging
+import functools
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+import tracing
+import order_queries
+import order_states
+
+# Метрики Prometheus для /metrics: вызовы и задержки методов PayMe, коды
+# ошибок, время запросов к БД по хелперам, отправка в Telegram, число
+# заказов по статусам в горячих секциях orders.
+#
+# Под gunicorn с несколькими воркерами задайте PROMETHEUS_MULTIPROC_DIR
+# (пустой каталог, очищаемый при деплое) – тогда значения из всех воркеров
+# суммируются при сборе. Завершившиеся воркеры отмечаются mark_process_dead().
+# Заказы по статусам пересчитывает один процесс на ORDER_STATUS_REFRESH сек.:
+# право на пересчёт разыгрывается через flock файла в этом каталоге.
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+ORDER_STATUS_REFRESH = float(os.getenv("METRICS_ORDER_STATUS_REFRESH", "30"))  # сек.
+
+KNOWN_METHODS = frozenset([
+    "CheckPerformTransaction", "CreateTransaction", "PerformTransaction",
+    "CheckTransaction", "CancelTransaction", "GetStatement", "ChangePassword",
+])
+
+RPC_REQUESTS = Counter("payme_rpc_requests_total", "Вызовы JSON-RPC PayMe", ["method"])
+RPC_LATENCY = Histogram(
+    "payme_rpc_latency_seconds", "Время обработки вызова JSON-RPC", ["method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+RPC_ERRORS = Counter("payme_rpc_errors_total", "Ответы PayMe с ошибкой", ["method", "code"])
+DB_QUERY_LATENCY = Histogram(
+    "payme_db_query_seconds", "Время запросов к БД по хелперам", ["helper"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+TELEGRAM_SEND_LATENCY = Histogram(
+    "payme_telegram_send_seconds", "Время отправки сообщения в Telegram",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+TELEGRAM_SEND_FAILURES = Counter("payme_telegram_send_failures_total", "Неудачные отправки в Telegram", ["kind"])
+ORDERS_BY_STATUS = Gauge(
+    "payme_orders", "Число заказов по статусам в горячих секциях orders", ["status"], multiprocess_mode="mostrecent"
+)
+ORDERS_PARTITIONS_MISSING = Gauge(
+    "payme_orders_partitions_missing", "Месяцев без секции orders (текущий и ORDERS_PARTITIONS_AHEAD вперёд)",
+    multiprocess_mode="mostrecent"
+)
+
+_order_status_checked = 0.0
+
+
+def method_label(method):
+    return method if method in KNOWN_METHODS else "unknown"
+
+
+def observe_rpc(payload, response, started):
+    method = method_label(payload.get("method") if isinstance(payload, dict) else None)
+    RPC_REQUESTS.labels(method).inc()
+    RPC_LATENCY.labels(method).observe(time.perf_counter() - started)
+    error = response.get("error")
+    if error:
+        RPC_ERRORS.labels(method, str(error.get("code"))).inc()
+
+
+# Декоратор хелпера БД: время выполнения в payme_db_query_seconds{helper=...}
+# и спан db.<helper> в трассе запроса (tracing.py).
+# Работает и с обычными функциями, и с корутинами (асинхронный бэкенд).
+def timed_db(helper):
+    histogram = DB_QUERY_LATENCY.labels(helper)
+    span_name = "db." + helper
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    with tracing.span(span_name):
+                        return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with tracing.span(span_name):
+                    return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# kind: None – успех, иначе "retryable" или "permanent"
+def observe_telegram_send(started, kind=None):
+    TELEGRAM_SEND_LATENCY.observe(time.perf_counter() - started)
+    if kind:
+        TELEGRAM_SEND_FAILURES.labels(kind).inc()
+
+
+# Только горячие секции (order_queries.HOT_SQL): старые месяцы и архив не
+# сканируются, число state без lower(status)
+ORDER_STATUS_SQL = (
+    "SELECT state, count(*) FROM orders "
+    f"WHERE {order_queries.HOT_SQL} AND state IS NOT NULL GROUP BY state"
+)
+ORDER_STATUS_LOCK = os.path.join(MULTIPROC_DIR, "order_statuses.lock") if MULTIPROC_DIR else None
+
+
+# Число заказов по статусам пересчитывается не чаще раза в ORDER_STATUS_REFRESH сек.
+# и, при нескольких воркерах, только одним из них
+def order_statuses_due():
+    global _order_status_checked
+    if time.monotonic() - _order_status_checked < ORDER_STATUS_REFRESH:
+        return False
+    _order_status_checked = time.monotonic()
+    return ORDER_STATUS_LOCK is None or _claim_order_statuses()
+
+
+# Время последнего пересчёта любым процессом – в файле под flock; занят или
+# пересчитан недавно – этот процесс пропускает
+def _claim_order_statuses():
+    try:
+        fd = os.open(ORDER_STATUS_LOCK, os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError as e:
+        logging.error("Метрики: нет доступа к %s: %s", ORDER_STATUS_LOCK, e)
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    try:
+        try:
+            last = float(os.read(fd, 32) or 0)
+        except ValueError:
+            last = 0.0
+        if time.time() - last < ORDER_STATUS_REFRESH:
+            return False
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, str(time.time()).encode())
+        return True
+    finally:
+        os.close(fd)
+
+
+def set_order_statuses(rows):
+    counts = dict(rows)
+    for state, status in order_states.STATE_STATUSES.items():
+        ORDERS_BY_STATUS.labels(status).set(counts.get(state, 0))
+
+
+def refresh_order_statuses(conn):
+    if not order_statuses_due():
+        return
+    try:
+        cur = conn.cursor()
+        cur.execute(ORDER_STATUS_SQL)
+        rows = cur.fetchall()
+        cur.close()
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error("Метрики: ошибка подсчёта заказов по статусам: %s", e)
+        return
+    set_order_statuses(rows)
+
+
+# stats – partitions.stats(): до первой проверки секций метрика не выставляется
+def set_partitions(stats):
+    if stats["missing_count"] is not None:
+        ORDERS_PARTITIONS_MISSING.set(stats["missing_count"])
+
+
+def render():
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
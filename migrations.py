@@ -0,0 +1,286 @@
+import os
+import sys
+import logging
+import argparse
+from collections import namedtuple
+import psycopg2
+from dotenv import load_dotenv
+import audit
+import outbox
+import partitions
+import order_states
+import product_catalog
+
+# Версионированные миграции схемы. Запускаются один раз на деплой:
+#   python migrations.py upgrade
+# Воркеры при старте только сверяют версию (verify_schema).
+#
+# Миграция – список шагов (SQL-строки или функции от курсора). Шаги с
+# transactional=False выполняются вне транзакции (нужно для CREATE INDEX CONCURRENTLY).
+
+Migration = namedtuple("Migration", ["version", "description", "steps", "transactional"])
+
+MIGRATIONS_LOCK_ID = 7350001  # ключ pg_advisory_lock, чтобы миграции не шли параллельно
+
+
+def _drop_invalid_index(name):
+    # После неудачного CREATE INDEX CONCURRENTLY остаётся невалидный индекс,
+    # который IF NOT EXISTS пропустил бы – удаляем его перед повтором.
+    def step(cur):
+        cur.execute(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = %s AND NOT i.indisvalid",
+            (name,)
+        )
+        if cur.fetchone():
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    return step
+
+
+MIGRATIONS = [
+    Migration(1, "orders baseline schema", [
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            merchant_trans_id TEXT,
+            product TEXT,
+            quantity INTEGER,
+            design_text TEXT,
+            design_photo TEXT,
+            location_lat REAL,
+            location_lon REAL,
+            status TEXT NOT NULL,
+            payment_amount INTEGER,
+            payme_amount INTEGER,
+            payment_system TEXT,
+            create_time BIGINT,
+            perform_time BIGINT,
+            cancel_time BIGINT,
+            order_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            delivery_comment TEXT,
+            items TEXT,
+            transaction_id TEXT,
+            cancel_reason INTEGER
+        );
+        """,
+        # Для баз, созданных старыми версиями init_db()
+        """
+        ALTER TABLE orders
+            ADD COLUMN IF NOT EXISTS user_id BIGINT,
+            ADD COLUMN IF NOT EXISTS merchant_trans_id TEXT,
+            ADD COLUMN IF NOT EXISTS product TEXT,
+            ADD COLUMN IF NOT EXISTS quantity INTEGER,
+            ADD COLUMN IF NOT EXISTS design_text TEXT,
+            ADD COLUMN IF NOT EXISTS design_photo TEXT,
+            ADD COLUMN IF NOT EXISTS location_lat REAL,
+            ADD COLUMN IF NOT EXISTS location_lon REAL,
+            ADD COLUMN IF NOT EXISTS create_time BIGINT,
+            ADD COLUMN IF NOT EXISTS perform_time BIGINT,
+            ADD COLUMN IF NOT EXISTS cancel_time BIGINT,
+            ADD COLUMN IF NOT EXISTS order_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS delivery_comment TEXT,
+            ADD COLUMN IF NOT EXISTS items TEXT,
+            ADD COLUMN IF NOT EXISTS transaction_id TEXT,
+            ADD COLUMN IF NOT EXISTS payment_system TEXT,
+            ADD COLUMN IF NOT EXISTS payme_amount INTEGER,
+            ADD COLUMN IF NOT EXISTS cancel_reason INTEGER;
+        """,
+    ], True),
+    Migration(2, "notification outbox", outbox.OUTBOX_DDL, True),
+    Migration(3, "unique index on orders.transaction_id", [
+        _drop_invalid_index("orders_transaction_id_key"),
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS orders_transaction_id_key ON orders (transaction_id)",
+    ], False),
+    Migration(4, "unique index on orders.merchant_trans_id", [
+        _drop_invalid_index("orders_merchant_trans_id_key"),
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS orders_merchant_trans_id_key ON orders (merchant_trans_id)",
+    ], False),
+    Migration(5, "NOTIFY order_changes on order status changes", [
+        """
+        CREATE OR REPLACE FUNCTION notify_order_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('order_changes', json_build_object(
+                'order_id', NEW.order_id,
+                'transaction_id', NEW.transaction_id,
+                'old_transaction_id', OLD.transaction_id
+            )::text);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+        """,
+        "DROP TRIGGER IF EXISTS orders_notify_change ON orders;",
+        """
+        CREATE TRIGGER orders_notify_change
+            AFTER UPDATE ON orders
+            FOR EACH ROW
+            WHEN (OLD.status IS DISTINCT FROM NEW.status
+                  OR OLD.transaction_id IS DISTINCT FROM NEW.transaction_id)
+            EXECUTE FUNCTION notify_order_change();
+        """,
+    ], True),
+    Migration(6, "index on orders.create_time for GetStatement", [
+        _drop_invalid_index("orders_create_time_idx"),
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_create_time_idx "
+        "ON orders (create_time, order_id) WHERE transaction_id IS NOT NULL",
+    ], False),
+    # Таблицу clients ведёт бот; если её ещё нет, триггер не создаётся
+    Migration(7, "NOTIFY client_changes on clients changes", [
+        """
+        CREATE OR REPLACE FUNCTION notify_client_change() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('client_changes', OLD.user_id::text);
+                RETURN OLD;
+            END IF;
+            PERFORM pg_notify('client_changes', NEW.user_id::text);
+            IF TG_OP = 'UPDATE' AND OLD.user_id IS DISTINCT FROM NEW.user_id THEN
+                PERFORM pg_notify('client_changes', OLD.user_id::text);
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+        """,
+        """
+        DO $$
+        BEGIN
+            IF to_regclass('clients') IS NOT NULL THEN
+                DROP TRIGGER IF EXISTS clients_notify_change ON clients;
+                CREATE TRIGGER clients_notify_change
+                    AFTER INSERT OR UPDATE OR DELETE ON clients
+                    FOR EACH ROW
+                    EXECUTE FUNCTION notify_client_change();
+            END IF;
+        END
+        $$;
+        """,
+    ], True),
+    # Прежняя таблица становится секцией orders_legacy без копирования (см. partitions.py)
+    Migration(8, "partition orders by month on order_time, orders_archive", [
+        "UPDATE orders SET order_time = localtimestamp WHERE order_time IS NULL",
+        partitions.add_legacy_bound,
+        _drop_invalid_index("orders_order_time_idx"),
+        partitions.create_legacy_order_time_index,
+        partitions.create_archive,
+        partitions.convert_to_partitioned,
+        partitions.create_initial_partitions,
+    ], False),
+    Migration(9, "partial index on processing orders for the expiry sweeper", [
+        partitions.create_partition_indexes,
+    ], False),
+    Migration(10, "products catalog with NOTIFY product_changes", product_catalog.PRODUCTS_DDL, True),
+    Migration(11, "append-only payme_audit partitioned by month", audit.AUDIT_DDL + [
+        audit.ensure_partitions,
+    ], True),
+    # Колонка, триггер и индекс по state – только здесь: миграции 1–9 уже применены
+    # на действующих базах и не меняются. Прежние *_processing_idx остаются в INDEXES.
+    Migration(12, "SMALLINT orders.state with partial index on open transactions", [
+        order_states.add_state_column,
+        order_states.backfill_state,
+        partitions.create_state_indexes,
+    ], False),
+    # Уникальность order_id, transaction_id и merchant_trans_id по всем секциям и архиву
+    Migration(13, "global order_keys for unique order keys across partitions", partitions.ORDER_KEYS_DDL + [
+        partitions.backfill_order_keys,
+    ], False),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+class SchemaVersionError(RuntimeError):
+    pass
+
+
+def current_version(cur):
+    cur.execute("SELECT to_regclass('schema_version')")
+    if cur.fetchone()[0] is None:
+        return 0
+    cur.execute("SELECT coalesce(max(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+
+def _run_step(cur, step):
+    if callable(step):
+        step(cur)
+    else:
+        cur.execute(step)
+
+
+def upgrade(conn, target=SCHEMA_VERSION):
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+    try:
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, description TEXT NOT NULL, "
+            "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        )
+        version = current_version(cur)
+        for migration in MIGRATIONS:
+            if migration.version <= version or migration.version > target:
+                continue
+            logging.info("Миграция %s: %s", migration.version, migration.description)
+            if migration.transactional:
+                cur.execute("BEGIN")
+            try:
+                for step in migration.steps:
+                    _run_step(cur, step)
+                cur.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (migration.version, migration.description)
+                )
+                if migration.transactional:
+                    cur.execute("COMMIT")
+            except Exception:
+                if migration.transactional:
+                    cur.execute("ROLLBACK")
+                raise
+            version = migration.version
+        return version
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+        cur.close()
+
+
+# Проверка при старте воркера: одна лёгкая выборка вместо DDL
+def verify_schema(conn):
+    cur = conn.cursor()
+    version = current_version(cur)
+    cur.close()
+    conn.rollback()
+    if version < SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"Схема БД версии {version}, требуется {SCHEMA_VERSION}. Выполните: python migrations.py upgrade"
+        )
+    return version
+
+
+def main(argv=None):
+    load_dotenv()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Миграции схемы БД payme_api_server")
+    parser.add_argument("command", nargs="?", default="upgrade", choices=["upgrade", "status"])
+    parser.add_argument("--target", type=int, default=SCHEMA_VERSION, help="версия, до которой мигрировать")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"), sslmode=os.getenv("DB_SSLMODE", "require"))
+    try:
+        if args.command == "status":
+            cur = conn.cursor()
+            version = current_version(cur)
+            cur.close()
+            print(f"Текущая версия схемы: {version}, последняя: {SCHEMA_VERSION}")
+            for migration in MIGRATIONS:
+                mark = "x" if migration.version <= version else " "
+                print(f"  [{mark}] {migration.version}: {migration.description}")
+        else:
+            version = upgrade(conn, args.target)
+            print(f"Схема обновлена до версии {version}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
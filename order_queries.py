@@ -0,0 +1,271 @@
+import os
+import re
+import weakref
+import threading
+import time
+import tracing
+from collections import namedtuple
+
+# Слой запросов к orders для горячего пути PayMe.
+#
+# Вместо SELECT * каждый потребитель объявляет нужные ему колонки (широкие
+# design_photo, design_text, items сюда не попадают), строки возвращаются
+# лёгкими кортежами OrderRow с доступом как к dict (row["status"], row.get()),
+# поэтому обработчики payme_handlers не меняются.
+#
+# Запросы выполняются через PREPARE/EXECUTE: каждое выражение готовится один
+# раз на соединение пула и дальше не разбирается и не планируется заново.
+
+# Колонки, которые читают обработчики PayMe, переходы статусов и постановка
+# уведомлений в outbox (user_id)
+PAYME_COLUMNS = (
+    "order_id", "user_id", "merchant_trans_id", "status",
+    "payment_system", "payment_amount", "payme_amount", "transaction_id",
+    "create_time", "perform_time", "cancel_time", "cancel_reason", "state",
+)
+
+
+# Колонки CheckPerformTransaction: чек строится из товаров заказа (product_catalog.py)
+RECEIPT_COLUMNS = PAYME_COLUMNS + ("product", "quantity", "items")
+
+
+# Доступ к строке-namedtuple как к dict: row["column"] и row.get("column", default),
+# как у прежнего RealDictRow
+class _DictAccess:
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self._fields
+
+
+class OrderRow(_DictAccess, namedtuple("OrderRow", PAYME_COLUMNS)):
+    __slots__ = ()
+
+
+class ReceiptRow(_DictAccess, namedtuple("ReceiptRow", RECEIPT_COLUMNS)):
+    __slots__ = ()
+
+
+COLUMNS_SQL = ", ".join(PAYME_COLUMNS)
+
+_PARAM_RE = re.compile(r"%\((\w+)\)s|%s")
+
+
+# Переводит SQL из стиля psycopg2 (%s, %(name)s) в позиционные $1, $2 ...
+# (для PREPARE и для asyncpg). Возвращает (sql, names): для именованных
+# параметров names – порядок имён, иначе None.
+def to_positional(sql):
+    names = []
+    counter = [0]
+
+    def replace(match):
+        name = match.group(1)
+        if name is None:
+            counter[0] += 1
+            return f"${counter[0]}"
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    converted = _PARAM_RE.sub(replace, sql)
+    return converted, (names or None)
+
+
+# Подготавливаемое выражение: имя для PREPARE, SQL с $n и порядок именованных параметров
+class Statement:
+    __slots__ = ("name", "sql", "names", "execute_sql")
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql, self.names = to_positional(sql)
+        nparams = len(self.names) if self.names else len(re.findall(r"\$\d+", self.sql))
+        args = "(" + ", ".join(["%s"] * nparams) + ")" if nparams else ""
+        self.execute_sql = f"EXECUTE {name}{args}"
+
+    def args(self, params):
+        if self.names is None:
+            return tuple(params)
+        return tuple(params[name] for name in self.names)
+
+
+# orders секционирована по месяцам order_time (partitions.py). Поиск по ключу
+# идёт сначала в горячих секциях – текущий месяц и ORDERS_HOT_MONTHS - 1
+# предыдущих, где живут все pending/processing и недавние оплаты, – затем в
+# остальных и, для чтения, в архиве orders_archive. Граница – стабильное
+# выражение, поэтому лишние секции отсекаются и в подготовленном выражении.
+# Все три части – одно выражение UNION ALL ... LIMIT 1 за один round trip:
+# Append выполняет ветки по порядку и останавливается на первой найденной
+# строке, так что заказ из горячих секций остальные секции и архив не трогает.
+ORDERS_HOT_MONTHS = max(int(os.getenv("ORDERS_HOT_MONTHS", "2")), 1)
+HOT_SINCE_SQL = f"date_trunc('month', localtimestamp) - interval '{ORDERS_HOT_MONTHS - 1} months'"
+HOT_SQL = f"order_time >= {HOT_SINCE_SQL}"
+COLD_SQL = f"order_time < {HOT_SINCE_SQL}"
+ARCHIVE_TABLE = "orders_archive"
+
+
+# Поиск заказа по ключевой колонке: горячие секции, остальные, архив – одним
+# выражением. Первая колонка результата – где найден заказ ("hot", "cold",
+# "archive") для статистики, за ней колонки row – класса строки (OrderRow или ReceiptRow).
+class Lookup:
+    __slots__ = ("name", "key_column", "row", "statement")
+
+    def __init__(self, name, key_column, row=OrderRow):
+        self.name = name
+        self.key_column = key_column
+        self.row = row
+        columns = ", ".join(row._fields)
+        select = f"FROM orders WHERE {key_column} = %(key)s"
+        self.statement = Statement(
+            name,
+            f"(SELECT 'hot' AS scope, {columns} {select} AND {HOT_SQL}) "
+            f"UNION ALL (SELECT 'cold', {columns} {select} AND {COLD_SQL}) "
+            f"UNION ALL (SELECT 'archive', {columns} FROM {ARCHIVE_TABLE} WHERE {key_column} = %(key)s) "
+            "LIMIT 1"
+        )
+
+
+ORDER_BY_TRANSACTION = Lookup("order_by_transaction", "transaction_id")
+ORDER_BY_MERCHANT_TRANS_ID = Lookup("order_by_merchant_trans_id", "merchant_trans_id")
+ORDER_FOR_RECEIPT = Lookup("order_for_receipt", "merchant_trans_id", ReceiptRow)
+ORDER_BY_ID = Statement(
+    "order_by_id", f"SELECT {COLUMNS_SQL} FROM orders WHERE order_id = %s"
+)
+
+# Возврат заказа из архива в orders – перед переходом статуса (например, отмена
+# давно завершённого заказа). Строка попадает в секцию своего order_time.
+RESTORE_SQL = (
+    f"WITH moved AS (DELETE FROM {ARCHIVE_TABLE} WHERE {{key_column}} = %s RETURNING *) "
+    "INSERT INTO orders SELECT * FROM moved"
+)
+
+# Выписка GetStatement читается именованным курсором (не PREPARE) пачками по
+# STATEMENT_FETCH_SIZE строк; порядок совпадает с индексами *_create_time_idx
+# секций и архива (Merge Append без сортировки)
+STATEMENT_FETCH_SIZE = int(os.getenv("STATEMENT_FETCH_SIZE", "2000"))
+STATEMENT_SQL = (
+    f"SELECT {COLUMNS_SQL} FROM orders "
+    "WHERE create_time BETWEEN %(from)s AND %(to)s AND transaction_id IS NOT NULL "
+    f"UNION ALL SELECT {COLUMNS_SQL} FROM {ARCHIVE_TABLE} "
+    "WHERE create_time BETWEEN %(from)s AND %(to)s AND transaction_id IS NOT NULL "
+    "ORDER BY create_time, order_id"
+)
+
+_update_statements = {}
+_update_lock = threading.Lock()
+
+
+# UPDATE по набору колонок: одно выражение на форму (кортеж имён полей)
+def update_statement(columns):
+    columns = tuple(columns)
+    statement = _update_statements.get(columns)
+    if statement is None:
+        with _update_lock:
+            statement = _update_statements.get(columns)
+            if statement is None:
+                set_clause = ", ".join(f"{column} = %s" for column in columns)
+                statement = Statement(
+                    f"update_order_{len(_update_statements) + 1}",
+                    f"UPDATE orders SET {set_clause} WHERE order_id = %s",
+                )
+                _update_statements[columns] = statement
+    return statement
+
+
+# Имена выражений, уже подготовленных на соединении. Соединение пула живёт
+# до переподключения; после него словарь сам забывает старый объект.
+_prepared = weakref.WeakKeyDictionary()
+
+
+# Медленное выполнение (дольше tracing.SLOW_SQL_MS) записывается в трассу вместе
+# с планом EXPLAIN EXECUTE – на том же соединении, тот же подготовленный план.
+def execute(cur, statement, params=()):
+    conn = cur.connection
+    names = _prepared.get(conn)
+    if names is None:
+        names = _prepared[conn] = set()
+    if statement.name not in names:
+        cur.execute(f"PREPARE {statement.name} AS {statement.sql}")
+        names.add(statement.name)
+    args = statement.args(params)
+    started = time.perf_counter()
+    cur.execute(statement.execute_sql, args)
+    duration = time.perf_counter() - started
+    if tracing.is_slow(duration):
+        plan = tracing.explain(conn, statement.execute_sql, args)
+        tracing.record_slow_sql(statement.sql, args, duration, plan)
+
+
+def fetch_order(conn, statement, *params, row_class=OrderRow):
+    cur = conn.cursor()
+    try:
+        execute(cur, statement, params)
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    return row_class._make(row) if row is not None else None
+
+
+_lookup_stats = {"hot": 0, "cold": 0, "archive": 0, "missing": 0}
+_lookup_lock = threading.Lock()
+
+
+def count_lookup(scope):
+    with _lookup_lock:
+        _lookup_stats[scope] += 1
+
+
+# Где находятся заказы, которые ищет горячий путь: доля "hot" должна быть близка к 1
+def lookup_stats():
+    with _lookup_lock:
+        stats = dict(_lookup_stats)
+    total = sum(stats.values())
+    stats["hot_rate"] = round(stats["hot"] / total, 4) if total else 0.0
+    return stats
+
+
+# Поиск заказа: горячие секции, остальные секции, архив – один запрос
+def find_order(conn, lookup, key):
+    cur = conn.cursor()
+    try:
+        execute(cur, lookup.statement, {"key": key})
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    if row is None:
+        count_lookup("missing")
+        return None
+    count_lookup(row[0])
+    return lookup.row._make(row[1:])
+
+
+# Переносит заказ из архива обратно в orders; True, если он там был
+def restore_order(conn, key_column, key):
+    cur = conn.cursor()
+    try:
+        cur.execute(RESTORE_SQL.format(key_column=key_column), (key,))
+        return cur.rowcount > 0
+    finally:
+        cur.close()
+
+
+def update_order(conn, order_id, fields):
+    statement = update_statement(fields.keys())
+    cur = conn.cursor()
+    try:
+        execute(cur, statement, list(fields.values()) + [order_id])
+    finally:
+        cur.close()
@@ -0,0 +1,318 @@
+import os
+import abc
+import itertools
+import threading
+import transitions
+import order_queries
+import order_states
+import outbox
+import response_cache
+import client_cache
+import metrics
+
+# Хранилище заказов и клиентов для обработчиков payme_handlers. Обработчики
+# обращаются к данным только через операции бэкенда (см. payme_handlers.py):
+#   get_order_by_merchant_trans_id, get_order_by_transaction,
+#   get_order_for_receipt, apply_transition, open_statement.
+# Интерфейс – OrderRepository: эти операции, а также get_order_by_id и
+# get_clients (профили клиентов для уведомлений).
+# Реализации:
+#   postgres (по умолчанию) – PostgresRepository ниже (синхронный, psycopg2;
+#     соединение – от get_conn, во Flask это соединение текущего запроса),
+#     асинхронный режим – asgi_server.AsyncpgBackend (asyncpg) с теми же операциями;
+#   memory – MemoryRepository ниже: заказы и профили клиентов в памяти
+#     процесса, без БД. Для профилирования самих обработчиков и прогонов
+#     жизненного цикла PayMe с высокой частотой запросов
+#     (benchmarks/payme_load.py --memory).
+#
+# MemoryRepository потокобезопасен: все операции под одной блокировкой,
+# заказы индексируются по order_id, merchant_trans_id и transaction_id.
+# Переходы статусов – по order_states.TRANSITIONS, как и SQL из transitions.py:
+# условие по текущему state, guard суммы для CREATE, те же поля SET. Уведомления об оплате не
+# отправляются, а складываются в outbox (строки outbox.notification_rows).
+
+ORDER_REPOSITORY = os.getenv("ORDER_REPOSITORY", "postgres")
+
+
+def is_memory():
+    return ORDER_REPOSITORY == "memory"
+
+
+# Ожидаемая сумма в единицах callback'а (как transitions.EXPECTED_AMOUNT_SQL)
+def expected_amount(order):
+    payment_system = (order.get("payment_system") or "payme").lower()
+    if payment_system == "click":
+        return int(order["payment_amount"]) * 100
+    if payment_system == "payme":
+        return order["payme_amount"]
+    return order["payment_amount"]
+
+
+# Поля, которые выставляет переход (SET из transitions.py; status и state – в apply_transition),
+# или None, если guard не выполнен
+def _create_fields(order, params):
+    if expected_amount(order) != params["amount"]:
+        return None
+    return {"create_time": params["now"], "transaction_id": params["transaction_id"]}
+
+
+def _perform_fields(order, params):
+    return {"perform_time": params["now"]}
+
+
+def _cancel_fields(order, params):
+    return {"cancel_time": params["now"], "cancel_reason": params["reason"]}
+
+
+TRANSITION_FIELDS = {
+    transitions.CREATE.name: _create_fields,
+    transitions.PERFORM.name: _perform_fields,
+    transitions.CANCEL.name: _cancel_fields,
+}
+
+ORDER_DEFAULTS = {column: None for column in order_queries.RECEIPT_COLUMNS}
+ORDER_DEFAULTS.update(status="pending", payment_system="payme", quantity=1)
+
+
+class OrderRepository(abc.ABC):
+    @abc.abstractmethod
+    def get_order_by_merchant_trans_id(self, merchant_trans_id):
+        pass
+
+    @abc.abstractmethod
+    def get_order_by_transaction(self, transaction_id):
+        pass
+
+    # Заказ для чека CheckPerformTransaction: дополнительно product, quantity, items
+    @abc.abstractmethod
+    def get_order_for_receipt(self, merchant_trans_id):
+        pass
+
+    @abc.abstractmethod
+    def get_order_by_id(self, order_id):
+        pass
+
+    # (applied, заказ) – как transitions.apply_transition; notify – поставить
+    # уведомления об оплате в outbox вместе с переходом
+    @abc.abstractmethod
+    def apply_transition(self, transition, key, params, notify=False):
+        pass
+
+    # Итератор строк выписки GetStatement по возрастанию create_time
+    @abc.abstractmethod
+    def open_statement(self, from_time, to_time):
+        pass
+
+    # {user_id: профиль} для найденных клиентов
+    @abc.abstractmethod
+    def get_clients(self, user_ids):
+        pass
+
+
+# Хранилище в PostgreSQL: узкие выборки и подготовленные выражения (order_queries.py),
+# поиск по ключу – сначала в горячих секциях orders (partitions.py).
+# get_conn() возвращает соединение, которое разделяют все операции одного
+# запроса; вернуть его в пул – забота вызывающего.
+class PostgresRepository(OrderRepository):
+    def __init__(self, get_conn, group_chat_id=None):
+        self.get_conn = get_conn
+        self.group_chat_id = group_chat_id
+
+    def _find(self, lookup, key):
+        conn = self.get_conn()
+        order = order_queries.find_order(conn, lookup, key)
+        conn.commit()
+        return order
+
+    @metrics.timed_db("get_order_by_merchant_trans_id")
+    def get_order_by_merchant_trans_id(self, merchant_trans_id):
+        return self._find(order_queries.ORDER_BY_MERCHANT_TRANS_ID, merchant_trans_id)
+
+    @metrics.timed_db("get_order_by_transaction")
+    def get_order_by_transaction(self, transaction_id):
+        return self._find(order_queries.ORDER_BY_TRANSACTION, transaction_id)
+
+    @metrics.timed_db("get_order_for_receipt")
+    def get_order_for_receipt(self, merchant_trans_id):
+        return self._find(order_queries.ORDER_FOR_RECEIPT, merchant_trans_id)
+
+    @metrics.timed_db("get_order_by_id")
+    def get_order_by_id(self, order_id):
+        conn = self.get_conn()
+        order = order_queries.fetch_order(conn, order_queries.ORDER_BY_ID, order_id)
+        conn.commit()
+        return order
+
+    @metrics.timed_db("update_order")
+    def update_order(self, order_id, fields):
+        conn = self.get_conn()
+        order_queries.update_order(conn, order_id, fields)
+        conn.commit()
+
+    # Переход статуса в одной транзакции (см. transitions.py); уведомления об
+    # оплате – в outbox в той же транзакции, отправляют фоновые воркеры outbox.py
+    @metrics.timed_db("apply_transition")
+    def apply_transition(self, transition, key, params, notify=False):
+        conn = self.get_conn()
+        try:
+            applied, order = transitions.apply_transition(conn, transition, key, **params)
+            if applied and notify:
+                outbox.enqueue_payment_notifications(conn, order, self.group_chat_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if applied:
+            response_cache.cache.invalidate(order.get("transaction_id"))
+            if notify:
+                outbox.wake()
+        return applied, order
+
+    # Именованный (серверный) курсор отдаёт строки пачками, поэтому период любой
+    # длины не загружается в память целиком. Курсор живёт, пока итератор не
+    # исчерпан или не закрыт (во Flask – stream_with_context держит соединение запроса).
+    @metrics.timed_db("open_statement")
+    def open_statement(self, from_time, to_time):
+        conn = self.get_conn()
+        cur = conn.cursor(name="payme_statement")
+        cur.itersize = order_queries.STATEMENT_FETCH_SIZE
+        cur.execute(order_queries.STATEMENT_SQL, {"from": from_time, "to": to_time})
+        return _iter_statement(conn, cur)
+
+    # Профили – через client_cache: в БД идут только отсутствующие в кэше
+    @metrics.timed_db("clients_lookup")
+    def get_clients(self, user_ids):
+        conn = self.get_conn()
+        try:
+            return client_cache.get_clients(conn, user_ids)
+        finally:
+            conn.rollback()
+
+
+def _iter_statement(conn, cur):
+    try:
+        for row in cur:
+            yield order_queries.OrderRow._make(row)
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+class MemoryRepository(OrderRepository):
+    def __init__(self, group_chat_id=None):
+        self.group_chat_id = group_chat_id
+        self._lock = threading.Lock()
+        self._orders = {}  # order_id -> dict колонок RECEIPT_COLUMNS
+        self._by_merchant_trans_id = {}
+        self._by_transaction_id = {}
+        self._clients = {}  # user_id -> профиль
+        self._order_ids = itertools.count(1)
+        self.outbox = []
+
+    # --- Наполнение (тесты, нагрузочный прогон) ---
+
+    def add_order(self, **fields):
+        with self._lock:
+            order = dict(ORDER_DEFAULTS)
+            order.update(fields)
+            order["state"] = order_states.status_state(order["status"])  # как триггер orders_set_state
+            if order["order_id"] is None:
+                order["order_id"] = next(self._order_ids)
+            if order["order_id"] in self._orders:
+                raise ValueError(f"Заказ {order['order_id']} уже есть")
+            if order["merchant_trans_id"] in self._by_merchant_trans_id:
+                raise ValueError(f"merchant_trans_id {order['merchant_trans_id']} уже занят")
+            self._orders[order["order_id"]] = order
+            self._index(order)
+            return order["order_id"]
+
+    def add_client(self, user_id, **profile):
+        with self._lock:
+            self._clients[user_id] = dict(profile, user_id=user_id)
+
+    def get_clients(self, user_ids):
+        with self._lock:
+            return {user_id: dict(self._clients[user_id]) for user_id in user_ids if user_id in self._clients}
+
+    def get_order_by_id(self, order_id):
+        with self._lock:
+            order = self._orders.get(order_id)
+            return _order_row(order) if order is not None else None
+
+    def _index(self, order):
+        if order["merchant_trans_id"] is not None:
+            self._by_merchant_trans_id[order["merchant_trans_id"]] = order["order_id"]
+        if order["transaction_id"] is not None:
+            self._by_transaction_id[order["transaction_id"]] = order["order_id"]
+
+    def _find(self, key_column, key):
+        index = self._by_transaction_id if key_column == "transaction_id" else self._by_merchant_trans_id
+        order_id = index.get(key)
+        return self._orders.get(order_id) if order_id is not None else None
+
+    # --- Операции бэкенда payme_handlers ---
+
+    def get_order_by_merchant_trans_id(self, merchant_trans_id):
+        with self._lock:
+            order = self._find("merchant_trans_id", merchant_trans_id)
+            return _order_row(order) if order is not None else None
+
+    def get_order_by_transaction(self, transaction_id):
+        with self._lock:
+            order = self._find("transaction_id", transaction_id)
+            return _order_row(order) if order is not None else None
+
+    def get_order_for_receipt(self, merchant_trans_id):
+        with self._lock:
+            order = self._find("merchant_trans_id", merchant_trans_id)
+            return _receipt_row(order) if order is not None else None
+
+    # Те же (applied, заказ), что и transitions.apply_transition
+    def apply_transition(self, transition, key, params, notify=False):
+        with self._lock:
+            order = self._find(transition.key_column, key)
+            if order is None:
+                return False, None
+            state = order_states.next_state(transition.name, order["state"])
+            fields = TRANSITION_FIELDS[transition.name](order, params) if state is not None else None
+            if fields is None:
+                return False, _order_row(order)
+            fields.update(status=order_states.STATE_STATUSES[state], state=state)
+            previous_transaction_id = order["transaction_id"]
+            order.update(fields)
+            if order["transaction_id"] != previous_transaction_id:
+                self._by_transaction_id.pop(previous_transaction_id, None)
+                self._index(order)
+            row = _order_row(order)
+            if notify:
+                self.outbox.extend(outbox.notification_rows(row, self.group_chat_id))
+        response_cache.cache.invalidate(row.get("transaction_id"))
+        return True, row
+
+    # Снимок выписки на момент вызова, по возрастанию create_time
+    def open_statement(self, from_time, to_time):
+        with self._lock:
+            orders = [
+                _order_row(order) for order in self._orders.values()
+                if order["transaction_id"] is not None
+                and order["create_time"] is not None and from_time <= order["create_time"] <= to_time
+            ]
+        orders.sort(key=lambda order: (order["create_time"], order["order_id"]))
+        return iter(orders)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "orders": len(self._orders),
+                "transactions": len(self._by_transaction_id),
+                "clients": len(self._clients),
+                "outbox": len(self.outbox),
+            }
+
+
+def _order_row(order):
+    return order_queries.OrderRow._make(order[column] for column in order_queries.PAYME_COLUMNS)
+
+
+def _receipt_row(order):
+    return order_queries.ReceiptRow._make(order[column] for column in order_queries.RECEIPT_COLUMNS)
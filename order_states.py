@@ -0,0 +1,151 @@
+import os
+import logging
+
+# Состояния заказа для PayMe. Текстовый orders.status ведёт бот ("pending",
+# "одобрен", ...) – он остаётся как есть, а рядом хранится orders.state
+# (SMALLINT): код, который прямо совпадает с состоянием транзакции PayMe.
+# state выставляет триггер orders_set_state при любой записи status – и бота,
+# и переходов transitions.py (миграция 12), поэтому обработчики и выборки
+# сравнивают число, без lower(status).
+#
+#   NEW (0)                     – транзакции ещё нет ("pending", "одобрен");
+#   CREATED (1)                 – транзакция создана, ждёт PerformTransaction;
+#   PERFORMED (2)               – оплачен;
+#   CANCELLED (-1)              – отменён до оплаты (в т.ч. по тайм-ауту, expiry.py);
+#   CANCELLED_AFTER_PERFORM (-2) – возврат после оплаты.
+# Статусы бота, которых нет в STATUS_STATES, дают state NULL: для PayMe такой
+# заказ не участвует ни в одном переходе.
+#
+# Переходы (TRANSITIONS) – единственные допустимые изменения state; по ним же
+# строятся условия в transitions.py и переходы хранилища в памяти.
+
+NEW = 0
+CREATED = 1
+PERFORMED = 2
+CANCELLED = -1
+CANCELLED_AFTER_PERFORM = -2
+
+STATUS_STATES = {
+    "pending": NEW,
+    "одобрен": NEW,
+    "processing": CREATED,
+    "completed": PERFORMED,
+    "cancelled": CANCELLED,
+    "refunded": CANCELLED_AFTER_PERFORM,
+}
+
+# Статус, который записывается при переходе в состояние
+STATE_STATUSES = {
+    NEW: "pending",
+    CREATED: "processing",
+    PERFORMED: "completed",
+    CANCELLED: "cancelled",
+    CANCELLED_AFTER_PERFORM: "refunded",
+}
+
+# Открытые транзакции (частичный индекс *_created_idx секций) и закрытые (архив)
+ACTIVE_STATES = (CREATED,)
+CLOSED_STATES = (PERFORMED, CANCELLED, CANCELLED_AFTER_PERFORM)
+
+# переход -> {из состояния: в состояние}
+TRANSITIONS = {
+    "create": {NEW: CREATED},
+    "perform": {CREATED: PERFORMED},
+    "cancel": {NEW: CANCELLED, CREATED: CANCELLED, PERFORMED: CANCELLED_AFTER_PERFORM},
+}
+
+ORDER_STATE_BACKFILL_BATCH = int(os.getenv("ORDER_STATE_BACKFILL_BATCH", "5000"))
+
+
+def status_state(status):
+    return STATUS_STATES.get(status.lower()) if status else None
+
+
+# Состояние строки заказа: колонка state, для строк без неё – по status
+def state_of(order):
+    state = order.get("state")
+    return state if state is not None else status_state(order.get("status"))
+
+
+def is_transaction_state(state):
+    return state is not None and state != NEW
+
+
+# Состояние после перехода или None, если из текущего состояния переход не допустим
+def next_state(transition_name, state):
+    return TRANSITIONS[transition_name].get(state)
+
+
+def from_states(transition_name):
+    return tuple(TRANSITIONS[transition_name])
+
+
+# SQL-выражение: статус после перехода по текущему cur.state (для SET в transitions.py)
+def next_status_sql(transition_name, column="cur.state"):
+    targets = TRANSITIONS[transition_name]
+    statuses = {STATE_STATUSES[target] for target in targets.values()}
+    if len(statuses) == 1:
+        return f"'{statuses.pop()}'"
+    cases = " ".join(f"WHEN {state} THEN '{STATE_STATUSES[target]}'" for state, target in targets.items())
+    return f"CASE {column} {cases} END"
+
+
+# --- Миграция 12: колонка state ---
+
+ORDER_STATE_FUNCTION_SQL = (
+    "CREATE OR REPLACE FUNCTION order_state(status TEXT) RETURNS SMALLINT AS $$ "
+    "SELECT CASE lower(status) "
+    + " ".join(f"WHEN '{status}' THEN {state}" for status, state in STATUS_STATES.items())
+    + " END::SMALLINT $$ LANGUAGE sql IMMUTABLE"
+)
+
+SET_STATE_TRIGGER_SQL = [
+    """
+    CREATE OR REPLACE FUNCTION orders_set_state() RETURNS trigger AS $$
+    BEGIN
+        NEW.state := order_state(NEW.status);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS orders_set_state ON orders;",
+    """
+    CREATE TRIGGER orders_set_state
+        BEFORE INSERT OR UPDATE OF status ON orders
+        FOR EACH ROW
+        EXECUTE FUNCTION orders_set_state();
+    """,
+]
+
+
+# Колонка добавляется без значения по умолчанию – без перезаписи таблиц;
+# новые и изменённые строки получают state от триггера сразу
+def add_state_column(cur):
+    cur.execute(ORDER_STATE_FUNCTION_SQL)
+    cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS state SMALLINT")
+    cur.execute("ALTER TABLE orders_archive ADD COLUMN IF NOT EXISTS state SMALLINT")
+    for sql in SET_STATE_TRIGGER_SQL:
+        cur.execute(sql)
+
+
+# Заполняет state у существующих строк: по секциям и архиву, диапазонами
+# order_id по batch_size строк, каждый диапазон – своей транзакцией
+# (соединение миграции в autocommit), чтобы не держать блокировки строк долго.
+def backfill_state(cur, batch_size=ORDER_STATE_BACKFILL_BATCH):
+    import partitions
+    tables = [name for name, low, high in partitions.list_partitions(cur)] + [partitions.ARCHIVE_TABLE]
+    for table in tables:
+        cur.execute(f"SELECT min(order_id), max(order_id) FROM {table} WHERE state IS NULL")
+        low, high = cur.fetchone()
+        if low is None:
+            continue
+        updated = 0
+        for start in range(low, high + 1, batch_size):
+            cur.execute(
+                f"UPDATE {table} SET state = order_state(status) "
+                "WHERE order_id >= %s AND order_id < %s AND state IS NULL AND status IS NOT NULL",
+                (start, start + batch_size)
+            )
+            updated += cur.rowcount
+        logging.info("state заполнен: %s, строк %s", table, updated)
+
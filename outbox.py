@@ -0,0 +1,388 @@
+import os
+import math
+import random
+import logging
+import threading
+import datetime
+from collections import defaultdict
+import psycopg2.extras
+import db_pool
+import metrics
+import client_cache
+import telegram_client
+import tracing
+from telegram_client import PermanentError, RetryableError
+
+# Outbox уведомлений в Telegram. Записи добавляются в той же транзакции,
+# что и смена статуса заказа, а доставляют их фоновые потоки – ответ PayMe
+# никогда не ждёт api.telegram.org.
+#
+# Покупателю уходит отдельное сообщение на каждую оплату. Уведомления в группу
+# администраторов (kind = payment_digest) становятся готовыми к отправке на
+# границе окна OUTBOX_DIGEST_WINDOW и уходят одной сводкой на окно – так пик
+# продаж не упирается в лимит Telegram на сообщения в группу.
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "10"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))  # сек.
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))  # сек.
+OUTBOX_LEASE = int(os.getenv("OUTBOX_LEASE", "60"))  # сек., на сколько запись «забирается» воркером
+OUTBOX_DIGEST_WINDOW = int(os.getenv("OUTBOX_DIGEST_WINDOW", "30"))  # сек.; 0 – без сводок
+OUTBOX_DIGEST_MAX = int(os.getenv("OUTBOX_DIGEST_MAX", "200"))  # записей в одной выборке сводок
+OUTBOX_DIGEST_LOCK_ID = 7350004  # ключ pg_try_advisory_xact_lock выборки сводок
+
+PAYMENT_KIND = "payment_success"
+DIGEST_KIND = "payment_digest"
+
+OUTBOX_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS notification_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        order_id INTEGER NOT NULL,
+        chat_id TEXT NOT NULL,
+        kind TEXT NOT NULL DEFAULT 'payment_success',
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        last_error TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        sent_at TIMESTAMPTZ
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS notification_outbox_due_idx "
+    "ON notification_outbox (next_attempt_at) WHERE status = 'pending';",
+]
+
+# Забирает пачку готовых к отправке записей: сдвигает next_attempt_at на время
+# аренды, чтобы другие воркеры их не взяли, пока идёт HTTP-запрос.
+CLAIM_SQL = """
+    UPDATE notification_outbox SET
+        attempts = attempts + 1,
+        next_attempt_at = now() + make_interval(secs => %s)
+    WHERE id IN (
+        SELECT id FROM notification_outbox
+        WHERE status = 'pending' AND next_attempt_at <= now() AND kind <> 'payment_digest'
+        ORDER BY next_attempt_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, order_id, chat_id, kind, attempts
+"""
+# То же для записей сводок: забираются все готовые сразу, чтобы окно ушло одним
+# сообщением. Выборку сводок делает один воркер за раз (advisory-блокировка до
+# конца транзакции): иначе два воркера с SKIP LOCKED поделили бы одно окно
+# на две сводки. Занято – этот воркер сводки пропускает.
+CLAIM_DIGEST_SQL = """
+    WITH claim_lock AS (SELECT pg_try_advisory_xact_lock(%s) AS locked)
+    UPDATE notification_outbox SET
+        attempts = attempts + 1,
+        next_attempt_at = now() + make_interval(secs => %s)
+    WHERE id IN (
+        SELECT o.id FROM notification_outbox o, claim_lock
+        WHERE claim_lock.locked
+          AND o.status = 'pending' AND o.next_attempt_at <= now() AND o.kind = 'payment_digest'
+        ORDER BY o.next_attempt_at
+        LIMIT %s
+        FOR UPDATE OF o SKIP LOCKED
+    )
+    RETURNING id, order_id, chat_id, kind, attempts
+"""
+ENQUEUE_SQL = "INSERT INTO notification_outbox (order_id, chat_id, kind, next_attempt_at) VALUES %s"
+# Колонки заказа для текста уведомлений и сводок
+ORDER_COLUMNS = ("order_id", "user_id", "product", "quantity", "payment_amount", "delivery_comment")
+ORDERS_SQL = f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders WHERE order_id = ANY(%s)"
+MARK_SENT_SQL = "UPDATE notification_outbox SET status = 'sent', sent_at = now(), last_error = NULL WHERE id = %s"
+MARK_FAILED_SQL = (
+    "UPDATE notification_outbox SET status = %s, last_error = %s, "
+    "next_attempt_at = now() + make_interval(secs => %s) WHERE id = %s"
+)
+
+_wakeup = threading.Event()
+_stats_lock = threading.Lock()
+_stats = {"sent": 0, "retried": 0, "dead": 0}
+
+
+# Добавляет уведомления об оплате в outbox. Вызывается внутри транзакции перехода,
+# коммит делает вызывающий.
+def enqueue_payment_notifications(conn, order, group_chat_id=None):
+    rows = notification_rows(order, group_chat_id)
+    if not rows:
+        return
+    cur = conn.cursor()
+    psycopg2.extras.execute_values(cur, ENQUEUE_SQL, rows)
+    cur.close()
+
+
+# Конец текущего окна сводок: все уведомления окна становятся готовыми одновременно
+def digest_due(now=None):
+    now = now if now is not None else datetime.datetime.now(datetime.timezone.utc).timestamp()
+    return datetime.datetime.fromtimestamp(
+        math.ceil(now / OUTBOX_DIGEST_WINDOW) * OUTBOX_DIGEST_WINDOW, datetime.timezone.utc
+    )
+
+
+# Записи outbox для оплаченного заказа: (order_id, chat_id, kind, next_attempt_at)
+def notification_rows(order, group_chat_id=None):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    rows = [(order["order_id"], chat_id, PAYMENT_KIND, now) for chat_id in payment_chat_ids(order)]
+    if group_chat_id:
+        if OUTBOX_DIGEST_WINDOW > 0:
+            rows.append((order["order_id"], str(group_chat_id), DIGEST_KIND, digest_due(now.timestamp())))
+        else:
+            rows.append((order["order_id"], str(group_chat_id), PAYMENT_KIND, now))
+    return rows
+
+
+# Получатель отдельного уведомления об оплате – покупатель; группе – в notification_rows
+def payment_chat_ids(order):
+    return [str(order["user_id"])] if order.get("user_id") is not None else []
+
+
+# Будит воркеры после коммита, чтобы не ждать следующего опроса
+def wake():
+    _wakeup.set()
+
+
+def format_payment_message(order, client):
+    if client:
+        client_info = (f"Клиент: {client.get('name', 'Неизвестный')} "
+                       f"(@{client.get('username', 'нет')})\nТелефон: {client.get('contact', 'не указан')}")
+    else:
+        client_info = "Данные клиента не найдены"
+    return (
+        f"✅ Оплата заказа №{order['order_id']} успешно проведена!\n\n"
+        f"{client_info}\n\n"
+        f"Товар: {order.get('product', 'не указан')}\n"
+        f"Количество: {order.get('quantity', 'не указано')}\n"
+        f"Сумма: {order.get('payment_amount', '0')} сум\n"
+        f"Комментарий к доставке: {order.get('delivery_comment', '')}"
+    )
+
+
+def format_digest_line(order, client):
+    customer = f"{client.get('name') or 'Клиент'} (@{client.get('username') or 'нет'})" if client else "клиент не найден"
+    return (f"№{order['order_id']} · {order.get('product') or 'товар не указан'} × {order.get('quantity') or 1}"
+            f" · {order.get('payment_amount') or 0} сум · {customer}")
+
+
+# Сводки по группам: [(chat_id, части)] и записи без заказа. Длинная сводка
+# делится на несколько сообщений по лимиту Telegram; часть – (текст, записи,
+# чьи строки в ней).
+def plan_digests(rows, orders, clients):
+    by_chat = defaultdict(list)
+    missing = []
+    for row in rows:
+        if row["order_id"] in orders:
+            by_chat[row["chat_id"]].append(row)
+        else:
+            missing.append(row)
+    digests = []
+    for chat_id, chat_rows in by_chat.items():
+        chat_orders = [orders[row["order_id"]] for row in chat_rows]
+        lines = [f"✅ Оплачено заказов: {len(chat_orders)}", ""]
+        lines += [format_digest_line(order, clients.get(order.get("user_id"))) for order in chat_orders]
+        header = len(lines) - len(chat_rows)
+        parts = [
+            ("\n".join(lines[index][:telegram_client.MESSAGE_LIMIT] for index in group),
+             [chat_rows[index - header] for index in group if index >= header])
+            for group in telegram_client.split_lines(lines)
+        ]
+        digests.append((chat_id, parts))
+    return digests, missing
+
+
+# Исходы сводки, из частей которой отправлены первые sent: их записи доставлены,
+# записи остальных частей – повтор (или dead) с ошибкой error. Повтор забирает
+# только их, поэтому уже отправленные части в группу не дублируются.
+def digest_outcomes(parts, sent, error=None):
+    return [
+        delivery_outcome(row, error if index >= sent else None)
+        for index, (_, part_rows) in enumerate(parts) for row in part_rows
+    ]
+
+
+def backoff_delay(attempts):
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+# Итог попытки доставки: (id, новый статус, задержка до повтора, ошибка)
+def delivery_outcome(row, error=None):
+    if error is None:
+        _count("sent")
+        logging.info("Outbox: уведомление %s по заказу %s отправлено в %s", row["id"], row["order_id"], row["chat_id"])
+        return row["id"], "sent", None, None
+    if isinstance(error, RetryableError) and row["attempts"] < OUTBOX_MAX_ATTEMPTS:
+        delay = error.retry_after if error.retry_after is not None else backoff_delay(row["attempts"])
+        _count("retried")
+        logging.warning("Outbox: уведомление %s, повтор через %.1f сек.: %s", row["id"], delay, error)
+        return row["id"], "pending", delay, str(error)
+    _count("dead")
+    if isinstance(error, RetryableError):
+        logging.error("Outbox: уведомление %s исчерпало попытки: %s", row["id"], error)
+    else:
+        logging.error("Outbox: уведомление %s не может быть доставлено: %s", row["id"], error)
+    return row["id"], "dead", None, str(error)
+
+
+def message_for(row, orders, clients):
+    order = orders.get(row["order_id"])
+    if order is None:
+        raise PermanentError("Заказ %s не найден" % row["order_id"])
+    return format_payment_message(order, clients.get(order.get("user_id")))
+
+
+class OutboxWorker:
+    def __init__(self, workers=OUTBOX_WORKERS, batch_size=OUTBOX_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.telegram = telegram_client.TelegramClient(workers)
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info("Outbox: запущено воркеров: %s", self.workers)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.process_batch()
+            except Exception as e:
+                logging.error("Outbox: ошибка обработки пакета: %s", e)
+                processed = 0
+            if processed < self.batch_size:
+                _wakeup.wait(OUTBOX_POLL_INTERVAL)
+                _wakeup.clear()
+
+    # Возвращает (отдельные записи, записи сводок)
+    def _claim(self, conn):
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(CLAIM_SQL, (OUTBOX_LEASE, self.batch_size))
+        rows = cur.fetchall()
+        cur.execute(CLAIM_DIGEST_SQL, (OUTBOX_DIGEST_LOCK_ID, OUTBOX_LEASE, OUTBOX_DIGEST_MAX))
+        digest_rows = cur.fetchall()
+        cur.close()
+        conn.commit()
+        return rows, digest_rows
+
+    def _load_context(self, conn, rows):
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(ORDERS_SQL, (list({r["order_id"] for r in rows}),))
+        orders = {o["order_id"]: o for o in cur.fetchall()}
+        user_ids = list({o["user_id"] for o in orders.values() if o.get("user_id") is not None})
+        cur.close()
+        clients = self._load_clients(conn, user_ids) if user_ids else {}
+        conn.commit()
+        return orders, clients
+
+    # Профили клиентов – через client_cache: в БД идут только отсутствующие в кэше
+    @metrics.timed_db("clients_lookup")
+    def _load_clients(self, conn, user_ids):
+        try:
+            return client_cache.get_clients(conn, user_ids)
+        except Exception as e:
+            logging.error("Outbox: ошибка чтения clients: %s", e)
+            conn.rollback()
+            return {}
+
+    def _finish(self, conn, results):
+        cur = conn.cursor()
+        for row_id, status, next_delay, error in results:
+            if status == "sent":
+                cur.execute(MARK_SENT_SQL, (row_id,))
+            else:
+                cur.execute(MARK_FAILED_SQL, (status, error, next_delay or 0, row_id))
+        cur.close()
+        conn.commit()
+
+    def deliver(self, row, orders, clients):
+        return self.telegram.send(row["chat_id"], message_for(row, orders, clients))
+
+    # Одна сводка по частям: на ошибке части остальные не отправляются (см. digest_outcomes)
+    def deliver_digest(self, chat_id, parts):
+        sent = 0
+        try:
+            for text, _ in parts:
+                self.telegram.send(chat_id, text)
+                sent += 1
+        except Exception as e:
+            return digest_outcomes(parts, sent, e)
+        return digest_outcomes(parts, sent)
+
+    # Пачка – отдельная трасса (tracing.py): загрузка clients и каждая отправка в Telegram
+    def process_batch(self):
+        trace = tracing.start_trace("outbox.batch")
+        try:
+            processed = self._process_batch()
+        except Exception:
+            tracing.finish_trace(trace, error=True)
+            raise
+        tracing.finish_trace(trace, discard=not processed, rows=processed)
+        return processed
+
+    def _process_batch(self):
+        pool = db_pool.get_pool()
+        conn = pool.getconn()
+        try:
+            rows, digest_rows = self._claim(conn)
+            if not rows and not digest_rows:
+                return 0
+            orders, clients = self._load_context(conn, rows + digest_rows)
+        finally:
+            pool.putconn(conn)
+
+        results = []
+        for row in rows:
+            try:
+                self.deliver(row, orders, clients)
+                results.append(delivery_outcome(row))
+            except Exception as e:
+                results.append(delivery_outcome(row, e))
+        digests, missing = plan_digests(digest_rows, orders, clients)
+        for chat_id, parts in digests:
+            results.extend(self.deliver_digest(chat_id, parts))
+        for row in missing:
+            results.append(delivery_outcome(row, PermanentError("Заказ %s не найден" % row["order_id"])))
+
+        conn = pool.getconn()
+        try:
+            self._finish(conn, results)
+        finally:
+            pool.putconn(conn)
+        return len(rows) + len(digest_rows)
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    if _worker is not None:
+        result.update(_worker.telegram.limiter.stats())
+    return result
+
+
+_worker = None
+
+
+def start_workers():
+    global _worker
+    if _worker is None:
+        _worker = OutboxWorker()
+        _worker.start()
+    return _worker
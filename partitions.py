@@ -0,0 +1,593 @@
+import os
+import re
+import sys
+import time
+import logging
+import argparse
+import datetime
+import threading
+import psycopg2
+from dotenv import load_dotenv
+import order_states
+
+# Секционирование orders по месяцам order_time и архив закрытых заказов.
+#
+# orders – секционированная таблица (RANGE по order_time):
+#   orders_legacy  – прежняя таблица целиком, (MINVALUE) .. месяц миграции 8;
+#   orders_pYYYYMM – по секции на месяц, создаются заранее на ORDERS_PARTITIONS_AHEAD месяцев;
+#   orders_default – страховка, если секцию не создали вовремя.
+# Индексы и уникальные индексы (order_id, transaction_id, merchant_trans_id) – у каждой
+# секции свои: Postgres не строит глобальный уникальный индекс без ключа секционирования.
+# Глобальную уникальность этих ключей – по всем секциям и архиву – держит
+# маленькая таблица order_keys (миграция 13): триггеры orders и orders_archive
+# записывают в неё ключи каждого заказа, и дубликат из другой секции падает
+# с unique_violation, как прежде на обычной таблице.
+#
+# Завершённые, отменённые и возвращённые заказы старше ORDERS_ARCHIVE_AFTER_DAYS
+# переносятся пачками в orders_archive (та же структура); пустые старые секции
+# удаляются. Горячие секции остаются маленькими – индексы и VACUUM не растут с объёмом.
+#
+# Секции создаёт не только деплой: в каждом процессе сервера поток
+# PartitionKeeper раз в ORDERS_PARTITIONS_CHECK_INTERVAL сек. досоздаёт
+# недостающие (pg_try_advisory_lock – занято другим процессом, проверка
+# пропускается), поэтому вставки не упираются в конец секций, даже если деплоев
+# долго нет. Секции, которых всё ещё нет, видны в /stats/partitions, /ready и
+# метрике payme_orders_partitions_missing.
+#
+# Запуск: python partitions.py ensure   – на release (Procfile);
+#         python partitions.py maintain – раз в сутки (Heroku Scheduler): секции + архив.
+
+ORDERS_PARTITIONS_AHEAD = int(os.getenv("ORDERS_PARTITIONS_AHEAD", "3"))  # месяцев вперёд
+ORDERS_ARCHIVE_AFTER_DAYS = int(os.getenv("ORDERS_ARCHIVE_AFTER_DAYS", "180"))
+ORDERS_ARCHIVE_BATCH = int(os.getenv("ORDERS_ARCHIVE_BATCH", "5000"))
+ORDERS_PARTITIONS_CHECK_INTERVAL = float(os.getenv("ORDERS_PARTITIONS_CHECK_INTERVAL", "3600"))  # сек.; 0 – не проверять
+ARCHIVE_STATES = list(order_states.CLOSED_STATES)
+
+PARTITIONS_LOCK_ID = 7350002  # ключ pg_advisory_lock обслуживания секций
+
+LEGACY_PARTITION = "orders_legacy"
+DEFAULT_PARTITION = "orders_default"
+ARCHIVE_TABLE = "orders_archive"
+KEYS_TABLE = "order_keys"
+ORDER_KEYS_BACKFILL_BATCH = int(os.getenv("ORDER_KEYS_BACKFILL_BATCH", "5000"))
+
+
+# Индексы, которые нужны горячему пути в каждой секции и в архиве: {table}_{суффикс}
+INDEXES = [
+    ("order_id_key", "UNIQUE", "(order_id)"),
+    ("transaction_id_key", "UNIQUE", "(transaction_id)"),
+    ("merchant_trans_id_key", "UNIQUE", "(merchant_trans_id)"),
+    ("create_time_idx", "", "(create_time, order_id) WHERE transaction_id IS NOT NULL"),
+    ("order_time_idx", "", "(order_time, order_id)"),
+    # Просроченные транзакции для expiry.py
+    ("processing_idx", "", "(create_time) WHERE status = 'processing'"),
+]
+
+# Индексы по orders.state – колонка появляется в миграции 12, поэтому они не входят
+# в INDEXES (миграции 8 и 9 строят INDEXES ещё без неё). Новым секциям их добавляет
+# create_partition, когда колонка уже есть.
+STATE_INDEXES = [
+    # Открытые транзакции (state = 1) для expiry.py
+    ("created_idx", "", f"(create_time) WHERE state = {order_states.CREATED}"),
+]
+
+
+def index_sql(table, concurrently=False, indexes=INDEXES):
+    mode = " CONCURRENTLY" if concurrently else ""
+    return [
+        f"CREATE {unique}{' ' if unique else ''}INDEX{mode} IF NOT EXISTS {table}_{suffix} ON {table} {definition}"
+        for suffix, unique, definition in indexes
+    ]
+
+
+def _has_state_column(cur):
+    cur.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = 'orders' AND column_name = 'state'"
+    )
+    return cur.fetchone() is not None
+
+
+def partition_name(month):
+    return f"orders_p{month:%Y%m}"
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+_BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def _parse_bound(value):
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.datetime.fromisoformat(value.strip("'"))
+
+
+# Секции orders: [(имя, начало или None, конец или None)], DEFAULT – с границами (None, None)
+def list_partitions(cur):
+    cur.execute(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'orders'::regclass "
+        "ORDER BY c.relname"
+    )
+    partitions = []
+    for name, bound in cur.fetchall():
+        match = _BOUND_RE.search(bound)
+        if match is None:
+            partitions.append((name, None, None))
+        else:
+            partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return partitions
+
+
+def _covered(partitions, start, end):
+    for name, low, high in partitions:
+        if name == DEFAULT_PARTITION:
+            continue
+        if (low is None or low < end) and (high is None or high > start):
+            return True
+    return False
+
+
+# Создаёт секцию месяца: отдельная таблица с индексами, в неё переносятся строки
+# этого месяца из DEFAULT (если успели туда попасть), затем ATTACH. Одна транзакция.
+def create_partition(cur, month):
+    name = partition_name(month)
+    start, end = month, add_months(month, 1)
+    cur.execute("BEGIN")
+    try:
+        cur.execute(f"CREATE TABLE {name} (LIKE orders INCLUDING DEFAULTS)")
+        for sql in index_sql(name):
+            cur.execute(sql)
+        if _has_state_column(cur):
+            for sql in index_sql(name, indexes=STATE_INDEXES):
+                cur.execute(sql)
+        cur.execute(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE order_time >= %s AND order_time < %s RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved",
+            (start, end)
+        )
+        if cur.rowcount:
+            logging.warning("Секция %s: перенесено из %s строк: %s", name, DEFAULT_PARTITION, cur.rowcount)
+        cur.execute(f"ALTER TABLE orders ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (start, end))
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    logging.info("Создана секция %s [%s, %s)", name, start, end)
+    return name
+
+
+# Месяцы с текущего на months_ahead вперёд, для которых нет секции
+def missing_months(cur, months_ahead=ORDERS_PARTITIONS_AHEAD):
+    cur.execute("SELECT date_trunc('month', localtimestamp)")
+    current = cur.fetchone()[0]
+    partitions = list_partitions(cur)
+    months = [add_months(current, offset) for offset in range(months_ahead + 1)]
+    return [month for month in months if not _covered(partitions, month, add_months(month, 1))]
+
+
+# Секции с текущего месяца на months_ahead вперёд. Идемпотентна; соединение – в autocommit.
+# wait=False – если обслуживание секций уже идёт в другом процессе, возвращает None.
+def ensure_partitions(conn, months_ahead=ORDERS_PARTITIONS_AHEAD, wait=True):
+    conn.autocommit = True
+    cur = conn.cursor()
+    if wait:
+        cur.execute("SELECT pg_advisory_lock(%s)", (PARTITIONS_LOCK_ID,))
+    else:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (PARTITIONS_LOCK_ID,))
+        if not cur.fetchone()[0]:
+            cur.close()
+            return None
+    try:
+        return [create_partition(cur, month) for month in missing_months(cur, months_ahead)]
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (PARTITIONS_LOCK_ID,))
+        cur.close()
+
+
+# Перенос пачки закрытых заказов старше cutoff в архив. Проход по (order_time, order_id)
+# с запоминанием позиции: незакрытые заказы не просматриваются повторно.
+ARCHIVE_BATCH_SQL = f"""
+WITH batch AS (
+    SELECT order_id, order_time FROM orders
+    WHERE order_time < %(cutoff)s
+      AND (order_time, order_id) > (%(after_time)s, %(after_id)s)
+      AND state = ANY(%(states)s)
+    ORDER BY order_time, order_id
+    LIMIT %(limit)s
+    FOR UPDATE SKIP LOCKED
+), moved AS (
+    DELETE FROM orders o USING batch b
+    WHERE o.order_id = b.order_id AND o.order_time = b.order_time
+    RETURNING o.*
+), archived AS (
+    INSERT INTO {ARCHIVE_TABLE} SELECT * FROM moved RETURNING 1
+)
+SELECT (SELECT count(*) FROM archived), b.order_time, b.order_id
+FROM batch b ORDER BY b.order_time DESC, b.order_id DESC LIMIT 1
+"""
+
+
+def archive_orders(conn, older_than_days=ORDERS_ARCHIVE_AFTER_DAYS, batch_size=ORDERS_ARCHIVE_BATCH):
+    conn.autocommit = False
+    cur = conn.cursor()
+    cur.execute("SELECT localtimestamp - make_interval(days => %s)", (older_than_days,))
+    cutoff = cur.fetchone()[0]
+    conn.commit()
+    params = {
+        "cutoff": cutoff, "after_time": datetime.datetime.min, "after_id": 0,
+        "states": ARCHIVE_STATES, "limit": batch_size,
+    }
+    total = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            cur.execute(ARCHIVE_BATCH_SQL, params)
+            row = cur.fetchone()
+            conn.commit()
+            if row is None:
+                break
+            total += row[0]
+            params["after_time"], params["after_id"] = row[1], row[2]
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    logging.info("Архивировано заказов старше %s: %s за %.1f сек.", cutoff, total, time.perf_counter() - started)
+    return total, cutoff
+
+
+# Удаляет пустые секции, целиком лежащие раньше cutoff (после архивации)
+def drop_empty_partitions(conn, cutoff):
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SELECT pg_advisory_lock(%s)", (PARTITIONS_LOCK_ID,))
+    dropped = []
+    try:
+        for name, low, high in list_partitions(cur):
+            if name == DEFAULT_PARTITION or high is None or high > cutoff:
+                continue
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {name})")
+            if cur.fetchone()[0]:
+                continue
+            cur.execute(f"ALTER TABLE orders DETACH PARTITION {name}")
+            cur.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+            logging.info("Удалена пустая секция %s", name)
+        return dropped
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (PARTITIONS_LOCK_ID,))
+        cur.close()
+
+
+# --- Проверка секций в процессе сервера ---
+
+_status_lock = threading.Lock()
+_status = {"checks": 0, "skipped_locked": 0, "created": 0, "errors": 0, "missing": None, "last_check": None}
+
+
+# Досоздаёт секции (если их не создаёт другой процесс) и запоминает, каких ещё нет.
+# Своё короткое соединение: проверка редкая, пул запросов она не занимает.
+def check_partitions(months_ahead=ORDERS_PARTITIONS_AHEAD):
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"), sslmode=os.getenv("DB_SSLMODE", "require"))
+    try:
+        created = ensure_partitions(conn, months_ahead, wait=False)
+        cur = conn.cursor()
+        missing = [partition_name(month) for month in missing_months(cur, months_ahead)]
+        cur.close()
+    finally:
+        conn.close()
+    with _status_lock:
+        _status["checks"] += 1
+        _status["skipped_locked"] += created is None
+        _status["created"] += len(created or [])
+        _status["missing"] = missing
+        _status["last_check"] = time.time()
+    if missing:
+        logging.error("Нет секций orders: %s – вставки в эти месяцы упадут (python partitions.py ensure)", missing)
+    return missing
+
+
+def stats():
+    with _status_lock:
+        stats = dict(_status)
+    stats["missing_count"] = len(stats["missing"]) if stats["missing"] is not None else None
+    return stats
+
+
+class PartitionKeeper:
+    def __init__(self, interval=ORDERS_PARTITIONS_CHECK_INTERVAL, months_ahead=ORDERS_PARTITIONS_AHEAD):
+        self.interval = interval
+        self.months_ahead = months_ahead
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="partition-keeper", daemon=True)
+        self._thread.start()
+        logging.info("Проверка секций orders: каждые %s сек.", self.interval)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # Первая проверка – сразу при старте процесса
+    def _run(self):
+        while True:
+            try:
+                check_partitions(self.months_ahead)
+            except Exception as e:
+                with _status_lock:
+                    _status["errors"] += 1
+                logging.error("Ошибка проверки секций orders: %s", e)
+            if self._stop.wait(self.interval):
+                return
+
+
+_keeper = None
+
+
+def start_keeper():
+    global _keeper
+    if _keeper is None and ORDERS_PARTITIONS_CHECK_INTERVAL > 0:
+        _keeper = PartitionKeeper()
+        _keeper.start()
+    return _keeper
+
+
+def maintain(conn, months_ahead=ORDERS_PARTITIONS_AHEAD, older_than_days=ORDERS_ARCHIVE_AFTER_DAYS,
+             batch_size=ORDERS_ARCHIVE_BATCH):
+    created = ensure_partitions(conn, months_ahead)
+    archived, cutoff = archive_orders(conn, older_than_days, batch_size)
+    dropped = drop_empty_partitions(conn, cutoff)
+    return {"created": created, "archived": archived, "dropped": dropped}
+
+
+# --- Шаги миграции 8: orders -> секционированная таблица ---
+#
+# Прежняя таблица не копируется, а подключается секцией orders_legacy.
+# CHECK-ограничение с той же границей проверяется заранее (VALIDATE не блокирует
+# запись), поэтому SET NOT NULL и ATTACH PARTITION не сканируют таблицу под
+# эксклюзивной блокировкой. Индексы orders_legacy остаются прежними.
+
+LEGACY_BOUND_CONSTRAINT = "orders_legacy_bound"
+# Индексы, которые у orders_legacy уже есть под именами прежней таблицы orders_*
+LEGACY_INDEXES = {"order_id_key", "transaction_id_key", "merchant_trans_id_key", "create_time_idx", "order_time_idx"}
+
+
+def _is_partitioned(cur):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = 'orders'::regclass")
+    return cur.fetchone()[0] == "p"
+
+
+def _legacy_bound(cur):
+    cur.execute(
+        "SELECT obj_description(oid, 'pg_constraint') FROM pg_constraint WHERE conname = %s",
+        (LEGACY_BOUND_CONSTRAINT,)
+    )
+    row = cur.fetchone()
+    return datetime.datetime.fromisoformat(row[0]) if row and row[0] else None
+
+
+# Граница legacy – начало следующего месяца: текущий месяц дописывается в legacy,
+# дальше строки идут в месячные секции
+def add_legacy_bound(cur):
+    if _is_partitioned(cur):
+        return
+    cur.execute("SELECT date_trunc('month', localtimestamp) + interval '1 month'")
+    bound = cur.fetchone()[0]
+    cur.execute(f"ALTER TABLE orders DROP CONSTRAINT IF EXISTS {LEGACY_BOUND_CONSTRAINT}")
+    cur.execute(
+        f"ALTER TABLE orders ADD CONSTRAINT {LEGACY_BOUND_CONSTRAINT} "
+        "CHECK (order_time IS NOT NULL AND order_time < %s) NOT VALID",
+        (bound,)
+    )
+    cur.execute(f"COMMENT ON CONSTRAINT {LEGACY_BOUND_CONSTRAINT} ON orders IS %s", (bound.isoformat(),))
+    cur.execute(f"ALTER TABLE orders VALIDATE CONSTRAINT {LEGACY_BOUND_CONSTRAINT}")
+
+
+# Индекс для прохода архивации по старым строкам legacy – строится без блокировки записи
+def create_legacy_order_time_index(cur):
+    if _is_partitioned(cur):
+        return
+    cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_order_time_idx ON orders (order_time, order_id)")
+
+
+def convert_to_partitioned(cur):
+    if _is_partitioned(cur):
+        return
+    bound = _legacy_bound(cur)
+    cur.execute("BEGIN")
+    try:
+        cur.execute("LOCK TABLE orders IN ACCESS EXCLUSIVE MODE")
+        cur.execute(f"ALTER TABLE orders RENAME TO {LEGACY_PARTITION}")
+        cur.execute(f"ALTER TABLE {LEGACY_PARTITION} ALTER COLUMN order_time SET NOT NULL")
+        cur.execute(f"DROP TRIGGER IF EXISTS orders_notify_change ON {LEGACY_PARTITION}")
+        cur.execute(
+            f"CREATE TABLE orders (LIKE {LEGACY_PARTITION} INCLUDING DEFAULTS) PARTITION BY RANGE (order_time)"
+        )
+        cur.execute("ALTER SEQUENCE IF EXISTS orders_order_id_seq OWNED BY orders.order_id")
+        cur.execute(
+            f"ALTER TABLE orders ATTACH PARTITION {LEGACY_PARTITION} FOR VALUES FROM (MINVALUE) TO (%s)",
+            (bound,)
+        )
+        cur.execute(f"CREATE TABLE {DEFAULT_PARTITION} (LIKE orders INCLUDING DEFAULTS)")
+        for sql in index_sql(DEFAULT_PARTITION):
+            cur.execute(sql)
+        cur.execute(f"ALTER TABLE orders ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+        cur.execute(
+            """
+            CREATE TRIGGER orders_notify_change
+                AFTER UPDATE ON orders
+                FOR EACH ROW
+                WHEN (OLD.status IS DISTINCT FROM NEW.status
+                      OR OLD.transaction_id IS DISTINCT FROM NEW.transaction_id)
+                EXECUTE FUNCTION notify_order_change();
+            """
+        )
+        cur.execute(f"ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT {LEGACY_BOUND_CONSTRAINT}")
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+
+
+def create_archive(cur):
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (LIKE orders INCLUDING DEFAULTS)")
+    for sql in index_sql(ARCHIVE_TABLE):
+        cur.execute(sql)
+
+
+# Добавляет новые индексы из INDEXES всем существующим секциям без блокировки записи.
+# Секции orders_legacy индексы с её прежними именами не нужны – у неё есть свои.
+def create_partition_indexes(cur, indexes=INDEXES):
+    tables = [name for name, low, high in list_partitions(cur)] + [ARCHIVE_TABLE]
+    for table in tables:
+        for (suffix, unique, definition), sql in zip(indexes, index_sql(table, True, indexes)):
+            if table == LEGACY_PARTITION and suffix in LEGACY_INDEXES:
+                continue
+            cur.execute(
+                "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                "WHERE c.relname = %s AND NOT i.indisvalid",
+                (f"{table}_{suffix}",)
+            )
+            if cur.fetchone():
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {table}_{suffix}")
+            cur.execute(sql)
+
+
+# Миграция 12: индексы STATE_INDEXES существующим секциям и архиву
+def create_state_indexes(cur):
+    create_partition_indexes(cur, STATE_INDEXES)
+
+
+# --- Миграция 13: глобальные ключи заказов ---
+#
+# Строка order_keys живёт, пока заказ есть в orders или в архиве: перенос в архив
+# и обратно (RESTORE_SQL) только переключает archived. Вставка в orders с уже
+# занятым order_id (не из архива) – unique_violation; transaction_id и
+# merchant_trans_id проверяют уникальные ограничения самой order_keys.
+ORDER_KEYS_DDL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {KEYS_TABLE} (
+        order_id INTEGER PRIMARY KEY,
+        order_time TIMESTAMP NOT NULL,
+        merchant_trans_id TEXT UNIQUE,
+        transaction_id TEXT UNIQUE,
+        archived BOOLEAN NOT NULL DEFAULT FALSE
+    );
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION order_keys_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM {KEYS_TABLE} WHERE order_id = OLD.order_id AND NOT archived;
+            RETURN NULL;
+        END IF;
+        INSERT INTO {KEYS_TABLE} AS k (order_id, order_time, merchant_trans_id, transaction_id, archived)
+        VALUES (NEW.order_id, NEW.order_time, NEW.merchant_trans_id, NEW.transaction_id,
+                TG_TABLE_NAME = '{ARCHIVE_TABLE}')
+        ON CONFLICT (order_id) DO UPDATE SET
+            order_time = EXCLUDED.order_time,
+            merchant_trans_id = EXCLUDED.merchant_trans_id,
+            transaction_id = EXCLUDED.transaction_id,
+            archived = EXCLUDED.archived
+        WHERE TG_OP = 'UPDATE' OR k.archived <> EXCLUDED.archived;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'order_id % уже занят', NEW.order_id USING ERRCODE = 'unique_violation';
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS orders_keys_sync ON orders;",
+    """
+    CREATE TRIGGER orders_keys_sync
+        AFTER INSERT OR DELETE OR UPDATE OF order_id, order_time, merchant_trans_id, transaction_id ON orders
+        FOR EACH ROW
+        EXECUTE FUNCTION order_keys_sync();
+    """,
+    f"DROP TRIGGER IF EXISTS {ARCHIVE_TABLE}_keys_sync ON {ARCHIVE_TABLE};",
+    f"""
+    CREATE TRIGGER {ARCHIVE_TABLE}_keys_sync
+        AFTER INSERT ON {ARCHIVE_TABLE}
+        FOR EACH ROW
+        EXECUTE FUNCTION order_keys_sync();
+    """,
+]
+
+
+# Ключи уже существующих заказов – после триггеров, диапазонами order_id, каждый
+# диапазон своей транзакцией (соединение миграции в autocommit). Строки, чьи ключи
+# уже заняты заказом из другой секции, не записываются – о них предупреждение в лог:
+# такие дубликаты нужно разобрать вручную, переход статуса по ним будет отклонён.
+def backfill_order_keys(cur, batch_size=ORDER_KEYS_BACKFILL_BATCH):
+    tables = [name for name, low, high in list_partitions(cur)] + [ARCHIVE_TABLE]
+    for table in tables:
+        cur.execute(f"SELECT min(order_id), max(order_id) FROM {table}")
+        low, high = cur.fetchone()
+        if low is None:
+            continue
+        archived = table == ARCHIVE_TABLE
+        inserted = 0
+        for start in range(low, high + 1, batch_size):
+            cur.execute(
+                f"WITH rows AS (SELECT order_id, order_time, merchant_trans_id, transaction_id FROM {table} "
+                "WHERE order_id >= %s AND order_id < %s), "
+                f"ins AS (INSERT INTO {KEYS_TABLE} (order_id, order_time, merchant_trans_id, transaction_id, archived) "
+                "SELECT order_id, order_time, merchant_trans_id, transaction_id, %s FROM rows "
+                "ON CONFLICT DO NOTHING RETURNING order_id) "
+                "SELECT (SELECT count(*) FROM ins), (SELECT array_agg(r.order_id) FROM rows r "
+                "WHERE r.order_id NOT IN (SELECT order_id FROM ins) "
+                f"AND NOT EXISTS (SELECT 1 FROM {KEYS_TABLE} k WHERE k.order_id = r.order_id))",
+                (start, start + batch_size, archived)
+            )
+            done, conflicts = cur.fetchone()
+            inserted += done
+            if conflicts:
+                logging.warning("order_keys: ключи заняты другим заказом, %s: order_id %s", table, conflicts)
+        logging.info("order_keys заполнена: %s, строк %s", table, inserted)
+
+
+def create_initial_partitions(cur):
+    ensure_partitions(cur.connection)
+
+
+def main(argv=None):
+    load_dotenv()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Секции и архив таблицы orders")
+    parser.add_argument("command", choices=["ensure", "archive", "maintain", "status"])
+    parser.add_argument("--months-ahead", type=int, default=ORDERS_PARTITIONS_AHEAD)
+    parser.add_argument("--older-than-days", type=int, default=ORDERS_ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ORDERS_ARCHIVE_BATCH)
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"), sslmode=os.getenv("DB_SSLMODE", "require"))
+    try:
+        if args.command == "ensure":
+            created = ensure_partitions(conn, args.months_ahead)
+            print(f"Создано секций: {len(created)} {' '.join(created)}")
+        elif args.command == "archive":
+            archived, cutoff = archive_orders(conn, args.older_than_days, args.batch_size)
+            dropped = drop_empty_partitions(conn, cutoff)
+            print(f"Архивировано заказов: {archived}, удалено пустых секций: {len(dropped)}")
+        elif args.command == "maintain":
+            print(maintain(conn, args.months_ahead, args.older_than_days, args.batch_size))
+        else:
+            cur = conn.cursor()
+            for name, low, high in list_partitions(cur):
+                cur.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", (name,))
+                print(f"  {name:<16} {str(low or '-'):<20} {str(high or '-'):<20} ~{cur.fetchone()[0]} строк")
+            cur.close()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
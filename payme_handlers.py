@@ -0,0 +1,390 @@
+import os
+import time
+import inspect
+import logging
+from collections import namedtuple
+import transitions
+import order_states
+import response_cache
+import rpc_codec
+import product_catalog
+import tracing
+
+# Обработчики методов JSON-RPC PayMe, общие для синхронного (Flask, server.py)
+# и асинхронного (ASGI, asgi_server.py) режимов.
+#
+# Обработчики не делают ввод-вывод сами: за данными они обращаются через
+# yield op(...), а выполняет операцию бэкенд режима – run_sync() вызывает
+# одноимённый метод синхронного бэкенда, run_async() – асинхронного.
+# Бэкенды – хранилища заказов из order_repository.py (postgres или memory).
+# Операции бэкенда:
+#   get_order_by_merchant_trans_id(merchant_trans_id) -> заказ или None
+#   get_order_by_transaction(transaction_id) -> заказ или None
+#   get_order_for_receipt(merchant_trans_id) -> заказ с product, quantity, items или None
+#   apply_transition(transition, key, params, notify=False) -> (applied, заказ)
+#     (notify – поставить уведомления об оплате в outbox в той же транзакции)
+#   open_statement(from_time, to_time) -> итератор (в ASGI – асинхронный) заказов
+#     с create_time в периоде, по возрастанию; читается по мере отправки ответа
+
+PAYME_MERCHANT_ID = os.getenv("PAYME_MERCHANT_ID")  # Значение для PayMe
+MERCHANT_KEY = os.getenv("MERCHANT_KEY")
+# Ожидаемый заголовок Authorization вычисляется один раз при старте
+EXPECTED_AUTH = rpc_codec.basic_auth_header("Paycom", MERCHANT_KEY)
+
+Op = namedtuple("Op", ["name", "args"])
+
+def op(name, *args):
+    return Op(name, args)
+
+def current_timestamp():
+    return int(round(time.time() * 1000))
+
+# Ключ поиска заказа (account.order_id, params.id) – всегда строка: колонки
+# ключей TEXT, и asyncpg, в отличие от psycopg2, число вместо строки не
+# принимает. Целое число приводится к строке, прочее (null, дробные, списки,
+# объекты) – None, то есть заказ или транзакция не найдены.
+def lookup_key(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+# Функция проверки суммы с учетом платежной системы:
+# Для Click берём значение из payment_amount (и умножаем на 100 для сравнения с копейками),
+# а для PayMe – используем значение из payme_amount, которое уже хранится в тийинах.
+def is_amount_correct(order, callback_amount):
+    payment_system = order.get("payment_system", "payme").lower()
+    if payment_system == "click":
+        return int(order["payment_amount"]) * 100 == int(callback_amount)
+    elif payment_system == "payme":
+        return int(order["payme_amount"]) == int(callback_amount)
+    else:
+        return int(order["payment_amount"]) == int(callback_amount)
+
+def check_perform_transaction(payload):
+    params = payload.get("params", {})
+    account = params.get("account", {})
+    merchant_trans_id = lookup_key(account.get("order_id"))  # Здесь order_id содержит UUID (merchant_trans_id)
+    if merchant_trans_id is None:
+        return error_order_id(payload)
+    order = yield op("get_order_for_receipt", merchant_trans_id)
+    if not order:
+        return error_order_id(payload)
+    if not is_amount_correct(order, params.get("amount")):
+        return error_amount(payload)
+    # Если заказ для PayMe, то используем значение payme_amount в чеке,
+    # иначе – значение payment_amount.
+    if order.get("payment_system", "payme").lower() == "payme":
+        amount = order["payme_amount"]
+    else:
+        amount = order["payment_amount"]
+    # Позиции чека – товары заказа с кодами из справочника в памяти (product_catalog.py)
+    items = product_catalog.receipt_items(order, int(amount))
+    return {
+        "id": payload.get("id"),
+        "result": {
+            "allow": True,
+            "detail": {
+                "receipt_type": 0,
+                "items": items
+            }
+        },
+        "error": None
+    }
+
+def create_transaction(payload):
+    params = payload.get("params", {})
+    account = params.get("account", {})
+    merchant_trans_id = lookup_key(account.get("order_id"))
+    if merchant_trans_id is None:
+        return error_order_id(payload)
+    transaction_id = lookup_key(params.get("id"))
+    if transaction_id is None:
+        return error_transaction(payload)
+    applied, order = yield op("apply_transition", transitions.CREATE, merchant_trans_id, {
+        "now": current_timestamp(),
+        "transaction_id": transaction_id,
+        "amount": params.get("amount")
+    })
+    if not order:
+        return error_order_id(payload)
+    if applied:
+        return {
+            "id": payload.get("id"),
+            "result": {
+                "create_time": order["create_time"],
+                "transaction": "000" + str(order["order_id"]),
+                "state": 1
+            }
+        }
+    if not is_amount_correct(order, params.get("amount")):
+        return error_amount(payload)
+    if order_states.state_of(order) == order_states.CREATED:
+        if order.get("transaction_id") == transaction_id:
+            return {
+                "id": payload.get("id"),
+                "result": {
+                    "create_time": order.get("create_time"),
+                    "transaction": "000" + str(order["order_id"]),
+                    "state": 1
+                }
+            }
+        else:
+            return error_has_another_transaction(payload)
+    else:
+        return error_unknown(payload)
+
+@response_cache.cached("PerformTransaction")
+def perform_transaction(payload):
+    params = payload.get("params", {})
+    transaction_id = lookup_key(params.get("id"))
+    if transaction_id is None:
+        return error_transaction(payload)
+    applied, order = yield op("apply_transition", transitions.PERFORM, transaction_id, {
+        "now": current_timestamp()
+    }, True)
+    if not order:
+        return error_transaction(payload)
+    order_id = order["order_id"]
+    if applied:
+        return {
+            "id": payload.get("id"),
+            "result": {
+                "transaction": "000" + str(order_id),
+                "perform_time": order["perform_time"],
+                "state": 2
+            }
+        }
+    elif order_states.state_of(order) == order_states.PERFORMED:
+        return {
+            "id": payload.get("id"),
+            "result": {
+                "transaction": "000" + str(order_id),
+                "perform_time": order.get("perform_time"),
+                "state": 2
+            }
+        }
+    elif order_states.state_of(order) in (order_states.CANCELLED, order_states.CANCELLED_AFTER_PERFORM):
+        return error_cancelled_transaction(payload)
+    else:
+        return error_unknown(payload)
+
+@response_cache.cached("CheckTransaction")
+def check_transaction(payload):
+    params = payload.get("params", {})
+    transaction_id = lookup_key(params.get("id"))
+    if transaction_id is None:
+        return error_transaction(payload)
+    order = yield op("get_order_by_transaction", transaction_id)
+    if not order:
+        return error_transaction(payload)
+    order_id = order["order_id"]
+    if order.get("transaction_id") != transaction_id:
+        return error_transaction(payload)
+    # state заказа совпадает с состоянием транзакции PayMe (order_states.py)
+    state_val = order_states.state_of(order)
+    if not order_states.is_transaction_state(state_val):
+        return error_transaction(payload)
+    return {
+        "id": payload.get("id"),
+        "result": {
+            "create_time": order.get("create_time", 0),
+            "perform_time": order.get("perform_time", 0),
+            "cancel_time": order.get("cancel_time", 0),
+            "transaction": "000" + str(order_id),
+            "state": state_val,
+            "reason": order.get("cancel_reason")
+        },
+        "error": None
+    }
+
+@response_cache.cached("CancelTransaction")
+def cancel_transaction(payload):
+    params = payload.get("params", {})
+    transaction_id = lookup_key(params.get("id"))
+    if transaction_id is None:
+        return error_transaction(payload)
+    applied, order = yield op("apply_transition", transitions.CANCEL, transaction_id, {
+        "now": current_timestamp(),
+        "reason": params.get("reason")
+    })
+    if not order:
+        return error_transaction(payload)
+    state_val = order_states.state_of(order)
+    if state_val not in (order_states.CANCELLED, order_states.CANCELLED_AFTER_PERFORM):
+        return error_cancel(payload)
+    return {
+        "id": payload.get("id"),
+        "result": {
+            "transaction": "000" + str(order["order_id"]),
+            "cancel_time": order.get("cancel_time"),
+            "state": state_val
+        }
+    }
+
+# Состояние транзакции в выписке; заказ с неизвестным статусом – как созданная транзакция
+def statement_state(order):
+    state = order_states.state_of(order)
+    return state if order_states.is_transaction_state(state) else order_states.CREATED
+
+# Транзакция выписки GetStatement в формате PayMe
+def statement_transaction(order):
+    if (order.get("payment_system") or "payme").lower() == "payme":
+        amount = order["payme_amount"]
+    elif order.get("payment_system").lower() == "click":
+        amount = order["payment_amount"] * 100
+    else:
+        amount = order["payment_amount"]
+    return {
+        "id": order["transaction_id"],
+        "time": order["create_time"],
+        "amount": amount,
+        "account": {"order_id": order["merchant_trans_id"]},
+        "create_time": order["create_time"],
+        "perform_time": order["perform_time"] or 0,
+        "cancel_time": order["cancel_time"] or 0,
+        "transaction": "000" + str(order["order_id"]),
+        "state": statement_state(order),
+        "reason": order["cancel_reason"],
+        "receivers": None
+    }
+
+# Выписка за период: строки не собираются в список, а сериализуются потоково
+def get_statement(payload):
+    params = payload.get("params", {})
+    from_time, to_time = params.get("from"), params.get("to")
+    if not isinstance(from_time, int) or not isinstance(to_time, int) or from_time > to_time:
+        return error_invalid_params(payload)
+    rows = yield op("open_statement", from_time, to_time)
+    return rpc_codec.StreamedResponse(payload.get("id"), "transactions", rows, statement_transaction)
+
+def change_password(payload):
+    params = payload.get("params", {})
+    new_password = params.get("password")
+    if new_password != MERCHANT_KEY:
+        return {
+            "id": payload.get("id"),
+            "result": {"success": True},
+            "error": None
+        }
+    return error_password(payload)
+
+# --- Функции формирования ошибок ---
+# Конверты ошибок сериализуются один раз при импорте (rpc_codec.ErrorEnvelope),
+# на каждый ответ подставляется только id.
+def _envelope(code, text, data):
+    return rpc_codec.ErrorEnvelope({"code": code, "message": {"ru": text, "uz": text, "en": text}, "data": data})
+
+_INVALID_JSON = _envelope(-32700, "Could not parse JSON", None)
+_ORDER_ID = _envelope(-31099, "Order number cannot be found", "order")
+_AMOUNT = _envelope(-31001, "Order amount is incorrect", "amount")
+_HAS_ANOTHER_TRANSACTION = _envelope(-31099, "Other transaction for this order is in progress", "order")
+_UNKNOWN = _envelope(-31008, "Unknown error", None)
+_TRANSACTION = _envelope(-31003, "Transaction number is wrong", "id")
+_CANCELLED_TRANSACTION = _envelope(-31008, "Transaction was cancelled or refunded", "order")
+_CANCEL = _envelope(-31007, "It is impossible to cancel. The order is completed", "order")
+_PASSWORD = _envelope(-32400, "Cannot change the password", "password")
+_AUTHORIZATION = _envelope(-32504, "Error during authorization", None)
+_INVALID_PARAMS = _envelope(-32600, "Invalid request parameters", None)
+
+def error_invalid_json():
+    return _INVALID_JSON(0)
+
+def error_order_id(payload):
+    return _ORDER_ID(payload.get("id", 0))
+
+def error_amount(payload):
+    return _AMOUNT(payload.get("id", 0))
+
+def error_has_another_transaction(payload):
+    return _HAS_ANOTHER_TRANSACTION(payload.get("id", 0))
+
+def error_unknown(payload):
+    return _UNKNOWN(payload.get("id", 0))
+
+def error_transaction(payload):
+    return _TRANSACTION(payload.get("id", 0))
+
+def error_cancelled_transaction(payload):
+    return _CANCELLED_TRANSACTION(payload.get("id", 0))
+
+def error_cancel(payload):
+    return _CANCEL(payload.get("id", 0))
+
+def error_password(payload):
+    return _PASSWORD(payload.get("id", 0))
+
+def error_authorization(payload):
+    return _AUTHORIZATION(payload.get("id", 0))
+
+def error_invalid_params(payload):
+    return _INVALID_PARAMS(payload.get("id", 0))
+
+# data зависит от запроса (имя метода), поэтому конверт собирается каждый раз
+def error_unknown_method(payload):
+    return {
+        "error": {"code": -32601, "message": {"ru": "Unknown method", "uz": "Unknown method", "en": "Unknown method"}, "data": payload.get("method", "")},
+        "result": None,
+        "id": payload.get("id", 0)
+    }
+
+METHODS = {
+    "CheckPerformTransaction": check_perform_transaction,
+    "CreateTransaction": create_transaction,
+    "PerformTransaction": perform_transaction,
+    "CheckTransaction": check_transaction,
+    "CancelTransaction": cancel_transaction,
+    "GetStatement": get_statement,
+    "ChangePassword": change_password,
+}
+
+# Проверка merchant и заголовка авторизации, затем вызов обработчика метода
+def dispatch(payload, auth_header):
+    with tracing.span("auth"):
+        merchant_in_payload = payload.get("params", {}).get("merchant")
+        merchant_ok = not merchant_in_payload or merchant_in_payload == PAYME_MERCHANT_ID
+        auth_ok = merchant_ok and rpc_codec.auth_matches(auth_header, EXPECTED_AUTH)
+    if not merchant_ok:
+        logging.warning("Merchant ID mismatch: payload merchant '%s' != PAYME_MERCHANT_ID '%s'", merchant_in_payload, PAYME_MERCHANT_ID)
+        return error_authorization(payload)
+
+    if not auth_ok:
+        logging.warning("Authorization failed for method %s", payload.get("method"))
+        return error_authorization(payload)
+
+    handler = METHODS.get(payload.get("method", ""))
+    if handler is None:
+        return error_unknown_method(payload)
+    response = handler(payload)
+    if inspect.isgenerator(response):
+        response = yield from response
+    return response
+
+# Выполняет обработчик, передавая его операции синхронному бэкенду
+def run_sync(handler_result, backend):
+    if not inspect.isgenerator(handler_result):
+        return handler_result
+    value = None
+    try:
+        while True:
+            step = handler_result.send(value)
+            value = getattr(backend, step.name)(*step.args)
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        handler_result.close()
+
+# То же для асинхронного бэкенда: операции – корутины
+async def run_async(handler_result, backend):
+    if not inspect.isgenerator(handler_result):
+        return handler_result
+    value = None
+    try:
+        while True:
+            step = handler_result.send(value)
+            value = await getattr(backend, step.name)(*step.args)
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        handler_result.close()
@@ -0,0 +1,196 @@
+import os
+import re
+import gzip
+import html
+import hashlib
+import functools
+import threading
+from collections import OrderedDict, namedtuple
+
+# HTML-форма оплаты с автосабмитом для /payment (общая для Flask и ASGI режимов).
+#
+# Шаблон разбирается один раз при импорте на статические куски и поля {{name}};
+# значения полей экранируются html.escape. Готовые страницы (тело, gzip-версия,
+# ETag) хранятся в ограниченном LRU-кэше по кортежу параметров, поэтому
+# повторные заходы и редиректы обратно не рендерят страницу заново, а при
+# совпавшем If-None-Match получают 304.
+
+CHECKOUT_URL = os.getenv("CHECKOUT_URL")
+CALLBACK_BASE_URL = os.getenv("CALLBACK_BASE_URL")  # Должна быть определена
+PAYMENT_PAGE_CACHE_SIZE = int(os.getenv("PAYMENT_PAGE_CACHE_SIZE", "1024"))
+PAYMENT_PAGE_MAX_AGE = int(os.getenv("PAYMENT_PAGE_MAX_AGE", "300"))  # сек., Cache-Control
+PAYMENT_PAGE_GZIP_MIN = 512  # байт; меньшие страницы не сжимаем
+
+# Используем DOMContentLoaded и небольшой таймаут для автоматического сабмита,
+# а также скрываем кнопку (display:none), чтобы пользователь не видел её.
+TEMPLATE = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+    <meta charset="UTF-8">
+    <title>Оплата за заказ</title>
+    <script>
+      document.addEventListener("DOMContentLoaded", function() {
+         setTimeout(function() {
+            document.forms[0].submit();
+         }, 100);
+      });
+    </script>
+</head>
+<body>
+    <h1>Оплата за заказ</h1>
+    <form action="{{checkout_url}}" method="POST">
+        <input type="hidden" name="account[order_id]" value="{{order_id}}">
+        <input type="hidden" name="amount" value="{{amount}}">
+        <input type="hidden" name="merchant" value="{{merchant}}">
+        <input type="hidden" name="callback" value="{{callback}}">
+        <input type="hidden" name="lang" value="{{lang}}">
+        <input type="hidden" name="description" value="{{description}}">
+        <input type="hidden" name="signature" value="{{signature}}">
+        <button type="submit" style="display:none;">Оплатить</button>
+    </form>
+    <p>Order ID (merchant_trans_id): {{order_id}}</p>
+</body>
+</html>"""
+
+# Параметры запроса и значения по умолчанию; порядок задаёт ключ кэша
+FIELDS = (
+    ("order_id", ""),
+    ("amount", ""),
+    ("merchant", ""),
+    ("callback", ""),
+    ("lang", "ru"),
+    ("description", "Оплата заказа"),
+    ("signature", ""),
+)
+
+# headers/gzip_headers – готовые заголовки ответа 200 для обычной и сжатой версии
+RenderedPage = namedtuple("RenderedPage", ["body", "gzip_body", "etag", "headers", "gzip_headers"])
+
+
+# Шаблон {{name}} -> строка для str.format: фигурные скобки статической
+# части (JS) экранируются, поля становятся {name}
+def compile_template(template):
+    tokens = re.split(r"\{\{(\w+)\}\}", template)
+    static = [part.replace("{", "{{").replace("}", "}}") for part in tokens[0::2]]
+    slots = tokens[1::2]
+    compiled = static[0] + "".join("{" + name + "}" + part for name, part in zip(slots, static[1:]))
+    return compiled, frozenset(slots)
+
+
+_COMPILED, _SLOTS = compile_template(TEMPLATE)
+
+
+def _render(values):
+    return _COMPILED.format_map({name: html.escape(values[name], quote=True) for name in _SLOTS})
+
+
+# args – любой mapping с .get(): request.args во Flask или разобранная строка запроса в ASGI
+def page_key(args):
+    return tuple(str(args.get(name, default)) for name, default in FIELDS)
+
+
+def _values(key):
+    values = dict(zip((name for name, _ in FIELDS), key))
+    callback = values["callback"]
+    if not callback or callback.lower() == "none":
+        values["callback"] = CALLBACK_BASE_URL if CALLBACK_BASE_URL else ""
+    values["checkout_url"] = CHECKOUT_URL or ""
+    return values
+
+
+def render_payment_form(args):
+    return _render(_values(page_key(args)))
+
+
+class PageCache:
+    def __init__(self, maxsize=PAYMENT_PAGE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            page = self._data.get(key)
+            if page is None:
+                self._stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return page
+
+    def put(self, key, page):
+        with self._lock:
+            self._data[key] = page
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._data), maxsize=self.maxsize)
+
+
+cache = PageCache()
+
+
+def get_page(args):
+    key = page_key(args)
+    page = cache.get(key)
+    if page is None:
+        page = build_page(_render(_values(key)).encode("utf-8"))
+        cache.put(key, page)
+    return page
+
+
+def build_page(body):
+    gzip_body = gzip.compress(body, 6, mtime=0) if len(body) >= PAYMENT_PAGE_GZIP_MIN else None
+    etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+    common = (("Cache-Control", f"private, max-age={PAYMENT_PAGE_MAX_AGE}"), ("Vary", "Accept-Encoding"))
+    headers = common + (("ETag", etag), ("Content-Type", "text/html; charset=utf-8"))
+    gzip_headers = common + (
+        ("ETag", etag[:-1] + '-gzip"'),
+        ("Content-Type", "text/html; charset=utf-8"),
+        ("Content-Encoding", "gzip"),
+    )
+    return RenderedPage(body, gzip_body, etag, headers, gzip_headers)
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match == etag or if_none_match.strip() == "*":
+        return True
+    # Сравнение слабое (RFC 7232): W/ и суффикс сжатой версии не мешают совпадению
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate.replace("-gzip\"", "\"") == etag:
+            return True
+    return False
+
+
+@functools.lru_cache(maxsize=64)
+def _accepts_gzip(accept_encoding):
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+# Ответ на GET /payment без привязки к фреймворку: (статус, заголовки, тело)
+def respond(args, if_none_match=None, accept_encoding=None):
+    page = get_page(args)
+    compressed = page.gzip_body is not None and _accepts_gzip(accept_encoding or "")
+    headers = page.gzip_headers if compressed else page.headers
+    if _etag_matches(if_none_match, page.etag):
+        # 304 несёт те же валидаторы, но без тела и его заголовков
+        return 304, headers[:3], b""
+    return 200, headers, page.gzip_body if compressed else page.body
+
+
+def stats():
+    return cache.stats()
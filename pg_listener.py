@@ -0,0 +1,104 @@
+import os
+import time
+import select
+import logging
+import threading
+import psycopg2
+import psycopg2.extensions
+
+# Один фоновый LISTEN-поток на процесс: получает NOTIFY из PostgreSQL и
+# раздаёт их подписчикам (инвалидация локальных кэшей между воркерами).
+# После переподключения уведомления могли быть потеряны, поэтому
+# подписчикам вызывается on_reset – они должны сбросить кэш целиком.
+
+LISTENER_RECONNECT_DELAY = float(os.getenv("LISTENER_RECONNECT_DELAY", "5"))
+
+
+class Listener:
+    def __init__(self, dsn=None, sslmode=None):
+        self.dsn = dsn or os.getenv("DATABASE_URL")
+        self.sslmode = sslmode or os.getenv("DB_SSLMODE", "require")
+        self._handlers = {}  # канал -> [(callback, on_reset)]
+        self._pending = set()  # каналы, на которые ещё не выполнен LISTEN
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, channel, callback, on_reset=None):
+        with self._lock:
+            self._handlers.setdefault(channel, []).append((callback, on_reset))
+            self._pending.add(channel)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="pg-listener", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _reset_all(self):
+        with self._lock:
+            handlers = [h for hs in self._handlers.values() for h in hs]
+        for _, on_reset in handlers:
+            if on_reset:
+                try:
+                    on_reset()
+                except Exception as e:
+                    logging.error("Listener: ошибка on_reset: %s", e)
+
+    def _listen_pending(self, cur, all_channels=False):
+        with self._lock:
+            channels = set(self._handlers) if all_channels else set(self._pending)
+            self._pending.clear()
+        for channel in channels:
+            cur.execute(f'LISTEN "{channel}"')
+
+    def _dispatch(self, notify):
+        with self._lock:
+            handlers = list(self._handlers.get(notify.channel, ()))
+        for callback, _ in handlers:
+            try:
+                callback(notify.payload)
+            except Exception as e:
+                logging.error("Listener: ошибка обработчика канала %s: %s", notify.channel, e)
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn, sslmode=self.sslmode)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                self._listen_pending(cur, all_channels=True)
+                self._reset_all()
+                logging.info("Listener: подписка на NOTIFY активна")
+                while not self._stop.is_set():
+                    self._listen_pending(cur)
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(conn.notifies.pop(0))
+            except Exception as e:
+                logging.error("Listener: соединение потеряно: %s", e)
+                self._reset_all()
+                time.sleep(LISTENER_RECONNECT_DELAY)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = Listener()
+        return _listener
@@ -0,0 +1,288 @@
+import os
+import json
+import math
+import logging
+import threading
+from collections import OrderedDict
+import db_pool
+
+# Фискальный справочник товаров для чека в CheckPerformTransaction: product ->
+# ИКПУ (code), код упаковки, единица измерения, НДС. Таблица products небольшая
+# и целиком держится в памяти процесса: чек строится без запросов к БД.
+#
+# Справочник загружается при старте и при каждом (пере)подключении LISTEN
+# (on_reset), изменения приходят через NOTIFY product_changes (миграция 10) –
+# строка целиком в payload, поэтому перечитывать таблицу не нужно.
+#
+# Товар без записи в справочнике выписывается по записи RECEIPT_DEFAULT_PRODUCT
+# со своим названием (и предупреждением в лог). Если справочник ещё не загружен
+# или и этой записи нет – по прежнему статическому чеку FALLBACK_ENTRY:
+# позиция чека всегда уходит с фискальным кодом.
+
+PRODUCT_CHANGES_CHANNEL = "product_changes"
+RECEIPT_DEFAULT_PRODUCT = os.getenv("RECEIPT_DEFAULT_PRODUCT", "Кружка")
+ITEMS_MEMO_SIZE = int(os.getenv("ITEMS_MEMO_SIZE", "10000"))
+
+PRODUCT_COLUMNS = ("product", "title", "code", "package_code", "units", "vat_percent")
+PRODUCTS_SQL = f"SELECT {', '.join(PRODUCT_COLUMNS)} FROM products"
+
+# Коды прежнего чека-заглушки (та же запись, что вставляет миграция 10)
+FALLBACK_ENTRY = {
+    "product": "Кружка",
+    "title": "Кружка",
+    "code": "06912001036000000",
+    "package_code": "1184747",
+    "units": 796,
+    "vat_percent": 12,
+}
+
+PRODUCTS_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS products (
+        product TEXT PRIMARY KEY,
+        title TEXT,
+        code TEXT NOT NULL,
+        package_code TEXT,
+        units INTEGER,
+        vat_percent INTEGER NOT NULL DEFAULT 12,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """,
+    # Прежний чек-заглушка становится записью по умолчанию
+    """
+    INSERT INTO products (product, title, code, package_code, units, vat_percent)
+    VALUES ('Кружка', 'Кружка', '06912001036000000', '1184747', 796, 12)
+    ON CONFLICT (product) DO NOTHING;
+    """,
+    """
+    CREATE OR REPLACE FUNCTION notify_product_change() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify('product_changes', json_build_object('deleted', OLD.product)::text);
+            RETURN OLD;
+        END IF;
+        IF TG_OP = 'UPDATE' AND OLD.product IS DISTINCT FROM NEW.product THEN
+            PERFORM pg_notify('product_changes', json_build_object('deleted', OLD.product)::text);
+        END IF;
+        PERFORM pg_notify('product_changes', json_build_object(
+            'product', NEW.product, 'title', NEW.title, 'code', NEW.code,
+            'package_code', NEW.package_code, 'units', NEW.units, 'vat_percent', NEW.vat_percent
+        )::text);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS products_notify_change ON products;",
+    """
+    CREATE TRIGGER products_notify_change
+        AFTER INSERT OR UPDATE OR DELETE ON products
+        FOR EACH ROW
+        EXECUTE FUNCTION notify_product_change();
+    """,
+]
+
+
+class ProductCatalog:
+    def __init__(self):
+        self._products = {}  # product -> dict(PRODUCT_COLUMNS); заменяется целиком
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._stats = {"reloads": 0, "changes": 0, "unknown_products": 0}
+
+    def get(self, product):
+        return self._products.get(product)
+
+    def replace(self, rows):
+        products = {row[0]: dict(zip(PRODUCT_COLUMNS, row)) for row in rows}
+        with self._lock:
+            self._products = products
+            self.loaded = True
+            self._stats["reloads"] += 1
+
+    # Копия при записи: читатели без блокировки всегда видят целый словарь
+    def apply(self, change):
+        with self._lock:
+            products = dict(self._products)
+            if "deleted" in change:
+                products.pop(change["deleted"], None)
+            else:
+                products[change["product"]] = {column: change.get(column) for column in PRODUCT_COLUMNS}
+            self._products = products
+            self._stats["changes"] += 1
+
+    def count_unknown(self):
+        with self._lock:
+            self._stats["unknown_products"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["products"] = len(self._products)
+            stats["loaded"] = self.loaded
+        stats["items_memo"] = len(_items_memo)
+        return stats
+
+
+catalog = ProductCatalog()
+
+
+def load(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute(PRODUCTS_SQL)
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    conn.commit()
+    catalog.replace(rows)
+    logging.info("Справочник товаров загружен: %s", len(rows))
+
+
+def reload_from_pool():
+    pool = db_pool.get_pool()
+    conn = pool.getconn()
+    try:
+        load(conn)
+    finally:
+        pool.putconn(conn)
+
+
+# Обработчик NOTIFY product_changes: payload – строка products в JSON или {"deleted": product}
+def on_product_change(payload):
+    try:
+        change = json.loads(payload)
+    except ValueError:
+        logging.warning("Справочник товаров: некорректное уведомление %r", payload)
+        return
+    catalog.apply(change)
+
+
+# reload – полная перезагрузка справочника (после переподключения уведомления могли потеряться)
+def subscribe(listener, reload=reload_from_pool):
+    listener.subscribe(PRODUCT_CHANGES_CHANNEL, on_product_change, on_reset=reload)
+
+
+# --- Товары заказа ---
+#
+# orders.items – JSON от бота: список {"product"|"title"|"name", "quantity"|"count",
+# "price"} или словарь {товар: количество}. Цена – конечное число >= 0,
+# количество – целое >= 1; items с неверной позицией не используются (чек – одной
+# строкой по product и quantity заказа). Разобранный список мемоизируется по
+# order_id (с проверкой, что текст items не изменился): повторные
+# CheckPerformTransaction по заказу не разбирают JSON заново.
+
+_items_memo = OrderedDict()  # order_id -> (текст items, [(товар, количество, вес цены)])
+_items_lock = threading.Lock()
+
+
+def _item_quantity(value):
+    if value is None:
+        return 1
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"количество {value!r}")
+    quantity = int(value)
+    if quantity < 1:
+        raise ValueError(f"количество {value!r}")
+    return quantity
+
+
+def _item_price(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"цена {value!r}")
+    price = float(value)
+    if not math.isfinite(price) or price < 0:
+        raise ValueError(f"цена {value!r}")
+    return price
+
+
+def _parse_items(text):
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = [{"product": name, "quantity": quantity} for name, quantity in data.items()]
+    items = []
+    for item in data:
+        name = item.get("product") or item.get("title") or item.get("name")
+        if not name:
+            raise ValueError(f"позиция без названия: {item!r}")
+        quantity = item.get("quantity")
+        quantity = _item_quantity(quantity if quantity is not None else item.get("count"))
+        items.append((name, quantity, _item_price(item.get("price"))))
+    return items
+
+
+# [(товар, количество, цена за единицу из items или None)]; без items – product и quantity заказа
+def order_items(order):
+    text = order.get("items")
+    if text:
+        order_id = order["order_id"]
+        with _items_lock:
+            memo = _items_memo.get(order_id)
+            if memo is not None and memo[0] == text:
+                _items_memo.move_to_end(order_id)
+                return memo[1]
+        try:
+            items = _parse_items(text)
+        except (ValueError, TypeError, AttributeError) as e:
+            logging.warning("Заказ %s: items не используются: %s", order_id, e)
+            items = []
+        if items:
+            with _items_lock:
+                _items_memo[order_id] = (text, items)
+                while len(_items_memo) > ITEMS_MEMO_SIZE:
+                    _items_memo.popitem(last=False)
+            return items
+    return [(order.get("product") or RECEIPT_DEFAULT_PRODUCT, max(int(order.get("quantity") or 1), 1), None)]
+
+
+# Делит сумму чека (тийины) между единицами товаров пропорционально ценам из items
+# (без цен – поровну). Возвращает [(товар, количество, цена за единицу)]; сумма
+# price * count строк точно равна amount – строка, которая не делится на
+# количество, разбивается на две.
+def split_amount(items, amount):
+    weights = [price * quantity if price is not None else quantity for _, quantity, price in items]
+    total_weight = sum(weights) or 1
+    lines, allocated = [], 0
+    for index, ((name, quantity, _), weight) in enumerate(zip(items, weights)):
+        if index == len(items) - 1:
+            share = amount - allocated
+        else:
+            share = int(amount * weight / total_weight)
+        allocated += share
+        unit, remainder = divmod(share, quantity)
+        if remainder:
+            if quantity > 1:
+                lines.append((name, quantity - 1, unit))
+            lines.append((name, 1, unit + remainder))
+        else:
+            lines.append((name, quantity, unit))
+    return lines
+
+
+def receipt_line(name, count, price):
+    entry = catalog.get(name)
+    if entry is None or not entry.get("code"):
+        catalog.count_unknown()
+        if not catalog.loaded:
+            logging.warning("Справочник products не загружен, чек %r по кодам %r", name, FALLBACK_ENTRY["product"])
+        else:
+            logging.warning("Товар %r не найден в справочнике products, чек по %r", name, RECEIPT_DEFAULT_PRODUCT)
+        entry = catalog.get(RECEIPT_DEFAULT_PRODUCT)
+        if entry is None or not entry.get("code"):
+            entry = FALLBACK_ENTRY
+    return {
+        "discount": 0,
+        "title": entry.get("title") if entry.get("product") == name and entry.get("title") else name,
+        "price": price,
+        "count": count,
+        "code": entry.get("code"),
+        "units": entry.get("units"),
+        "vat_percent": entry.get("vat_percent"),
+        "package_code": entry.get("package_code"),
+    }
+
+
+# Позиции чека detail.items для суммы amount (тийины)
+def receipt_items(order, amount):
+    return [receipt_line(name, count, price) for name, count, price in split_amount(order_items(order), amount)]
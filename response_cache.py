@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import logging
+import threading
+import functools
+from collections import OrderedDict
+
+# Кэш ответов PayMe по ключу (метод, id транзакции). Кэшируются только ответы
+# в устойчивых состояниях: 2 (проведена), -1 и -2 (отменена). Ответы в
+# состоянии 1 и ошибки всегда идут в БД – они могут измениться в любой момент.
+#
+# Инвалидация: локально – сразу после перехода статуса в этом воркере,
+# между воркерами – через NOTIFY order_changes (триггер на orders, миграция 5).
+# -1 и -2 конечны, а 2 ещё может стать -2 (CancelTransaction после оплаты):
+# если отмена прошла в другом воркере, корректность кэшированного ответа
+# с состоянием 2 держится только на этом NOTIFY. Пока LISTEN переподключается,
+# уведомления могут потеряться – поэтому после переподключения кэш очищается
+# целиком (on_reset), а срок жизни записи ограничен RESPONSE_CACHE_TTL.
+#
+# Ответ, прочитанный из БД до инвалидации своей транзакции, не сохраняется:
+# у каждой транзакции своё поколение (счётчик в одной из GENERATION_SLOTS
+# ячеек по хэшу transaction_id – память не растёт с числом транзакций), поэтому
+# инвалидации других транзакций на запись не влияют.
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))  # сек.
+ORDER_CHANGES_CHANNEL = "order_changes"
+
+CACHEABLE_STATES = (2, -1, -2)
+GENERATION_SLOTS = 4096
+CACHED_METHODS = ("PerformTransaction", "CheckTransaction", "CancelTransaction")
+
+
+class ResponseCache:
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # (method, transaction_id) -> (expires_at, response без id)
+        self._lock = threading.Lock()
+        # Поколения транзакций по ячейкам хэша и общее поколение clear()
+        self._generations = [0] * GENERATION_SLOTS
+        self._epoch = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def get(self, method, transaction_id):
+        key = (method, transaction_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry[0] < now:
+                del self._data[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    # Метка для put(): ответ, прочитанный после неё, сохраняется, только если
+    # транзакцию с тех пор не инвалидировали
+    def generation(self, transaction_id):
+        return self._epoch, self._generations[hash(transaction_id) % GENERATION_SLOTS]
+
+    def put(self, method, transaction_id, response, generation=None):
+        key = (method, transaction_id)
+        with self._lock:
+            if generation is not None and generation != self.generation(transaction_id):
+                return
+            self._data[key] = (time.monotonic() + self.ttl, response)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, transaction_id):
+        if transaction_id is None:
+            return
+        with self._lock:
+            self._generations[hash(transaction_id) % GENERATION_SLOTS] += 1
+            for method in CACHED_METHODS:
+                if self._data.pop((method, transaction_id), None) is not None:
+                    self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._data)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+cache = ResponseCache()
+
+
+# Декоратор обработчика метода PayMe (генератора из payme_handlers.py): отдаёт
+# ответ из кэша или сохраняет результат, если транзакция в устойчивом состоянии.
+# id транзакции не строкой (null, число, список, объект) кэш не использует –
+# такой запрос обработчик разбирает сам (ошибка параметров или поиск по строке).
+def cached(method):
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(payload):
+            transaction_id = payload.get("params", {}).get("id")
+            if not isinstance(transaction_id, str):
+                return (yield from handler(payload))
+            hit = cache.get(method, transaction_id)
+            if hit is not None:
+                return dict(hit, id=payload.get("id"))
+            generation = cache.generation(transaction_id)
+            response = yield from handler(payload)
+            result = response.get("result")
+            if result and result.get("state") in CACHEABLE_STATES:
+                cache.put(method, transaction_id, {k: v for k, v in response.items() if k != "id"}, generation)
+            return response
+        return wrapper
+    return decorator
+
+
+# Обработчик NOTIFY order_changes: payload – JSON с transaction_id до и после изменения
+def on_order_change(payload):
+    try:
+        change = json.loads(payload)
+    except ValueError:
+        logging.warning("Кэш ответов: некорректное уведомление %r", payload)
+        cache.clear()
+        return
+    cache.invalidate(change.get("transaction_id"))
+    if change.get("old_transaction_id") != change.get("transaction_id"):
+        cache.invalidate(change.get("old_transaction_id"))
+
+
+def subscribe(listener):
+    listener.subscribe(ORDER_CHANGES_CHANNEL, on_order_change, on_reset=cache.clear)
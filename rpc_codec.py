@@ -0,0 +1,131 @@
+import json
+import hmac
+import base64
+
+# Кодек JSON-RPC для /callback: разбор тела прямо из bytes (orjson, если
+# установлен, иначе stdlib json), проверка Basic-авторизации по заранее
+# вычисленному заголовку за постоянное время и готовые сериализованные
+# конверты ошибок, в которые при ответе подставляется только id.
+# Большие списки (GetStatement) отдаются потоково – StreamedResponse.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+    loads = orjson.loads
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+else:
+    BACKEND = "json"
+    loads = json.loads  # json.loads принимает bytes и сам определяет кодировку
+
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+_ID_MARKER = "\x00rpc-id\x00"
+_ITEMS_MARKER = "\x00rpc-items\x00"
+STREAM_CHUNK_SIZE = 64 * 1024  # байт в одном куске потокового ответа
+
+
+# Ответ-ошибка: обычный dict (его видят кэш, логи и тесты), который дополнительно
+# несёт готовые байты конверта до и после значения id.
+class ErrorResponse(dict):
+    __slots__ = ("encoded",)
+
+
+class ErrorEnvelope:
+    __slots__ = ("error", "prefix", "suffix")
+
+    def __init__(self, error):
+        self.error = error
+        encoded = dumps({"error": error, "result": None, "id": _ID_MARKER})
+        marker = dumps(_ID_MARKER)
+        self.prefix, self.suffix = encoded.split(marker)
+
+    def __call__(self, rpc_id):
+        response = ErrorResponse(error=self.error, result=None, id=rpc_id)
+        response.encoded = self
+        return response
+
+
+# Сериализация ответа: для ErrorResponse – склейка готовых байтов с id
+def encode_response(response):
+    envelope = getattr(response, "encoded", None)
+    if envelope is not None and response.get("error") is envelope.error:
+        return envelope.prefix + dumps(response.get("id")) + envelope.suffix
+    return dumps(response)
+
+
+# Ответ со списком в result[key], который сериализуется по мере чтения строк:
+# rows – итератор (или асинхронный итератор) строк, formatter превращает строку
+# в элемент списка. Сам dict содержит только id – его видят логи и метрики.
+class StreamedResponse(dict):
+    __slots__ = ("key", "rows", "formatter")
+
+    def __init__(self, rpc_id, key, rows, formatter):
+        super().__init__(id=rpc_id, result=None, error=None)
+        self.key = key
+        self.rows = rows
+        self.formatter = formatter
+
+    # Байты до первого и после последнего элемента списка
+    def envelope(self):
+        encoded = dumps({"result": {self.key: _ITEMS_MARKER}, "error": None, "id": self.get("id")})
+        prefix, suffix = encoded.split(dumps(_ITEMS_MARKER))
+        return prefix + b"[", b"]" + suffix
+
+
+# Куски тела StreamedResponse не больше ~STREAM_CHUNK_SIZE, память не зависит от числа строк
+def iter_encoded(response, chunk_size=STREAM_CHUNK_SIZE):
+    prefix, suffix = response.envelope()
+    buffer = bytearray(prefix)
+    separator = b""
+    try:
+        for row in response.rows:
+            buffer += separator
+            buffer += dumps(response.formatter(row))
+            separator = b","
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+    finally:
+        # При обрыве соединения закрываем источник строк (курсор) сразу
+        close = getattr(response.rows, "close", None)
+        if close is not None:
+            close()
+    buffer += suffix
+    yield bytes(buffer)
+
+
+async def aiter_encoded(response, chunk_size=STREAM_CHUNK_SIZE):
+    prefix, suffix = response.envelope()
+    buffer = bytearray(prefix)
+    separator = b""
+    try:
+        async for row in response.rows:
+            buffer += separator
+            buffer += dumps(response.formatter(row))
+            separator = b","
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+    finally:
+        aclose = getattr(response.rows, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    buffer += suffix
+    yield bytes(buffer)
+
+
+def basic_auth_header(username, password):
+    return ("Basic " + base64.b64encode(f"{username}:{password}".encode()).decode()).encode()
+
+
+def auth_matches(header, expected):
+    if isinstance(header, str):
+        header = header.encode("utf-8", "replace")
+    return hmac.compare_digest(header.strip(), expected)
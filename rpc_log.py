@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+import tracing
+
+# Неблокирующее логирование: обработчики запросов только кладут запись в
+# очередь, форматирование и запись в stdout делает фоновый поток
+# (QueueListener). На каждый вызов JSON-RPC пишется одна структурированная
+# JSON-строка (метод, транзакция, время, код результата); полные дампы
+# запроса/ответа – только для доли вызовов LOG_PAYLOAD_SAMPLE_RATE.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+
+SENSITIVE_HEADERS = frozenset(["authorization", "cookie", "set-cookie", "proxy-authorization", "x-api-key"])
+
+rpc_logger = logging.getLogger("payme.rpc")
+
+_dropped = 0
+_listener = None
+_listener_pid = None
+
+
+# QueueHandler без форматирования в потоке запроса и без блокировки при
+# переполнении очереди: лишние записи отбрасываются и считаются.
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+
+# Обычные записи – в прежнем текстовом формате, записи payme.rpc – JSON-строкой
+class _Formatter(logging.Formatter):
+    def format(self, record):
+        rpc = getattr(record, "rpc", None)
+        if rpc is None:
+            return super().format(record)
+        line = {"ts": round(record.created, 3), "level": record.levelname}
+        line.update(rpc)
+        return json.dumps(line, ensure_ascii=False, default=str)
+
+
+# Повторный вызов в том же процессе ничего не делает; после fork (воркер
+# gunicorn с preload_app) поток записи родителя не существует – создаётся новый.
+def setup_logging():
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid():
+        return
+    first = _listener_pid is None
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(_Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    root.handlers = [_NonBlockingQueueHandler(log_queue)]
+    root.setLevel(LOG_LEVEL)
+    _listener = logging.handlers.QueueListener(log_queue, stream)
+    _listener.start()
+    _listener_pid = os.getpid()
+    if first:
+        atexit.register(stop_logging)
+
+
+# Дописывает очередь и останавливает фоновый поток (при завершении процесса)
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped():
+    return _dropped
+
+
+def redact_headers(headers):
+    return {k: ("***" if k.lower() in SENSITIVE_HEADERS else v) for k, v in headers.items()}
+
+
+# В ChangePassword новый ключ кассы приходит в params.password
+def redact_payload(payload):
+    params = payload.get("params")
+    if isinstance(params, dict) and "password" in params:
+        payload = dict(payload, params=dict(params, password="***"))
+    return payload
+
+
+def result_code(response):
+    error = response.get("error")
+    if error:
+        return error.get("code")
+    return 0
+
+
+# Одна запись на вызов JSON-RPC. payload может быть None, если тело не разобралось.
+# headers – mapping заголовков, нужен только для сэмплированного дампа.
+def log_call(payload, response, started, headers=None):
+    payload = payload if isinstance(payload, dict) else {}
+    params = payload.get("params")
+    params = params if isinstance(params, dict) else {}
+    result = response.get("result")
+    rpc = {
+        "event": "rpc",
+        "method": payload.get("method"),
+        "rpc_id": payload.get("id"),
+        "transaction_id": params.get("id"),
+        "latency_ms": round((time.perf_counter() - started) * 1000, 3),
+        "code": result_code(response),
+        "trace_id": tracing.current_id(),
+    }
+    if isinstance(result, dict) and "state" in result:
+        rpc["state"] = result["state"]
+    rpc_logger.info("rpc", extra={"rpc": rpc})
+
+    if LOG_PAYLOAD_SAMPLE_RATE > 0 and random.random() < LOG_PAYLOAD_SAMPLE_RATE:
+        dump = {
+            "event": "rpc_dump",
+            "method": rpc["method"],
+            "transaction_id": rpc["transaction_id"],
+            "headers": redact_headers(dict(headers or {})),
+            "request": redact_payload(payload),
+            "response": response,
+        }
+        rpc_logger.info("rpc_dump", extra={"rpc": dump})
@@ -1,571 +1,248 @@
 import os
-import json
 import time
-import base64
 import logging
-import sys
-import requests  # Для отправки уведомлений через Telegram Bot API
 import threading  # Для автопинга
-from flask import Flask, request, jsonify
+import startup  # Первым: от его импорта отсчитываются этапы старта
+from flask import Flask, Response, request, jsonify, g, stream_with_context
 from dotenv import load_dotenv
 import psycopg2
 import psycopg2.extras
+startup.mark("import flask, psycopg2")
 
-# Загружаем переменные окружения
+# Загружаем переменные окружения (до импорта модулей, читающих их при импорте)
 load_dotenv()
+startup.mark("load_dotenv")
+
+import db_pool
+import order_queries
+import outbox
+import expiry
+import partitions
+import migrations
+import response_cache
+import client_cache
+import product_catalog
+import pg_listener
+import payment_page
+import payme_handlers
+import order_repository
+import rpc_log
+import rpc_codec
+import metrics
+import tracing
+import audit
+startup.mark("import modules")
 
-PAYME_MERCHANT_ID = os.getenv("PAYME_MERCHANT_ID")  # Значение для PayMe
-MERCHANT_KEY = os.getenv("MERCHANT_KEY")
-CHECKOUT_URL = os.getenv("CHECKOUT_URL")
-CALLBACK_BASE_URL = os.getenv("CALLBACK_BASE_URL")  # Должна быть определена
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Переменные для уведомлений через Telegram
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-GROUP_CHAT_ID = os.getenv("GROUP_CHAT_ID")  # Идентификатор группы администраторов (если используется)
+# Идентификатор группы администраторов для уведомлений (если используется)
+GROUP_CHAT_ID = os.getenv("GROUP_CHAT_ID")
 
 app = Flask(__name__)
 
-# Настройка логирования
-logging.basicConfig(
-    stream=sys.stdout,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-
+# Соединение берётся из пула один раз на запрос и разделяется всеми хелперами;
+# возвращается в пул в teardown_appcontext.
 def get_db():
-    conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-    return conn
-
-def init_db():
-    conn = get_db()
-    cur = conn.cursor()
-    # Обновлённая схема таблицы orders: добавлен столбец payme_amount для сумм PayMe (тийины)
-    create_table_query = """
-    CREATE TABLE IF NOT EXISTS orders (
-        order_id SERIAL PRIMARY KEY,
-        user_id BIGINT,
-        merchant_trans_id TEXT,
-        product TEXT,
-        quantity INTEGER,
-        design_text TEXT,
-        design_photo TEXT,
-        location_lat REAL,
-        location_lon REAL,
-        status TEXT NOT NULL,
-        payment_amount INTEGER,
-        payme_amount INTEGER,
-        payment_system TEXT,
-        create_time BIGINT,
-        perform_time BIGINT,
-        cancel_time BIGINT,
-        order_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        delivery_comment TEXT,
-        items TEXT,
-        transaction_id TEXT
-    );
-    """
-    cur.execute(create_table_query)
-    conn.commit()
-    alter_queries = [
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS user_id BIGINT;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS merchant_trans_id TEXT;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS product TEXT;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS quantity INTEGER;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS design_text TEXT;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS design_photo TEXT;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS location_lat REAL;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS location_lon REAL;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS create_time BIGINT;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS perform_time BIGINT;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS cancel_time BIGINT;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS order_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS delivery_comment TEXT;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS transaction_id TEXT;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS payment_system TEXT;",
-        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS payme_amount INTEGER;"
-    ]
-    for query in alter_queries:
-        try:
-            cur.execute(query)
-        except Exception as e:
-            logging.error("Ошибка ALTER TABLE: %s", e)
-    conn.commit()
-    cur.close()
-    conn.close()
-
-init_db()
-
-def current_timestamp():
-    return int(round(time.time() * 1000))
-
-# Функция для отправки сообщения через Telegram Bot API
-def send_message_to_telegram(chat_id, text, token):
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+    if "db" not in g:
+        g.db = db_pool.get_pool().getconn()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        db_pool.get_pool().putconn(conn)
+
+# Схема создаётся миграциями (python migrations.py upgrade) один раз на деплой;
+# при старте только проверяется её версия. Соединение отдельное, не из пула:
+# под gunicorn с preload_app проверка идёт в мастере, и его соединения
+# не должны достаться воркерам после fork.
+def verify_schema():
+    conn = psycopg2.connect(DATABASE_URL, sslmode=db_pool.DB_SSLMODE)
     try:
-        response = requests.post(url, json=payload, timeout=10)
-        logging.info("Уведомление отправлено: %s", response.json())
-    except Exception as e:
-        logging.error("Ошибка отправки сообщения в Telegram: %s", e)
-
-# Функция для уведомления об успешном платеже
-def notify_payment_success(order):
-    try:
-        conn = get_db()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute("SELECT * FROM clients WHERE user_id = %s", (order["user_id"],))
-        client = cur.fetchone()
-        cur.close()
+        version = migrations.verify_schema(conn)
+        logging.info("Версия схемы БД: %s", version)
+    finally:
         conn.close()
 
-        if client:
-            client_info = (f"Клиент: {client.get('name', 'Неизвестный')} "
-                           f"(@{client.get('username', 'нет')})\nТелефон: {client.get('contact', 'не указан')}")
-        else:
-            client_info = "Данные клиента не найдены"
-
-        message_text = (
-            f"✅ Оплата заказа №{order['order_id']} успешно проведена!\n\n"
-            f"{client_info}\n\n"
-            f"Товар: {order.get('product', 'не указан')}\n"
-            f"Количество: {order.get('quantity', 'не указано')}\n"
-            f"Сумма: {order.get('payment_amount', '0')} сум\n"
-            f"Комментарий к доставке: {order.get('delivery_comment', '')}"
-        )
-
-        send_message_to_telegram(order["user_id"], message_text, TELEGRAM_BOT_TOKEN)
-        if GROUP_CHAT_ID:
-            send_message_to_telegram(GROUP_CHAT_ID, message_text, TELEGRAM_BOT_TOKEN)
+# Готовность процесса к работе с БД: схема проверена, пул прогрет, справочник
+# товаров загружен. В режиме STARTUP_MODE=fast выполняется не при старте,
+# а в фоне после start_background() или при первом обращении (см. startup.py).
+_ready = False
+_ready_lock = threading.Lock()
+_schema_verified = False
+
+def ensure_ready():
+    global _ready, _schema_verified
+    if _ready or order_repository.is_memory():
+        return
+    with _ready_lock:
+        if _ready:
+            return
+        started = time.perf_counter()
+        if not _schema_verified:
+            verify_schema()
+            _schema_verified = True
+        db_pool.get_pool().prefill()
+        if not product_catalog.catalog.loaded:
+            product_catalog.reload_from_pool()
+        _ready = True
+        startup.record("warmup", started)
+        startup.log_breakdown("ready")
+
+def _warmup():
+    try:
+        ensure_ready()
     except Exception as e:
-        logging.error("Ошибка отправки уведомления о платеже: %s", e)
-
-# Функции работы с базой данных
-def get_order_by_merchant_trans_id(merchant_trans_id):
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cur.execute("SELECT * FROM orders WHERE merchant_trans_id = %s", (merchant_trans_id,))
-    order = cur.fetchone()
-    cur.close()
-    conn.close()
-    return order
-
-def get_order_by_id(order_id):
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cur.execute("SELECT * FROM orders WHERE order_id = %s", (order_id,))
-    order = cur.fetchone()
-    cur.close()
-    conn.close()
-    return order
-
-def update_order(order_id, fields):
-    conn = get_db()
-    cur = conn.cursor()
-    set_clause = ", ".join([f"{key} = %s" for key in fields.keys()])
-    values = list(fields.values())
-    values.append(order_id)
-    query = f"UPDATE orders SET {set_clause} WHERE order_id = %s"
-    cur.execute(query, values)
-    conn.commit()
-    cur.close()
-    conn.close()
-
-# Функция проверки суммы с учетом платежной системы:
-# Для Click берём значение из payment_amount (и умножаем на 100 для сравнения с копейками),
-# а для PayMe – используем значение из payme_amount, которое уже хранится в тийинах.
-def is_amount_correct(order, callback_amount):
-    payment_system = order.get("payment_system", "payme").lower()
-    if payment_system == "click":
-        return int(order["payment_amount"]) * 100 == int(callback_amount)
-    elif payment_system == "payme":
-        return int(order["payme_amount"]) == int(callback_amount)
-    else:
-        return int(order["payment_amount"]) == int(callback_amount)
-
-def check_perform_transaction(payload):
-    params = payload.get("params", {})
-    account = params.get("account", {})
-    merchant_trans_id = account.get("order_id")  # Здесь order_id содержит UUID (merchant_trans_id)
-    if merchant_trans_id is None:
-        return error_order_id(payload)
-    order = get_order_by_merchant_trans_id(merchant_trans_id)
-    if not order:
-        return error_order_id(payload)
-    if not is_amount_correct(order, params.get("amount")):
-        return error_amount(payload)
-    # Если заказ для PayMe, то используем значение payme_amount в чеке,
-    # иначе – значение payment_amount.
-    if order.get("payment_system", "payme").lower() == "payme":
-        item_price = order["payme_amount"]
-    else:
-        item_price = order["payment_amount"]
-    stub_items = [
-        {
-            "discount": 0,
-            "title": "Кружка",
-            "price": item_price,
-            "count": 1,
-            "code": "06912001036000000",
-            "units": 796,
-            "vat_percent": 12,
-            "package_code": "1184747"
-        }
-    ]
-    return {
-        "id": payload.get("id"),
-        "result": {
-            "allow": True,
-            "detail": {
-                "receipt_type": 0,
-                "items": stub_items
-            }
-        },
-        "error": None
-    }
-
-def create_transaction(payload):
-    params = payload.get("params", {})
-    account = params.get("account", {})
-    merchant_trans_id = account.get("order_id")
-    if merchant_trans_id is None:
-        return error_order_id(payload)
-    order = get_order_by_merchant_trans_id(merchant_trans_id)
-    if not order:
-        return error_order_id(payload)
-    if not is_amount_correct(order, params.get("amount")):
-        return error_amount(payload)
-    transaction_id = params.get("id")
-    if order["status"].lower() in ["pending", "одобрен"]:
-        create_time = current_timestamp()
-        update_order(order["order_id"], {
-            "status": "processing",
-            "create_time": create_time,
-            "transaction_id": transaction_id
-        })
-        return {
-            "id": payload.get("id"),
-            "result": {
-                "create_time": create_time,
-                "transaction": "000" + str(order["order_id"]),
-                "state": 1
-            }
-        }
-    elif order["status"].lower() == "processing":
-        if order.get("transaction_id") == transaction_id:
-            return {
-                "id": payload.get("id"),
-                "result": {
-                    "create_time": order.get("create_time"),
-                    "transaction": "000" + str(order["order_id"]),
-                    "state": 1
-                }
-            }
-        else:
-            return error_has_another_transaction(payload)
-    else:
-        return error_unknown(payload)
-
-def perform_transaction(payload):
-    params = payload.get("params", {})
-    transaction_id = params.get("id")
-    order = get_order_by_transaction(transaction_id)
-    if not order:
-        return error_transaction(payload)
-    order_id = order["order_id"]
-    if order["status"].lower() == "processing":
-        perform_time = current_timestamp()
-        update_order(order_id, {
-            "status": "completed",
-            "perform_time": perform_time
-        })
-        updated_order = get_order_by_id(order_id)
-        notify_payment_success(updated_order)
-        return {
-            "id": payload.get("id"),
-            "result": {
-                "transaction": "000" + str(order_id),
-                "perform_time": perform_time,
-                "state": 2
-            }
-        }
-    elif order["status"].lower() == "completed":
-        return {
-            "id": payload.get("id"),
-            "result": {
-                "transaction": "000" + str(order_id),
-                "perform_time": order.get("perform_time"),
-                "state": 2
-            }
-        }
-    elif order["status"].lower() in ["cancelled", "refunded"]:
-        return error_cancelled_transaction(payload)
-    else:
-        return error_unknown(payload)
-
-def check_transaction(payload):
-    params = payload.get("params", {})
-    transaction_id = params.get("id")
-    order = get_order_by_transaction(transaction_id)
-    if not order:
-        return error_transaction(payload)
-    order_id = order["order_id"]
-    if order.get("transaction_id") != transaction_id:
-        return error_transaction(payload)
-    if order["status"].lower() == "processing":
-        state_val = 1
-    elif order["status"].lower() == "completed":
-        state_val = 2
-    elif order["status"].lower() == "cancelled":
-        state_val = -1
-    elif order["status"].lower() == "refunded":
-        state_val = -2
-    else:
-        return error_transaction(payload)
-    return {
-        "id": payload.get("id"),
-        "result": {
-            "create_time": order.get("create_time", 0),
-            "perform_time": order.get("perform_time", 0),
-            "cancel_time": order.get("cancel_time", 0),
-            "transaction": "000" + str(order_id),
-            "state": state_val,
-            "reason": order.get("cancel_reason")
-        },
-        "error": None
-    }
-
-def cancel_transaction(payload):
-    params = payload.get("params", {})
-    transaction_id = params.get("id")
-    order = get_order_by_transaction(transaction_id)
-    if not order:
-        return error_transaction(payload)
-    order_id = order["order_id"]
-    if order.get("transaction_id") != transaction_id:
-        return error_transaction(payload)
-    cancel_time = current_timestamp()
-    if order["status"].lower() in ["pending", "processing"]:
-        new_status = "cancelled"
-        state_val = -1
-    elif order["status"].lower() == "completed":
-        new_status = "refunded"
-        state_val = -2
-    elif order["status"].lower() in ["cancelled", "refunded"]:
-        cancel_time = order.get("cancel_time", cancel_time)
-        state_val = -1 if order["status"].lower() == "cancelled" else -2
-    else:
-        return error_cancel(payload)
-    update_order(order_id, {
-        "status": new_status,
-        "cancel_time": cancel_time,
-        "cancel_reason": params.get("reason")
-    })
-    return {
-        "id": payload.get("id"),
-        "result": {
-            "transaction": "000" + str(order_id),
-            "cancel_time": cancel_time,
-            "state": state_val
-        }
-    }
-
-def change_password(payload):
-    params = payload.get("params", {})
-    new_password = params.get("password")
-    if new_password != MERCHANT_KEY:
-        return {
-            "id": payload.get("id"),
-            "result": {"success": True},
-            "error": None
-        }
-    return error_password(payload)
-
-def get_order_by_transaction(transaction_id):
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cur.execute("SELECT * FROM orders WHERE transaction_id = %s", (transaction_id,))
-    order = cur.fetchone()
-    cur.close()
-    conn.close()
-    return order
-
-# --- Функции формирования ошибок ---
-def error_invalid_json():
-    return {
-        "error": {"code": -32700, "message": {"ru": "Could not parse JSON", "uz": "Could not parse JSON", "en": "Could not parse JSON"}, "data": None},
-        "result": None,
-        "id": 0
-    }
-
-def error_order_id(payload):
-    return {
-        "error": {"code": -31099, "message": {"ru": "Order number cannot be found", "uz": "Order number cannot be found", "en": "Order number cannot be found"}, "data": "order"},
-        "result": None,
-        "id": payload.get("id", 0)
-    }
-
-def error_amount(payload):
-    return {
-        "error": {"code": -31001, "message": {"ru": "Order amount is incorrect", "uz": "Order amount is incorrect", "en": "Order amount is incorrect"}, "data": "amount"},
-        "result": None,
-        "id": payload.get("id", 0)
-    }
-
-def error_has_another_transaction(payload):
-    return {
-        "error": {"code": -31099, "message": {"ru": "Other transaction for this order is in progress", "uz": "Other transaction for this order is in progress", "en": "Other transaction for this order is in progress"}, "data": "order"},
-        "result": None,
-        "id": payload.get("id", 0)
-    }
-
-def error_unknown(payload):
-    return {
-        "error": {"code": -31008, "message": {"ru": "Unknown error", "uz": "Unknown error", "en": "Unknown error"}, "data": None},
-        "result": None,
-        "id": payload.get("id", 0)
-    }
-
-def error_transaction(payload):
-    return {
-        "error": {"code": -31003, "message": {"ru": "Transaction number is wrong", "uz": "Transaction number is wrong", "en": "Transaction number is wrong"}, "data": "id"},
-        "result": None,
-        "id": payload.get("id", 0)
-    }
-
-def error_cancelled_transaction(payload):
-    return {
-        "error": {"code": -31008, "message": {"ru": "Transaction was cancelled or refunded", "uz": "Transaction was cancelled or refunded", "en": "Transaction was cancelled or refunded"}, "data": "order"},
-        "result": None,
-        "id": payload.get("id", 0)
-    }
-
-def error_cancel(payload):
-    return {
-        "error": {"code": -31007, "message": {"ru": "It is impossible to cancel. The order is completed", "uz": "It is impossible to cancel. The order is completed", "en": "It is impossible to cancel. The order is completed"}, "data": "order"},
-        "result": None,
-        "id": payload.get("id", 0)
-    }
-
-def error_password(payload):
-    return {
-        "error": {"code": -32400, "message": {"ru": "Cannot change the password", "uz": "Cannot change the password", "en": "Cannot change the password"}, "data": "password"},
-        "result": None,
-        "id": payload.get("id", 0)
-    }
-
-def error_authorization(payload):
-    return {
-        "error": {"code": -32504, "message": {"ru": "Error during authorization", "uz": "Error during authorization", "en": "Error during authorization"}, "data": None},
-        "result": None,
-        "id": payload.get("id", 0)
-    }
-
-def error_unknown_method(payload):
-    return {
-        "error": {"code": -32601, "message": {"ru": "Unknown method", "uz": "Unknown method", "en": "Unknown method"}, "data": payload.get("method", "")},
-        "result": None,
-        "id": payload.get("id", 0)
-    }
+        logging.error("Прогрев не выполнен (повтор при первом запросе): %s", e)
 
 # ============================================================================
 
 # Маршрут для GET-запросов по /payment – отдает HTML-форму оплаты с автосабмитом
 @app.route('/payment', methods=['GET'])
 def payment_form():
-    order_id_param = request.args.get("order_id", "")
-    amount = request.args.get("amount", "")
-    merchant = request.args.get("merchant", "")
-    callback = request.args.get("callback", "")
-    lang = request.args.get("lang", "ru")
-    description = request.args.get("description", "Оплата заказа")
-    signature = request.args.get("signature", "")
-    
-    if not callback or callback.lower() == "none":
-        callback = CALLBACK_BASE_URL if CALLBACK_BASE_URL else ""
-    
-    # Используем DOMContentLoaded и небольшой таймаут для автоматического сабмита,
-    # а также скрываем кнопку (display:none), чтобы пользователь не видел её.
-    html_form = f"""<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <title>Оплата за заказ</title>
-    <script>
-      document.addEventListener("DOMContentLoaded", function() {{
-         setTimeout(function() {{
-            document.forms[0].submit();
-         }}, 100);
-      }});
-    </script>
-</head>
-<body>
-    <h1>Оплата за заказ</h1>
-    <form action="{CHECKOUT_URL}" method="POST">
-        <input type="hidden" name="account[order_id]" value="{order_id_param}">
-        <input type="hidden" name="amount" value="{amount}">
-        <input type="hidden" name="merchant" value="{merchant}">
-        <input type="hidden" name="callback" value="{callback}">
-        <input type="hidden" name="lang" value="{lang}">
-        <input type="hidden" name="description" value="{description}">
-        <input type="hidden" name="signature" value="{signature}">
-        <button type="submit" style="display:none;">Оплатить</button>
-    </form>
-    <p>Order ID (merchant_trans_id): {order_id_param}</p>
-</body>
-</html>"""
-    return html_form
-
-# Основной обработчик callback
+    status, headers, body = payment_page.respond(
+        request.args, request.headers.get("If-None-Match"), request.headers.get("Accept-Encoding")
+    )
+    return Response(body, status=status, headers=headers)
+
+# Готовность: проверка схемы и прогрев пула (в режиме fast – при первом вызове)
+@app.route('/ready', methods=['GET'])
+def ready():
+    try:
+        ensure_ready()
+    except Exception:
+        # Подробности – только в лог: маршрут открыт без авторизации
+        logging.exception("Сервер не готов")
+        return jsonify({"ready": False}), 503
+    return jsonify({"ready": True, "startup": startup.stats(),
+                    "partitions_missing": partitions.stats()["missing_count"]})
+
+# Этапы старта текущего процесса
+@app.route('/stats/startup', methods=['GET'])
+def startup_stats():
+    return jsonify(startup.stats())
+
+# Статистика пула соединений текущего воркера
+@app.route('/stats/db', methods=['GET'])
+def db_stats():
+    if order_repository.is_memory():
+        return jsonify(backend.stats())
+    return jsonify(db_pool.get_pool().stats())
+
+# Где найдены заказы горячего пути: горячие секции, остальные, архив
+@app.route('/stats/orders', methods=['GET'])
+def orders_stats():
+    return jsonify(order_queries.lookup_stats())
+
+# Статистика доставки уведомлений
+@app.route('/stats/outbox', methods=['GET'])
+def outbox_stats():
+    return jsonify(outbox.stats())
+
+# Статистика отмены просроченных транзакций
+@app.route('/stats/expiry', methods=['GET'])
+def expiry_stats():
+    return jsonify(expiry.stats())
+
+# Проверка секций orders (partitions.PartitionKeeper)
+@app.route('/stats/partitions', methods=['GET'])
+def partitions_stats():
+    return jsonify(partitions.stats())
+
+# Статистика журнала аудита вызовов
+@app.route('/stats/audit', methods=['GET'])
+def audit_stats():
+    return jsonify(audit.stats())
+
+# Статистика трассировки запросов
+@app.route('/stats/tracing', methods=['GET'])
+def tracing_stats():
+    return jsonify(tracing.stats())
+
+# Статистика кэша ответов PayMe
+@app.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(response_cache.cache.stats())
+
+# Статистика кэша страниц /payment
+@app.route('/stats/payment', methods=['GET'])
+def payment_page_stats():
+    return jsonify(payment_page.stats())
+
+# Справочник товаров для чеков
+@app.route('/stats/catalog', methods=['GET'])
+def catalog_stats():
+    return jsonify(product_catalog.catalog.stats())
+
+# Статистика кэша профилей клиентов (уведомления об оплате)
+@app.route('/stats/clients', methods=['GET'])
+def clients_stats():
+    return jsonify(client_cache.cache.stats())
+
+# Метрики Prometheus (агрегируются по всем воркерам, см. metrics.py)
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not order_repository.is_memory():
+        metrics.refresh_order_statuses(get_db())
+        metrics.set_partitions(partitions.stats())
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+# Бэкенд обработчиков payme_handlers (см. order_repository.py): PostgreSQL через
+# соединение текущего запроса или, при ORDER_REPOSITORY=memory, заказы в памяти
+# процесса без БД (нагрузочные прогоны)
+if order_repository.is_memory():
+    backend = order_repository.MemoryRepository(GROUP_CHAT_ID)
+else:
+    backend = order_repository.PostgresRepository(get_db, GROUP_CHAT_ID)
+
+# Основной обработчик callback. Каждый вызов – трасса (tracing.py); для
+# GetStatement трасса заканчивается до потоковой отправки выписки.
 @app.route('/callback', methods=['POST'])
 def callback():
+    trace = tracing.start_trace("callback")
+    try:
+        response = _callback(trace)
+    except Exception:
+        tracing.finish_trace(trace, error=True)
+        raise
+    tracing.finish_trace(trace)
+    return response
+
+def _callback(trace):
+    started = time.perf_counter()
+    if not _ready:
+        with tracing.span("ensure_ready"):
+            ensure_ready()
+    raw_data = request.get_data()
     try:
-        raw_data = request.data.decode('utf-8')
-        logging.info("Received raw data: %s", raw_data)
-        payload = json.loads(raw_data)
+        with tracing.span("json_parse", bytes=len(raw_data)):
+            payload = rpc_codec.loads(raw_data)
     except Exception as e:
-        logging.error("JSON parse error: %s", str(e))
-        response = error_invalid_json()
-        logging.info("Response: %s", json.dumps(response))
-        return jsonify(response)
-    
-    logging.info("Headers: %s", dict(request.headers))
-    logging.info("Payload: %s", payload)
+        logging.error("JSON parse error: %s (%d bytes)", e, len(raw_data))
+        response = payme_handlers.error_invalid_json()
+        rpc_log.log_call(None, response, started)
+        metrics.observe_rpc(None, response, started)
+        record_audit(None, response, started, raw_data)
+        return Response(rpc_codec.encode_response(response), mimetype="application/json")
     
-    # Проверка merchant
-    merchant_in_payload = payload.get("params", {}).get("merchant")
-    if merchant_in_payload and merchant_in_payload != PAYME_MERCHANT_ID:
-        logging.warning("Merchant ID mismatch: payload merchant '%s' != PAYME_MERCHANT_ID '%s'", merchant_in_payload, PAYME_MERCHANT_ID)
-        response = error_authorization(payload)
-        return jsonify(response)
-    
-    # Проверка авторизации через заголовок
     auth_header = request.headers.get("Authorization", "")
-    expected_auth = "Basic " + base64.b64encode(f"Paycom:{MERCHANT_KEY}".encode()).decode()
-    if auth_header.strip() != expected_auth.strip():
-        response = error_authorization(payload)
-        logging.warning("Authorization failed. Provided: %s, Expected: %s", auth_header, expected_auth)
-        logging.info("Response: %s", json.dumps(response))
-        return jsonify(response)
-    
-    method = payload.get("method", "")
-    if method == "CheckPerformTransaction":
-        response = check_perform_transaction(payload)
-    elif method == "CreateTransaction":
-        response = create_transaction(payload)
-    elif method == "PerformTransaction":
-        response = perform_transaction(payload)
-    elif method == "CheckTransaction":
-        response = check_transaction(payload)
-    elif method == "CancelTransaction":
-        response = cancel_transaction(payload)
-    elif method == "ChangePassword":
-        response = change_password(payload)
-    else:
-        response = error_unknown_method(payload)
+    response = payme_handlers.run_sync(payme_handlers.dispatch(payload, auth_header), backend)
     
-    logging.info("Response: %s", json.dumps(response))
-    return jsonify(response)
+    rpc_log.log_call(payload, response, started, request.headers)
+    metrics.observe_rpc(payload, response, started)
+    record_audit(payload, response, started)
+    trace.attrs.update(tracing.rpc_attrs(payload, response))
+    if isinstance(response, rpc_codec.StreamedResponse):
+        return Response(stream_with_context(rpc_codec.iter_encoded(response)), mimetype="application/json")
+    return Response(rpc_codec.encode_response(response), mimetype="application/json")
+
+# Журнал аудита (audit.py): запись в буфер, в БД – фоновым потоком пачками.
+# С хранилищем в памяти не ведётся.
+def record_audit(payload, response, started, raw=None):
+    if not order_repository.is_memory():
+        audit.record(payload, response, started, raw)
 
 # --- Автопинг для Render.com ---
 def auto_ping():
@@ -573,6 +250,7 @@ def auto_ping():
     if not auto_ping_url:
         logging.warning("AUTO_PING_URL не задан. Автопинг не запущен.")
         return
+    import requests  # Лениво: не замедляет холодный старт
     while True:
         try:
             requests.get(auto_ping_url)
@@ -581,9 +259,67 @@ def auto_ping():
             logging.error("Ошибка автопинга: %s", e)
         time.sleep(300)  # каждые 5 минут
 
-# Запускаем автопинг в фоновом потоке
-threading.Thread(target=auto_ping, daemon=True).start()
+def start_auto_ping():
+    threading.Thread(target=auto_ping, name="auto-ping", daemon=True).start()
+
+# --- Запуск ---
+# Импорт модуля ничего не запускает. create_app() выполняет разовую подготовку
+# (логирование, проверка схемы – в режиме fast откладывается, см. startup.py),
+# start_background() – фоновые потоки процесса (outbox, LISTEN). Под gunicorn (gunicorn_conf.py) create_app() вызывается
+# один раз в мастере (preload_app), start_background() – в post_fork каждого
+# воркера, автопинг – один на весь сервер в мастере.
+startup.mark("routes")
+_app_ready = False
+
+def create_app():
+    global _app_ready, _schema_verified
+    if not _app_ready:
+        # Настройка логирования: запись в stdout из фонового потока (rpc_log.py)
+        rpc_log.setup_logging()
+        startup.mark("setup_logging")
+        if order_repository.is_memory():
+            logging.warning("ORDER_REPOSITORY=memory: заказы в памяти процесса, БД не используется")
+        elif not startup.is_fast():
+            verify_schema()
+            _schema_verified = True
+            startup.mark("verify_schema")
+        _app_ready = True
+        startup.log_breakdown("create_app")
+    return app
+
+def start_background():
+    started = time.perf_counter()
+    rpc_log.setup_logging()
+    # Хранилище в памяти: outbox, отмена просроченных, справочник и LISTEN работают с БД
+    if order_repository.is_memory():
+        return
+    # Запускаем воркеры доставки уведомлений
+    outbox.start_workers()
+    # Отмена просроченных транзакций PayMe (один воркер за раз, см. expiry.py)
+    expiry.start_sweeper()
+    # Секции orders на месяцы вперёд – и без деплоев (один процесс за раз, см. partitions.py)
+    partitions.start_keeper()
+    # Справочник товаров для чеков: загружается сразу, дальше обновляется по NOTIFY.
+    # В режиме fast – вместе с проверкой схемы и прогревом пула в фоне.
+    if not startup.is_fast():
+        try:
+            product_catalog.reload_from_pool()
+        except Exception as e:
+            logging.error("Справочник товаров не загружен: %s", e)
+    # Межпроцессная инвалидация кэшей через LISTEN/NOTIFY
+    listener = pg_listener.get_listener()
+    response_cache.subscribe(listener)
+    client_cache.subscribe(listener)
+    product_catalog.subscribe(listener)
+    listener.start()
+    startup.record("start_background", started)
+    if startup.is_fast():
+        threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+    startup.log_breakdown("start_background")
 
 if __name__ == '__main__':
     port = int(os.environ["PORT"])
+    create_app()
+    start_background()
+    start_auto_ping()
     app.run(host='0.0.0.0', port=port)
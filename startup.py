@@ -0,0 +1,62 @@
+import os
+import time
+import logging
+import threading
+
+# Холодный старт процесса. Платформа усыпляет простаивающий инстанс, и первый
+# запрос PayMe после пробуждения ждёт весь старт: импорты, проверку схемы,
+# соединения с БД. STARTUP_MODE:
+#   eager (по умолчанию) – схема проверяется в create_app(), до приёма запросов;
+#   fast – create_app() не ходит в БД: проверка схемы, прогрев пула и загрузка
+#     справочника товаров идут в фоне после start_background(), а первый
+#     запрос, которому нужна БД, дожидается их (server.ensure_ready()).
+#     GET /ready выполняет то же самое – его удобно дёргать сразу после деплоя
+#     или пробуждения.
+#
+# Этапы старта (импорты, create_app, фоновые потоки, прогрев) замеряются
+# от импорта этого модуля и пишутся в лог одной строкой; их же отдаёт
+# /stats/startup – для сравнения стоимости старта между релизами.
+
+_started = time.perf_counter()
+_last = _started
+_phases = []  # (этап, мс)
+_lock = threading.Lock()
+
+
+# Режим читается при вызове: модуль импортируется первым, ещё до load_dotenv()
+def mode():
+    return os.getenv("STARTUP_MODE", "eager")
+
+
+def is_fast():
+    return mode() == "fast"
+
+
+# Отмечает конец этапа: его длительность – от предыдущей отметки
+def mark(phase):
+    global _last
+    with _lock:
+        now = time.perf_counter()
+        _phases.append((phase, round((now - _last) * 1000, 1)))
+        _last = now
+
+
+# Длительность отдельного действия вне общей последовательности (прогрев, первый запрос)
+def record(phase, started):
+    with _lock:
+        _phases.append((phase, round((time.perf_counter() - started) * 1000, 1)))
+
+
+def elapsed_ms():
+    return round((time.perf_counter() - _started) * 1000, 1)
+
+
+def log_breakdown(stage):
+    with _lock:
+        phases = ", ".join(f"{phase} {ms} мс" for phase, ms in _phases)
+    logging.info("Старт (%s, %s, pid %s): %s мс – %s", stage, mode(), os.getpid(), elapsed_ms(), phases)
+
+
+def stats():
+    with _lock:
+        return {"mode": mode(), "pid": os.getpid(), "phases_ms": dict(_phases)}
@@ -0,0 +1,214 @@
+import os
+import time
+import threading
+import metrics
+import tracing
+
+# Клиент Telegram Bot API для outbox: одна пулированная keep-alive сессия на
+# процесс и ограничитель частоты отправки (token bucket) на каждый чат и на
+# бота в целом. Ответ 429 с retry_after блокирует чат на указанное время –
+# следующие сообщения в него откладываются, а не получают новый 429.
+#
+# Лимиты Telegram: ~1 сообщение в секунду в личный чат, 20 в минуту в группу,
+# около 30 в секунду на бота. Ограничитель локален для процесса.
+#
+# requests импортируется при создании первой сессии, то есть при первой
+# отправке: на холодный старт сервера его импорт не влияет.
+
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", "10"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # сообщений/сек. в личный чат
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", str(20 / 60)))  # сообщений/сек. в группу
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))  # сообщений/сек. на бота
+TELEGRAM_BURST = float(os.getenv("TELEGRAM_BURST", "3"))  # размер «ведра» чата
+TELEGRAM_MAX_WAIT = float(os.getenv("TELEGRAM_MAX_WAIT", "2"))  # сек.; дольше – отложить через outbox
+
+MESSAGE_LIMIT = 4096  # символов в одном сообщении
+
+
+class PermanentError(Exception):
+    pass
+
+
+class RetryableError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    # Задержка до момента, когда можно отправить, без резервирования
+    def delay(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+
+# Групповые чаты и каналы в Bot API имеют отрицательные id
+def is_group_chat(chat_id):
+    return str(chat_id).startswith("-")
+
+
+class RateLimiter:
+    def __init__(self, chat_rate=TELEGRAM_CHAT_RATE, group_rate=TELEGRAM_GROUP_RATE,
+                 global_rate=TELEGRAM_GLOBAL_RATE, burst=TELEGRAM_BURST, max_wait=TELEGRAM_MAX_WAIT):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self._global = TokenBucket(global_rate, max(global_rate, 1))
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if is_group_chat(chat_id) else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.burst)
+        return bucket
+
+    # Резервирует отправку в чат и возвращает, сколько секунд подождать перед ней.
+    # Если ждать дольше max_wait – RetryableError: outbox отложит запись сам,
+    # не занимая поток воркера.
+    def reserve(self, chat_id):
+        chat_id = str(chat_id)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(chat_id)
+            wait = max(bucket.delay(now), self._global.delay(now))
+            if wait > self.max_wait:
+                raise RetryableError(f"Лимит отправки в чат {chat_id}, ждать {wait:.1f} сек.", wait)
+            bucket.take()
+            self._global.take()
+        return wait
+
+    # Ответ 429: чат заблокирован на retry_after секунд
+    def block(self, chat_id, retry_after):
+        with self._lock:
+            bucket = self._bucket(str(chat_id))
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+            bucket.tokens = min(bucket.tokens, 0)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            blocked = sum(1 for b in self._buckets.values() if b.blocked_until > now)
+            return {"chats": len(self._buckets), "blocked_chats": blocked}
+
+
+def make_session(pool_size=2):
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def telegram_url(token=None):
+    return f"{TELEGRAM_API_URL}/bot{token or TELEGRAM_BOT_TOKEN}/sendMessage"
+
+
+# Разбор ответа Bot API. Ошибки делятся на временные (5xx, 429)
+# и постоянные (остальные 4xx – например, чат не найден).
+def check_telegram_response(status_code, body):
+    if status_code == 200:
+        return body
+    description = f"HTTP {status_code}: {body.get('description')}"
+    if status_code == 429:
+        raise RetryableError(description, (body.get("parameters") or {}).get("retry_after"))
+    if status_code >= 500:
+        raise RetryableError(description)
+    raise PermanentError(description)
+
+
+# Отправка одного сообщения через переданную сессию; сетевые ошибки считаются временными
+def send_message_to_telegram(session, chat_id, text, token=None):
+    import requests
+    payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+    started = time.perf_counter()
+    try:
+        response = session.post(telegram_url(token), json=payload, timeout=TELEGRAM_TIMEOUT)
+    except requests.RequestException as e:
+        metrics.observe_telegram_send(started, "retryable")
+        raise RetryableError(str(e))
+    try:
+        body = response.json()
+    except ValueError:
+        body = {"description": response.text[:200]}
+    try:
+        result = check_telegram_response(response.status_code, body)
+    except RetryableError:
+        metrics.observe_telegram_send(started, "retryable")
+        raise
+    except PermanentError:
+        metrics.observe_telegram_send(started, "permanent")
+        raise
+    metrics.observe_telegram_send(started)
+    return result
+
+
+class TelegramClient:
+    def __init__(self, pool_size=2, limiter=None):
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.limiter = limiter or RateLimiter()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = make_session(self.pool_size)
+        return self._session
+
+    def send(self, chat_id, text):
+        with tracing.span("telegram.send", chat_id=str(chat_id)) as span:
+            wait = self.limiter.reserve(chat_id)
+            if wait:
+                span.set(rate_wait_ms=round(wait * 1000, 1))
+                time.sleep(wait)
+            try:
+                return send_message_to_telegram(self.session, chat_id, text)
+            except RetryableError as e:
+                if e.retry_after:
+                    self.limiter.block(chat_id, e.retry_after)
+                raise
+
+
+# Делит строки на сообщения не длиннее limit по границам строк: [[номер строки]]
+def split_lines(lines, limit=MESSAGE_LIMIT):
+    groups, current, size = [], [], 0
+    for index, line in enumerate(lines):
+        length = min(len(line), limit)
+        if current and size + 1 + length > limit:
+            groups.append(current)
+            current, size = [], 0
+        size += length + 1 if current else length
+        current.append(index)
+    if current:
+        groups.append(current)
+    return groups
+
+
+# Делит текст на сообщения не длиннее limit по границам строк
+def split_message(lines, limit=MESSAGE_LIMIT):
+    return ["\n".join(lines[index][:limit] for index in group) for group in split_lines(lines, limit)]
@@ -0,0 +1,69 @@
+import time
+import psycopg2
+import audit
+
+
+def test_make_entry_redacts_password():
+    payload = {"id": 5, "method": "ChangePassword", "params": {"password": "secret"}}
+    entry = audit.make_entry(payload, {"id": 5, "result": {"success": True}}, time.perf_counter())
+    request = entry[-2]
+    assert request["params"]["password"] == "***"
+    assert "secret" not in str(entry)
+    # Исходный запрос не меняется – его ещё читает обработчик
+    assert payload["params"]["password"] == "secret"
+
+
+def test_make_entry_keeps_transaction_fields():
+    payload = {"id": 1, "method": "CheckPerformTransaction",
+               "params": {"id": "t-1", "amount": 100000, "account": {"order_id": 42}}}
+    response = {"id": 1, "error": {"code": -31050}}
+    entry = audit.make_entry(payload, response, time.perf_counter())
+    assert entry[1:6] == ("CheckPerformTransaction", "1", "t-1", "42", -31050)
+    assert entry[-2] == payload
+    assert entry[-1] == response
+
+
+def test_make_entry_unparsed_body():
+    response = {"id": None, "error": {"code": -32700}}
+    entry = audit.make_entry(None, response, time.perf_counter(), b"{not json")
+    assert entry[1] is None
+    assert entry[-2] == {"raw": "{not json"}
+
+
+def test_copy_line_replaces_nul():
+    payload = {"id": 1, "method": "CheckTransaction", "params": {"id": "t\x00-1"}}
+    entry = audit.make_entry(None, {"id": None, "error": {"code": -32700}}, time.perf_counter(), b"{\x00}")
+    line = audit._copy_line(entry)
+    assert "\x00" not in line and "\\u0000" not in line
+    line = audit._copy_line(audit.make_entry(payload, {"id": 1, "result": {}}, time.perf_counter()))
+    assert "\x00" not in line and "\\u0000" not in line
+    assert "t�-1" in line
+
+
+class RejectingCursor:
+    # COPY отклоняет данные, в которых есть marker, – как jsonb отклоняет \u0000
+    def __init__(self, marker):
+        self.marker = marker
+        self.rows = []
+        self.statements = []
+
+    def execute(self, sql):
+        self.statements.append(sql)
+
+    def copy_expert(self, sql, buffer):
+        data = buffer.read()
+        if self.marker in data:
+            raise psycopg2.DataError("unsupported Unicode escape sequence")
+        self.rows.extend(data.splitlines())
+
+
+def test_copy_rows_drops_only_rejected_entry():
+    started = time.perf_counter()
+    entries = [audit.make_entry({"id": i, "method": "CheckTransaction", "params": {"id": f"t-{i}"}},
+                                {"id": i, "result": {}}, started) for i in range(3)]
+    cur = RejectingCursor("t-1")
+    rejected = audit.stats()["rejected"]
+    assert audit.copy_rows(cur, entries) == 2
+    assert len(cur.rows) == 2 and "t-1" not in "".join(cur.rows)
+    assert cur.statements.count("ROLLBACK TO SAVEPOINT audit_row") == 1
+    assert audit.stats()["rejected"] == rejected + 1
@@ -0,0 +1,137 @@
+import os
+import pytest
+import expiry
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+SCHEMA = f"expiry_test_{os.getpid()}"
+
+
+# Курсор-заглушка: ответы на LOCK_SQL и EXPIRE_SQL по очереди
+class FakeCursor:
+    def __init__(self, locks, batches):
+        self.locks = list(locks)
+        self.batches = list(batches)
+        self.executed = []
+        self.result = None
+        self.closed = False
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        if sql == expiry.LOCK_SQL:
+            self.result = [(self.locks.pop(0),)]
+        else:
+            self.result = [(transaction_id,) for transaction_id in self.batches.pop(0)]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_sweep_params_deadline():
+    params = expiry.sweep_params(now=50_000_000, batch_size=10)
+    assert params == {
+        "deadline": 50_000_000 - expiry.PAYME_TRANSACTION_TIMEOUT, "now": 50_000_000,
+        "reason": expiry.CANCEL_REASON_TIMEOUT, "limit": 10,
+    }
+
+
+def test_sweep_runs_batches_until_short_one():
+    cur = FakeCursor(locks=[True, True], batches=[["t-1", "t-2"], ["t-3"]])
+    conn = FakeConnection(cur)
+    before = expiry.stats()
+    assert expiry.sweep(conn, batch_size=2) == 3
+    assert [params for sql, params in cur.executed if sql == expiry.LOCK_SQL] == [(expiry.EXPIRY_LOCK_ID,)] * 2
+    assert [params["limit"] for sql, params in cur.executed if sql == expiry.EXPIRE_SQL] == [2, 2]
+    assert conn.commits == 2 and cur.closed
+    after = expiry.stats()
+    assert after["sweeps"] == before["sweeps"] + 1
+    assert after["expired"] == before["expired"] + 3
+
+
+def test_sweep_skips_when_locked_elsewhere():
+    cur = FakeCursor(locks=[False], batches=[])
+    conn = FakeConnection(cur)
+    skipped = expiry.stats()["skipped_locked"]
+    assert expiry.sweep(conn) == 0
+    assert [sql for sql, _ in cur.executed] == [expiry.LOCK_SQL]
+    assert (conn.commits, conn.rollbacks) == (0, 1)
+    assert expiry.stats()["skipped_locked"] == skipped + 1
+
+
+def test_sweep_rolls_back_on_error():
+    cur = FakeCursor(locks=[True], batches=[])  # EXPIRE_SQL падает: пачек нет
+    conn = FakeConnection(cur)
+    with pytest.raises(IndexError):
+        expiry.sweep(conn)
+    assert conn.rollbacks == 1 and cur.closed
+
+
+# --- Отмена в PostgreSQL: нужна TEST_DATABASE_URL (таблица – во временной схеме) ---
+
+@pytest.fixture
+def conn():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL не задан")
+    import psycopg2
+    conn = psycopg2.connect(TEST_DATABASE_URL, options=f"-c search_path={SCHEMA}")
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(
+        "CREATE TABLE orders (order_id INTEGER NOT NULL, order_time TIMESTAMP NOT NULL DEFAULT now(), "
+        "transaction_id TEXT, status TEXT, create_time BIGINT, cancel_time BIGINT, cancel_reason INTEGER, "
+        # state вместо триггера orders_set_state
+        "state INTEGER GENERATED ALWAYS AS (CASE status WHEN 'processing' THEN 1 ELSE 0 END) STORED)"
+    )
+    conn.autocommit = False
+    yield conn
+    conn.rollback()
+    conn.autocommit = True
+    conn.cursor().execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    conn.close()
+
+
+def test_sweep_cancels_only_expired_processing_orders(conn):
+    now = expiry.current_timestamp()
+    old = now - expiry.PAYME_TRANSACTION_TIMEOUT - 1000
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT INTO orders (order_id, transaction_id, status, create_time) VALUES (%s, %s, %s, %s)",
+        [
+            (1, "t-1", "processing", old),
+            (2, "t-2", "processing", old),
+            (3, "t-3", "processing", now),  # ещё не просрочена
+            (4, "t-4", "completed", old),
+        ],
+    )
+    conn.commit()
+    assert expiry.sweep(conn, batch_size=1) == 2
+    cur = conn.cursor()
+    cur.execute("SELECT order_id, status, cancel_reason FROM orders ORDER BY order_id")
+    assert cur.fetchall() == [
+        (1, "cancelled", expiry.CANCEL_REASON_TIMEOUT),
+        (2, "cancelled", expiry.CANCEL_REASON_TIMEOUT),
+        (3, "processing", None),
+        (4, "completed", None),
+    ]
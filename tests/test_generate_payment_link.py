@@ -0,0 +1,31 @@
+import pytest
+import generate_payment_link
+
+DEFAULTS = {"amount": 100000, "user_id": None, "product": "Кружка", "description": "Оплата"}
+
+
+def orders(rows):
+    return list(generate_payment_link.make_orders(rows, DEFAULTS))
+
+
+def test_defaults_and_csv_strings():
+    first, second = orders([{}, {"amount": "250000", "quantity": "3", "user_id": "7"}])
+    assert (first["amount"], first["quantity"], first["user_id"]) == (100000, 1, None)
+    assert (second["amount"], second["quantity"], second["user_id"]) == (250000, 3, 7)
+    assert first["merchant_trans_id"] != second["merchant_trans_id"]
+
+
+def test_integral_float_amount_is_accepted():
+    assert orders([{"amount": 100000.0}])[0]["amount"] == 100000
+
+
+@pytest.mark.parametrize("amount", [100000.9, "100000.9", 0, "0", -100000, "abc", float("nan"), True, 100050])
+def test_bad_amount_is_rejected_with_row_number(amount):
+    with pytest.raises(ValueError, match="строка 2"):
+        orders([{}, {"amount": amount}])
+
+
+@pytest.mark.parametrize("quantity", ["0", "-3", 0, 1.5, "x"])
+def test_bad_quantity_is_rejected_with_row_number(quantity):
+    with pytest.raises(ValueError, match="строка 1: количество"):
+        orders([{"quantity": quantity}])
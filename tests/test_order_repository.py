@@ -0,0 +1,95 @@
+import pytest
+import transitions
+import order_states
+from order_repository import MemoryRepository, OrderRepository
+
+AMOUNT = 100000  # тийины
+
+
+@pytest.fixture
+def repository():
+    repository = MemoryRepository(group_chat_id="-100")
+    repository.add_order(order_id=1, user_id=7, merchant_trans_id="m-1",
+                         payment_amount=AMOUNT // 100, payme_amount=AMOUNT)
+    return repository
+
+
+def create(repository, amount=AMOUNT, transaction_id="t-1"):
+    return repository.apply_transition(transitions.CREATE, "m-1", {
+        "now": 1000, "transaction_id": transaction_id, "amount": amount,
+    })
+
+
+def perform(repository, notify=True):
+    return repository.apply_transition(transitions.PERFORM, "t-1", {"now": 2000}, notify=notify)
+
+
+def cancel(repository):
+    return repository.apply_transition(transitions.CANCEL, "t-1", {"now": 3000, "reason": 5})
+
+
+def test_implements_interface(repository):
+    assert isinstance(repository, OrderRepository)
+
+
+def test_create_with_wrong_amount_is_rejected(repository):
+    applied, order = create(repository, amount=AMOUNT + 100)
+    assert not applied
+    assert order["state"] == order_states.NEW
+    assert order["transaction_id"] is None
+    assert repository.get_order_by_transaction("t-1") is None
+
+
+def test_create_sets_transaction(repository):
+    applied, order = create(repository)
+    assert applied
+    assert order["state"] == order_states.CREATED
+    assert order["status"] == "processing"
+    assert order["create_time"] == 1000
+    assert repository.get_order_by_transaction("t-1")["order_id"] == 1
+
+
+def test_repeated_perform_is_not_applied(repository):
+    create(repository)
+    applied, order = perform(repository)
+    assert applied and order["state"] == order_states.PERFORMED
+    assert len(repository.outbox) == 2  # покупатель и сводка группы
+
+    applied, order = perform(repository)
+    assert not applied
+    assert order["state"] == order_states.PERFORMED
+    assert order["perform_time"] == 2000
+    assert len(repository.outbox) == 2
+
+
+def test_cancel_after_perform_refunds_once(repository):
+    create(repository)
+    perform(repository)
+    applied, order = cancel(repository)
+    assert applied
+    assert order["state"] == order_states.CANCELLED_AFTER_PERFORM
+    assert order["cancel_reason"] == 5
+
+    applied, order = cancel(repository)
+    assert not applied
+    assert order["state"] == order_states.CANCELLED_AFTER_PERFORM
+    applied, order = perform(repository)
+    assert not applied
+
+
+def test_cancel_before_perform_blocks_perform(repository):
+    create(repository)
+    applied, order = cancel(repository)
+    assert applied and order["state"] == order_states.CANCELLED
+    applied, order = perform(repository)
+    assert not applied
+    assert order["state"] == order_states.CANCELLED
+
+
+def test_unknown_key(repository):
+    assert repository.apply_transition(transitions.PERFORM, "missing", {"now": 1}) == (False, None)
+
+
+def test_duplicate_merchant_trans_id_is_rejected(repository):
+    with pytest.raises(ValueError):
+        repository.add_order(user_id=8, merchant_trans_id="m-1")
@@ -0,0 +1,48 @@
+import pytest
+import order_states
+from order_states import NEW, CREATED, PERFORMED, CANCELLED, CANCELLED_AFTER_PERFORM
+
+
+@pytest.mark.parametrize("transition, state, expected", [
+    ("create", NEW, CREATED),
+    ("create", CREATED, None),
+    ("create", PERFORMED, None),
+    ("perform", CREATED, PERFORMED),
+    ("perform", NEW, None),
+    ("perform", PERFORMED, None),
+    ("perform", CANCELLED, None),
+    ("cancel", NEW, CANCELLED),
+    ("cancel", CREATED, CANCELLED),
+    ("cancel", PERFORMED, CANCELLED_AFTER_PERFORM),
+    ("cancel", CANCELLED, None),
+    ("cancel", CANCELLED_AFTER_PERFORM, None),
+    ("create", None, None),
+])
+def test_next_state(transition, state, expected):
+    assert order_states.next_state(transition, state) == expected
+
+
+# Закрытые состояния конечны: из них нет ни одного перехода
+def test_closed_states_are_terminal():
+    for state in (CANCELLED, CANCELLED_AFTER_PERFORM):
+        assert all(state not in targets for targets in order_states.TRANSITIONS.values())
+
+
+# Каждое состояние перехода записывается статусом, который читается обратно в то же состояние
+def test_transition_targets_round_trip_through_status():
+    for targets in order_states.TRANSITIONS.values():
+        for target in targets.values():
+            assert order_states.status_state(order_states.STATE_STATUSES[target]) == target
+
+
+def test_status_state_is_case_insensitive_and_unknown_is_none():
+    assert order_states.status_state("Completed") == PERFORMED
+    assert order_states.status_state("в доставке") is None
+    assert order_states.status_state(None) is None
+
+
+def test_next_status_sql():
+    assert order_states.next_status_sql("perform") == "'completed'"
+    assert order_states.next_status_sql("cancel") == (
+        "CASE cur.state WHEN 0 THEN 'cancelled' WHEN 1 THEN 'cancelled' WHEN 2 THEN 'refunded' END"
+    )
@@ -0,0 +1,190 @@
+import os
+import datetime
+import pytest
+import outbox
+import telegram_client
+from telegram_client import RetryableError
+from telegram_stub import TelegramStub
+
+ORDERS = {1: {"order_id": 1, "user_id": 7, "product": "Кружка", "quantity": 2, "payment_amount": 2000}}
+CLIENTS = {7: {"user_id": 7, "name": "Анна", "username": "anna", "contact": "+998"}}
+
+
+def outbox_row(attempts=1, chat_id="7", kind=outbox.PAYMENT_KIND, row_id=10):
+    return {"id": row_id, "order_id": 1, "chat_id": chat_id, "kind": kind, "attempts": attempts}
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = TelegramStub().start()
+    monkeypatch.setattr(telegram_client, "TELEGRAM_API_URL", stub.url)
+    monkeypatch.setattr(telegram_client, "TELEGRAM_BOT_TOKEN", "test-token")
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def worker():
+    return outbox.OutboxWorker(workers=1)
+
+
+def test_deliver_to_stub(stub, worker):
+    row = outbox_row()
+    worker.deliver(row, ORDERS, CLIENTS)
+    assert stub.messages == 1
+    assert outbox.delivery_outcome(row) == (10, "sent", None, None)
+
+
+def test_rate_limited_delivery_is_retried_after_retry_after(stub, worker):
+    stub.error_rate = 1.0
+    row = outbox_row()
+    with pytest.raises(RetryableError) as error:
+        worker.deliver(row, ORDERS, CLIENTS)
+    assert error.value.retry_after == 1
+    row_id, status, delay, message = outbox.delivery_outcome(row, error.value)
+    assert (row_id, status, delay) == (10, "pending", 1)
+    assert "429" in message
+    assert stub.rejected == 1
+
+
+def test_retries_stop_after_max_attempts(stub, worker):
+    stub.error_rate = 1.0
+    row = outbox_row(attempts=outbox.OUTBOX_MAX_ATTEMPTS)
+    with pytest.raises(RetryableError) as error:
+        worker.deliver(row, ORDERS, CLIENTS)
+    assert outbox.delivery_outcome(row, error.value)[1] == "dead"
+
+
+def test_digest_rows_share_one_outcome(stub, worker):
+    rows = [outbox_row(chat_id="-100", kind=outbox.DIGEST_KIND, row_id=i) for i in (1, 2)]
+    digests, missing = outbox.plan_digests(rows, ORDERS, CLIENTS)
+    assert not missing
+    [(chat_id, parts)] = digests
+    assert parts[0][0].startswith("✅ Оплачено заказов: 2")
+    results = worker.deliver_digest(chat_id, parts)
+    assert [status for _, status, _, _ in results] == ["sent", "sent"]
+    assert stub.messages == len(parts)
+
+
+def test_failed_digest_part_is_retried_alone(worker):
+    orders = {order_id: dict(ORDERS[1], order_id=order_id, product="Кружка " * 10) for order_id in range(1, 201)}
+    rows = [dict(outbox_row(chat_id="-100", kind=outbox.DIGEST_KIND, row_id=order_id), order_id=order_id)
+            for order_id in orders]
+    [(chat_id, parts)], _ = outbox.plan_digests(rows, orders, CLIENTS)
+    assert len(parts) >= 3
+    assert sorted(row["id"] for _, part_rows in parts for row in part_rows) == list(orders)
+    assert all(len(text) <= telegram_client.MESSAGE_LIMIT for text, _ in parts)
+
+    sent = []
+
+    # Первая часть уходит, вторая получает 429
+    def send(chat, text):
+        if sent:
+            raise RetryableError("HTTP 429: Too Many Requests", 1)
+        sent.append(text)
+    worker.telegram.send = send
+    results = worker.deliver_digest(chat_id, parts)
+    first = {row["id"] for row in parts[0][1]}
+    assert {row_id for row_id, status, _, _ in results if status == "sent"} == first
+    assert {row_id for row_id, status, _, _ in results if status == "pending"} == set(orders) - first
+
+    # Повтор забирает только неотправленные записи: заказов первой части в нём нет
+    retry_rows = [row for row in rows if row["id"] not in first]
+    [(_, retry_parts)], _ = outbox.plan_digests(retry_rows, orders, CLIENTS)
+    retried = "\n".join(text for text, _ in retry_parts)
+    assert not any(f"№{order_id} " in retried for order_id in first)
+
+
+def test_backoff_grows_and_is_capped():
+    assert outbox.OUTBOX_BACKOFF_BASE * 0.8 <= outbox.backoff_delay(1) <= outbox.OUTBOX_BACKOFF_BASE * 1.2
+    assert outbox.backoff_delay(3) >= outbox.OUTBOX_BACKOFF_BASE * 4 * 0.8
+    assert outbox.backoff_delay(100) <= outbox.OUTBOX_BACKOFF_MAX * 1.2
+
+
+def test_notification_rows_digest_for_group():
+    rows = outbox.notification_rows({"order_id": 1, "user_id": 7}, "-100")
+    assert [(chat_id, kind) for _, chat_id, kind, _ in rows] == [("7", outbox.PAYMENT_KIND), ("-100", outbox.DIGEST_KIND)]
+    assert rows[1][3].timestamp() % outbox.OUTBOX_DIGEST_WINDOW == 0
+
+
+# --- Выборка записей в PostgreSQL: нужна TEST_DATABASE_URL (таблица создаётся во временной схеме) ---
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+SCHEMA = f"outbox_test_{os.getpid()}"
+
+
+@pytest.fixture
+def connections():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL не задан")
+    import psycopg2
+    conns = [psycopg2.connect(TEST_DATABASE_URL) for _ in range(2)]
+    cur = conns[0].cursor()
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"SET search_path TO {SCHEMA}")
+    for sql in outbox.OUTBOX_DDL:
+        cur.execute(sql)
+    conns[0].commit()
+    conns[1].cursor().execute(f"SET search_path TO {SCHEMA}")
+    conns[1].commit()
+    yield conns
+    for conn in conns:
+        conn.rollback()
+    cur = conns[0].cursor()
+    cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    conns[0].commit()
+    for conn in conns:
+        conn.close()
+
+
+def enqueue(conn, rows):
+    import psycopg2.extras
+    psycopg2.extras.execute_values(conn.cursor(), outbox.ENQUEUE_SQL, rows)
+    conn.commit()
+
+
+def claim(conn, sql, params):
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    return cur.fetchall()
+
+
+def test_claim_skips_rows_leased_by_another_worker(connections):
+    first, second = connections
+    now = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)
+    enqueue(first, [(1, "7", outbox.PAYMENT_KIND, now), (2, "8", outbox.PAYMENT_KIND, now)])
+    a = claim(first, outbox.CLAIM_SQL, (outbox.OUTBOX_LEASE, 1))
+    b = claim(second, outbox.CLAIM_SQL, (outbox.OUTBOX_LEASE, 1))
+    assert len(a) == len(b) == 1 and a[0][0] != b[0][0]
+    first.commit()
+    second.commit()
+    # Аренда: до её конца записи никто не забирает
+    assert claim(first, outbox.CLAIM_SQL, (outbox.OUTBOX_LEASE, 10)) == []
+    first.commit()
+
+
+def test_failed_row_is_claimed_again_after_backoff(connections):
+    conn = connections[0]
+    now = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)
+    enqueue(conn, [(1, "7", outbox.PAYMENT_KIND, now)])
+    [(row_id, _, _, _, attempts)] = claim(conn, outbox.CLAIM_SQL, (outbox.OUTBOX_LEASE, 10))
+    conn.cursor().execute(outbox.MARK_FAILED_SQL, ("pending", "HTTP 429", 0, row_id))
+    conn.commit()
+    [(again_id, _, _, _, again_attempts)] = claim(conn, outbox.CLAIM_SQL, (outbox.OUTBOX_LEASE, 10))
+    assert again_id == row_id and again_attempts == attempts + 1
+    conn.commit()
+
+
+def test_digest_window_is_claimed_by_one_worker(connections):
+    first, second = connections
+    due = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)
+    enqueue(first, [(order_id, "-100", outbox.DIGEST_KIND, due) for order_id in range(1, 6)])
+    params = (outbox.OUTBOX_DIGEST_LOCK_ID, outbox.OUTBOX_LEASE, outbox.OUTBOX_DIGEST_MAX)
+    window = claim(first, outbox.CLAIM_DIGEST_SQL, params)
+    # Пока первый воркер не закоммитил выборку, второй не получает ни одной записи окна
+    assert claim(second, outbox.CLAIM_DIGEST_SQL, params) == []
+    second.commit()
+    first.commit()
+    assert len(window) == 5
+    assert claim(second, outbox.CLAIM_DIGEST_SQL, params) == []
+    second.commit()
@@ -0,0 +1,114 @@
+import os
+import datetime
+import pytest
+import partitions
+import order_queries
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+SCHEMA = f"partitions_test_{os.getpid()}"
+
+
+def test_add_months_crosses_year():
+    assert partitions.add_months(datetime.datetime(2026, 11, 1), 3) == datetime.datetime(2027, 2, 1)
+
+
+def test_covered_ignores_default_partition():
+    month = datetime.datetime(2026, 10, 1)
+    listed = [(partitions.DEFAULT_PARTITION, None, None), ("orders_legacy", None, month)]
+    assert not partitions._covered(listed, month, partitions.add_months(month, 1))
+    listed.append((partitions.partition_name(month), month, partitions.add_months(month, 1)))
+    assert partitions._covered(listed, month, partitions.add_months(month, 1))
+
+
+# --- Секции и order_keys в PostgreSQL: нужна TEST_DATABASE_URL (таблицы – во временной схеме) ---
+
+@pytest.fixture
+def conn(monkeypatch):
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL не задан")
+    import psycopg2
+    # Все соединения теста, включая собственное соединение check_partitions, – в схеме SCHEMA
+    monkeypatch.setenv("PGOPTIONS", f"-c search_path={SCHEMA}")
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    monkeypatch.setenv("DB_SSLMODE", "prefer")
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(
+        "CREATE TABLE orders (order_id INTEGER NOT NULL, order_time TIMESTAMP NOT NULL, "
+        "merchant_trans_id TEXT, transaction_id TEXT, status TEXT) PARTITION BY RANGE (order_time)"
+    )
+    cur.execute(f"CREATE TABLE {partitions.DEFAULT_PARTITION} PARTITION OF orders DEFAULT")
+    cur.execute(f"CREATE TABLE {partitions.ARCHIVE_TABLE} (LIKE orders INCLUDING DEFAULTS)")
+    for sql in partitions.ORDER_KEYS_DDL:
+        cur.execute(sql)
+    yield conn
+    conn.rollback()
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    conn.close()
+
+
+def test_check_partitions_creates_missing_months(conn):
+    assert partitions.missing_months(conn.cursor(), 2)
+    assert partitions.check_partitions(2) == []
+    assert partitions.stats()["missing_count"] == 0
+    assert partitions.missing_months(conn.cursor(), 2) == []
+
+
+def test_check_partitions_skips_when_another_process_maintains(conn):
+    import psycopg2
+    other = psycopg2.connect(TEST_DATABASE_URL)
+    try:
+        other.cursor().execute("SELECT pg_advisory_lock(%s)", (partitions.PARTITIONS_LOCK_ID,))
+        skipped = partitions.stats()["skipped_locked"]
+        assert len(partitions.check_partitions(1)) == 2
+        assert partitions.stats()["skipped_locked"] == skipped + 1
+    finally:
+        other.close()
+
+
+def insert(cur, order_id, month, merchant_trans_id, transaction_id=None):
+    cur.execute(
+        "INSERT INTO orders (order_id, order_time, merchant_trans_id, transaction_id, status) "
+        "VALUES (%s, %s, %s, %s, 'completed')",
+        (order_id, month, merchant_trans_id, transaction_id)
+    )
+
+
+def test_order_keys_are_unique_across_partitions(conn):
+    import psycopg2
+    partitions.ensure_partitions(conn, 1)
+    cur = conn.cursor()
+    cur.execute("SELECT date_trunc('month', localtimestamp)")
+    this_month = cur.fetchone()[0]
+    next_month = partitions.add_months(this_month, 1)
+    insert(cur, 1, this_month, "m-1", "t-1")
+    for order_id, merchant_trans_id, transaction_id in ((1, "m-2", None), (2, "m-1", None), (3, "m-3", "t-1")):
+        with pytest.raises(psycopg2.errors.UniqueViolation):
+            insert(cur, order_id, next_month, merchant_trans_id, transaction_id)
+
+
+def test_archived_order_keeps_its_keys_and_can_be_restored(conn):
+    import psycopg2
+    partitions.ensure_partitions(conn, 0)
+    cur = conn.cursor()
+    cur.execute("SELECT date_trunc('month', localtimestamp)")
+    month = cur.fetchone()[0]
+    insert(cur, 1, month, "m-1", "t-1")
+    cur.execute(
+        f"WITH moved AS (DELETE FROM orders WHERE order_id = 1 RETURNING *) "
+        f"INSERT INTO {partitions.ARCHIVE_TABLE} SELECT * FROM moved"
+    )
+    cur.execute(f"SELECT archived FROM {partitions.KEYS_TABLE} WHERE order_id = 1")
+    assert cur.fetchone() == (True,)
+    # Ключ архивного заказа занят: новый заказ с тем же merchant_trans_id не вставляется
+    with pytest.raises(psycopg2.errors.UniqueViolation):
+        insert(cur, 2, month, "m-1")
+    assert order_queries.restore_order(conn, "merchant_trans_id", "m-1")
+    cur.execute(f"SELECT archived FROM {partitions.KEYS_TABLE} WHERE order_id = 1")
+    assert cur.fetchone() == (False,)
+    cur.execute("SELECT count(*) FROM orders WHERE merchant_trans_id = 'm-1'")
+    assert cur.fetchone() == (1,)
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import pytest
+import payme_handlers
+import rpc_codec
+from order_repository import MemoryRepository
+
+AMOUNT = 100000  # тийины
+
+
+@pytest.fixture
+def repository():
+    repository = MemoryRepository()
+    repository.add_order(order_id=1, user_id=7, merchant_trans_id="12345",
+                         payment_amount=AMOUNT // 100, payme_amount=AMOUNT)
+    return repository
+
+
+# Асинхронный бэкенд над хранилищем в памяти. Как asyncpg (asgi_server.AsyncpgBackend),
+# не принимает ключ поиска не строкой: там это DataError и ответ 500.
+class StrictAsyncBackend:
+    def __init__(self, repository):
+        self.repository = repository
+
+    def __getattr__(self, name):
+        method = getattr(self.repository, name)
+
+        async def call(*args):
+            key = args[1] if name == "apply_transition" else args[0]
+            if not isinstance(key, str):
+                raise TypeError(f"{name}: ключ {key!r} не строка")
+            return method(*args)
+        return call
+
+
+def run_both(handler, payload, sync_repository, async_repository):
+    sync_response = payme_handlers.run_sync(handler(payload), sync_repository)
+    async_response = asyncio.run(payme_handlers.run_async(handler(payload), StrictAsyncBackend(async_repository)))
+    return sync_response, async_response
+
+
+def test_integer_order_id_gives_same_answer_in_both_modes(repository):
+    other = MemoryRepository()
+    other.add_order(order_id=1, user_id=7, merchant_trans_id="12345",
+                    payment_amount=AMOUNT // 100, payme_amount=AMOUNT)
+    check = {"id": 1, "method": "CheckPerformTransaction",
+             "params": {"amount": AMOUNT, "account": {"order_id": 12345}}}
+    sync_response, async_response = run_both(payme_handlers.check_perform_transaction, check, repository, other)
+    assert sync_response == async_response
+    assert sync_response["result"]["allow"] is True
+
+    create = {"id": 2, "method": "CreateTransaction",
+              "params": {"id": "t-1", "time": 1, "amount": AMOUNT, "account": {"order_id": 12345}}}
+    sync_response, async_response = run_both(payme_handlers.create_transaction, create, repository, other)
+    assert sync_response["result"]["state"] == async_response["result"]["state"] == 1
+    assert repository.get_order_by_transaction("t-1")["merchant_trans_id"] == "12345"
+
+
+@pytest.mark.parametrize("key", [None, 1.5, True, ["x"], {}])
+def test_malformed_keys_are_not_found(repository, key):
+    check = {"id": 1, "params": {"amount": AMOUNT, "account": {"order_id": key}}}
+    for response in run_both(payme_handlers.check_perform_transaction, check, repository, repository):
+        assert response["error"]["code"] == -31099
+    lookup = {"id": 1, "params": {"id": key}}
+    for response in run_both(payme_handlers.check_transaction, lookup, repository, repository):
+        assert response["error"]["code"] == -31003
+
+
+@pytest.mark.parametrize("params", [
+    {"from": 1000},
+    {"from": "1000", "to": 2000},
+    {"from": 1000.0, "to": 2000},
+    {"from": 2000, "to": 1000},
+])
+def test_statement_rejects_bad_bounds(repository, params):
+    response = payme_handlers.run_sync(payme_handlers.get_statement({"id": 3, "params": params}), repository)
+    assert response["error"]["code"] == -32600
+
+
+def test_statement_streams_transactions_in_period(repository):
+    for order_id, create_time in ((2, 3000), (3, 1000), (4, 2000), (5, 5000)):
+        repository.add_order(order_id=order_id, user_id=7, merchant_trans_id=str(order_id),
+                             payment_amount=AMOUNT // 100, payme_amount=AMOUNT, status="completed",
+                             transaction_id=f"t-{order_id}", create_time=create_time, perform_time=create_time + 1)
+    payload = {"id": 3, "method": "GetStatement", "params": {"from": 1000, "to": 3000}}
+    response = payme_handlers.run_sync(payme_handlers.get_statement(payload), repository)
+    body = json.loads(b"".join(rpc_codec.iter_encoded(response, chunk_size=64)))
+    assert body["id"] == 3 and body["error"] is None
+    transactions = body["result"]["transactions"]
+    assert [t["id"] for t in transactions] == ["t-3", "t-4", "t-2"]
+    assert transactions[0] == {
+        "id": "t-3", "time": 1000, "amount": AMOUNT, "account": {"order_id": "3"},
+        "create_time": 1000, "perform_time": 1001, "cancel_time": 0, "transaction": "0003",
+        "state": 2, "reason": None, "receivers": None,
+    }
@@ -0,0 +1,54 @@
+import gzip
+import payment_page
+
+ARGS = {"order_id": "42", "amount": "150000", "merchant": "m-1", "signature": "s"}
+
+
+def test_params_are_escaped():
+    args = dict(ARGS, order_id='"><script>alert(1)</script>', description="a & b")
+    status, _, body = payment_page.respond(args)
+    assert status == 200
+    page = body.decode("utf-8")
+    assert "<script>alert(1)</script>" not in page
+    assert 'value="&quot;&gt;&lt;script&gt;alert(1)&lt;/script&gt;"' in page
+    assert 'value="a &amp; b"' in page
+
+
+def test_template_script_survives_compilation():
+    page = payment_page.render_payment_form(ARGS)
+    assert "document.forms[0].submit();" in page
+    assert "{{" not in page
+
+
+def test_matching_etag_returns_304():
+    status, headers, _ = payment_page.respond(ARGS)
+    etag = dict(headers)["ETag"]
+    for if_none_match in (etag, "W/" + etag, '"other", ' + etag, "*"):
+        status, headers, body = payment_page.respond(ARGS, if_none_match)
+        assert (status, body) == (304, b"")
+        assert dict(headers)["ETag"] == etag
+    assert payment_page.respond(ARGS, '"other"')[0] == 200
+
+
+def test_etag_depends_on_params():
+    first = dict(payment_page.respond(ARGS)[1])["ETag"]
+    second = dict(payment_page.respond(dict(ARGS, amount="150100"))[1])["ETag"]
+    assert first != second
+
+
+def test_gzip_only_when_accepted():
+    _, headers, body = payment_page.respond(ARGS, accept_encoding="gzip, deflate")
+    headers = dict(headers)
+    assert headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(body) == payment_page.respond(ARGS)[2]
+
+    _, headers, body = payment_page.respond(ARGS, accept_encoding="gzip;q=0, identity")
+    assert "Content-Encoding" not in dict(headers)
+    assert body.startswith(b"<!DOCTYPE html>")
+
+
+def test_gzip_etag_is_accepted_in_if_none_match():
+    _, headers, _ = payment_page.respond(ARGS, accept_encoding="gzip")
+    etag = dict(headers)["ETag"]
+    assert etag.endswith('-gzip"')
+    assert payment_page.respond(ARGS, etag)[0] == 304
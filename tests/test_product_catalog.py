@@ -0,0 +1,55 @@
+import json
+import pytest
+import product_catalog
+
+
+def total(lines):
+    return sum(count * price for _, count, price in lines)
+
+
+def test_split_amount_by_prices_is_exact():
+    lines = product_catalog.split_amount([("Кружка", 2, 3000.0), ("Футболка", 1, 4000.0)], 1000000)
+    assert lines == [("Кружка", 2, 300000), ("Футболка", 1, 400000)]
+    assert total(lines) == 1000000
+
+
+def test_split_amount_without_prices_is_even():
+    lines = product_catalog.split_amount([("Кружка", 1, None), ("Футболка", 1, None)], 100000)
+    assert lines == [("Кружка", 1, 50000), ("Футболка", 1, 50000)]
+
+
+def test_split_amount_splits_indivisible_line():
+    lines = product_catalog.split_amount([("Кружка", 3, None)], 100000)
+    assert lines == [("Кружка", 2, 33333), ("Кружка", 1, 33334)]
+    assert total(lines) == 100000
+
+
+def test_split_amount_zero_prices():
+    lines = product_catalog.split_amount([("Подарок", 1, 0.0), ("Кружка", 1, 0.0)], 100000)
+    assert total(lines) == 100000 and all(price >= 0 for _, _, price in lines)
+
+
+def order(items, order_id=1):
+    return {"order_id": order_id, "items": json.dumps(items), "product": "Кружка", "quantity": 2}
+
+
+def test_order_items_from_json():
+    items = product_catalog.order_items(order([{"product": "Футболка", "quantity": "2", "price": "1500"}]))
+    assert items == [("Футболка", 2, 1500.0)]
+
+
+@pytest.mark.parametrize("item", [
+    {"product": "Футболка", "price": float("nan")},
+    {"product": "Футболка", "price": float("inf")},
+    {"product": "Футболка", "price": -100},
+    {"product": "Футболка", "price": "дёшево"},
+    {"product": "Футболка", "quantity": 0},
+    {"product": "Футболка", "quantity": -3},
+    {"product": "Футболка", "quantity": 1.5},
+    {"quantity": 1},
+])
+def test_bad_items_fall_back_to_order_line(item):
+    items = product_catalog.order_items(order([{"product": "Кружка", "quantity": 1, "price": 100}, item], order_id=2))
+    assert items == [("Кружка", 2, None)]
+    lines = product_catalog.split_amount(items, 100000)
+    assert total(lines) == 100000
@@ -0,0 +1,96 @@
+import pytest
+import response_cache
+from response_cache import ResponseCache, GENERATION_SLOTS
+
+RESPONSE = {"result": {"state": 2}, "error": None}
+
+
+def other_slot(transaction_id):
+    slot = hash(transaction_id) % GENERATION_SLOTS
+    return next(f"t-{i}" for i in range(GENERATION_SLOTS * 2) if hash(f"t-{i}") % GENERATION_SLOTS != slot)
+
+
+def test_put_after_invalidation_is_dropped():
+    cache = ResponseCache()
+    generation = cache.generation("t-1")
+    cache.invalidate("t-1")  # переход статуса, пока ответ читался из БД
+    cache.put("CheckTransaction", "t-1", RESPONSE, generation)
+    assert cache.get("CheckTransaction", "t-1") is None
+
+
+def test_invalidation_of_other_transaction_keeps_put():
+    cache = ResponseCache()
+    generation = cache.generation("t-1")
+    cache.invalidate(other_slot("t-1"))
+    cache.put("CheckTransaction", "t-1", RESPONSE, generation)
+    assert cache.get("CheckTransaction", "t-1") == RESPONSE
+
+
+def test_clear_invalidates_pending_reads():
+    cache = ResponseCache()
+    generation = cache.generation("t-1")
+    cache.clear()  # переподключение LISTEN
+    cache.put("CheckTransaction", "t-1", RESPONSE, generation)
+    assert cache.get("CheckTransaction", "t-1") is None
+
+
+def test_invalidate_drops_all_methods():
+    cache = ResponseCache()
+    for method in response_cache.CACHED_METHODS:
+        cache.put(method, "t-1", RESPONSE)
+    cache.invalidate("t-1")
+    assert all(cache.get(method, "t-1") is None for method in response_cache.CACHED_METHODS)
+
+
+def test_expired_entry_is_a_miss():
+    cache = ResponseCache(ttl=-1)
+    cache.put("CheckTransaction", "t-1", RESPONSE)
+    assert cache.get("CheckTransaction", "t-1") is None
+    assert cache.stats()["expired"] == 1
+
+
+# Обработчик-генератор: одна операция бэкенда, ответ с заданным state
+def handler(state):
+    def check(payload):
+        transaction_id = payload["params"].get("id")
+        if not isinstance(transaction_id, str):
+            return {"id": payload["id"], "error": {"code": -32600}}
+        yield "lookup"
+        return {"id": payload["id"], "result": {"state": state}}
+    return response_cache.cached("CheckTransaction")(check)
+
+
+def run(handler_result):
+    lookups = 0
+    try:
+        next(handler_result)
+        lookups += 1
+        handler_result.send(None)
+    except StopIteration as stop:
+        return stop.value, lookups
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    response_cache.cache.clear()
+    yield
+    response_cache.cache.clear()
+
+
+def test_settled_response_is_served_from_cache():
+    cached_check = handler(2)
+    assert run(cached_check({"id": 1, "params": {"id": "t-1"}})) == ({"id": 1, "result": {"state": 2}}, 1)
+    assert run(cached_check({"id": 2, "params": {"id": "t-1"}})) == ({"id": 2, "result": {"state": 2}}, 0)
+
+
+def test_open_transaction_is_not_cached():
+    cached_check = handler(1)
+    run(cached_check({"id": 1, "params": {"id": "t-1"}}))
+    assert run(cached_check({"id": 2, "params": {"id": "t-1"}}))[1] == 1
+
+
+@pytest.mark.parametrize("transaction_id", [["x"], {}, 12345, None])
+def test_non_string_id_bypasses_cache(transaction_id):
+    response, lookups = run(handler(2)({"id": 1, "params": {"id": transaction_id}}))
+    assert response == {"id": 1, "error": {"code": -32600}}
+    assert response_cache.cache.stats()["size"] == 0
@@ -0,0 +1,94 @@
+import json
+import asyncio
+import rpc_codec
+from rpc_codec import ErrorEnvelope, StreamedResponse
+
+ERROR = {"code": -31050, "message": {"ru": "Заказ не найден", "uz": "Buyurtma topilmadi", "en": "Order not found"}}
+
+
+class Rows:
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.rows)
+
+    def close(self):
+        self.closed = True
+
+
+class AsyncRows(Rows):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.rows)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_error_envelope_substitutes_id():
+    envelope = ErrorEnvelope(ERROR)
+    for rpc_id in (7, "abc", None, {"nested": [1, 2]}):
+        response = envelope(rpc_id)
+        assert response == {"error": ERROR, "result": None, "id": rpc_id}
+        assert json.loads(rpc_codec.encode_response(response)) == {"error": ERROR, "result": None, "id": rpc_id}
+
+
+def test_modified_error_response_is_serialized_in_full():
+    response = ErrorEnvelope(ERROR)(1)
+    response["error"] = {"code": -32400, "message": "Internal error"}
+    assert json.loads(rpc_codec.encode_response(response))["error"] == {"code": -32400, "message": "Internal error"}
+
+
+def test_auth_matches_precomputed_header():
+    expected = rpc_codec.basic_auth_header("Paycom", "secret")
+    assert rpc_codec.auth_matches("Basic UGF5Y29tOnNlY3JldA== ", expected)
+    assert rpc_codec.auth_matches(b"Basic UGF5Y29tOnNlY3JldA==", expected)
+    assert not rpc_codec.auth_matches("Basic UGF5Y29tOndyb25n", expected)
+    assert not rpc_codec.auth_matches("Basic Пароль", expected)
+
+
+def test_streamed_response_is_valid_json_across_chunks():
+    rows = Rows(range(1000))
+    response = StreamedResponse(5, "transactions", rows, lambda row: {"id": row})
+    chunks = list(rpc_codec.iter_encoded(response, chunk_size=256))
+    assert len(chunks) > 1
+    body = json.loads(b"".join(chunks))
+    assert body["id"] == 5 and body["error"] is None
+    assert body["result"]["transactions"] == [{"id": row} for row in range(1000)]
+    assert rows.closed
+
+
+def test_streamed_response_without_rows():
+    response = StreamedResponse("x", "transactions", Rows([]), lambda row: row)
+    assert json.loads(b"".join(rpc_codec.iter_encoded(response))) == {
+        "result": {"transactions": []}, "error": None, "id": "x"}
+
+
+def test_interrupted_stream_closes_rows():
+    rows = Rows(range(1000))
+    chunks = rpc_codec.iter_encoded(StreamedResponse(1, "transactions", rows, str), chunk_size=64)
+    next(chunks)
+    chunks.close()  # клиент оборвал соединение
+    assert rows.closed
+
+
+def test_async_streamed_response():
+    rows = AsyncRows(range(100))
+    response = StreamedResponse(1, "transactions", rows, lambda row: {"id": row})
+
+    async def collect():
+        return [chunk async for chunk in rpc_codec.aiter_encoded(response, chunk_size=128)]
+
+    body = json.loads(b"".join(asyncio.run(collect())))
+    assert body["result"]["transactions"] == [{"id": row} for row in range(100)]
+    assert rows.closed
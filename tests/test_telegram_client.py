@@ -0,0 +1,65 @@
+import pytest
+import telegram_client
+from telegram_client import RateLimiter, RetryableError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(telegram_client.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_is_sent_without_waiting(clock):
+    limiter = RateLimiter(chat_rate=1, global_rate=25, burst=3, max_wait=2)
+    assert [limiter.reserve(7) for _ in range(3)] == [0, 0, 0]
+    assert limiter.reserve(7) == pytest.approx(1)
+    assert limiter.reserve("8") == 0  # у другого чата своё «ведро»
+
+
+def test_wait_beyond_max_wait_is_deferred(clock):
+    limiter = RateLimiter(chat_rate=1, global_rate=25, burst=1, max_wait=2)
+    limiter.reserve(7)
+    assert limiter.reserve(7) == pytest.approx(1)
+    assert limiter.reserve(7) == pytest.approx(2)
+    with pytest.raises(RetryableError) as error:
+        limiter.reserve(7)
+    assert error.value.retry_after == pytest.approx(3)
+    clock.now += 3
+    assert limiter.reserve(7) == 0  # отказ не занял место в очереди
+
+
+def test_block_after_429_delays_chat(clock):
+    limiter = RateLimiter(chat_rate=1, global_rate=25, burst=3, max_wait=2)
+    limiter.block(7, 30)
+    assert limiter.stats() == {"chats": 1, "blocked_chats": 1}
+    with pytest.raises(RetryableError) as error:
+        limiter.reserve("7")
+    assert error.value.retry_after == pytest.approx(30)
+    clock.now += 29
+    assert limiter.reserve(7) == pytest.approx(1)
+    assert limiter.stats()["blocked_chats"] == 1
+    clock.now += 1
+    assert limiter.stats()["blocked_chats"] == 0
+
+
+def test_group_chat_uses_group_rate(clock):
+    limiter = RateLimiter(chat_rate=1, group_rate=1 / 3, global_rate=25, burst=1, max_wait=5)
+    limiter.reserve(-100)
+    assert limiter.reserve(-100) == pytest.approx(3)
+    limiter.reserve(7)
+    assert limiter.reserve(7) == pytest.approx(1)
+
+
+def test_global_rate_limits_all_chats(clock):
+    limiter = RateLimiter(chat_rate=1, global_rate=2, burst=3, max_wait=2)
+    assert [limiter.reserve(chat_id) for chat_id in (1, 2)] == [0, 0]
+    assert limiter.reserve(3) == pytest.approx(0.5)
@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import importlib
+import threading
+import contextvars
+
+# Трассировка отдельных запросов: на вызов /callback (и на пачку outbox)
+# заводится трасса, внутри – спаны: разбор JSON, авторизация, каждый хелпер БД
+# (через metrics.timed_db), загрузка профилей clients, каждая отправка в Telegram.
+#
+# Спаны пишутся всегда (кортеж в список – дёшево), а экспортируется трасса,
+# если запрос попал в выборку TRACE_SAMPLE_RATE или шёл дольше TRACE_SLOW_MS,
+# или в нём был медленный SQL (дольше SLOW_SQL_MS – вместе с его EXPLAIN).
+#
+# Экспорт – в фоновом потоке, запрос не ждёт записи. TRACE_EXPORTER:
+#   jsonl (по умолчанию) – строка JSON на трассу в TRACE_FILE;
+#   log – в общий лог (stdout) записью payme.trace;
+#   none – не экспортировать;
+#   module:attr – свой экспортёр: объект с методом export(trace_dict)
+#   или фабрика без аргументов, которая его возвращает.
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jsonl")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+SLOW_SQL_MS = float(os.getenv("SLOW_SQL_MS", "200"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "1000"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))  # на трассу; лишние считаются
+
+_current = contextvars.ContextVar("payme_trace", default=None)
+_stats_lock = threading.Lock()
+_stats = {"traces": 0, "exported": 0, "slow": 0, "slow_sql": 0, "dropped": 0}
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "attrs", "started", "wall_started", "spans",
+                 "sampled", "keep", "dropped_spans", "_token")
+
+    def __init__(self, name, attrs):
+        self.trace_id = "%016x" % random.getrandbits(64)
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        self.spans = []  # (имя, начало от старта трассы в мс, длительность в мс, атрибуты)
+        self.sampled = random.random() < TRACE_SAMPLE_RATE
+        self.keep = False  # принудительный экспорт (медленный SQL)
+        self.dropped_spans = 0
+        self._token = None
+
+    def add_span(self, name, started, duration, attrs=None):
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped_spans += 1
+            return
+        self.spans.append((name, round((started - self.started) * 1000, 3), round(duration * 1000, 3), attrs))
+
+    def to_dict(self, duration_ms):
+        trace = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "ts": round(self.wall_started, 3),
+            "duration_ms": duration_ms,
+            "sampled": self.sampled,
+            "attrs": self.attrs,
+            "spans": [
+                {"name": name, "start_ms": start, "duration_ms": duration, **({"attrs": attrs} if attrs else {})}
+                for name, start, duration, attrs in self.spans
+            ],
+        }
+        if self.dropped_spans:
+            trace["dropped_spans"] = self.dropped_spans
+        return trace
+
+
+def current():
+    return _current.get()
+
+
+def current_id():
+    trace = _current.get()
+    return trace.trace_id if trace is not None else None
+
+
+def start_trace(name, **attrs):
+    trace = Trace(name, attrs)
+    trace._token = _current.set(trace)
+    return trace
+
+
+# Завершает трассу и решает, экспортировать ли её. discard – не экспортировать
+# никогда (например, пустой проход outbox).
+def finish_trace(trace, discard=False, **attrs):
+    if trace._token is not None:
+        try:
+            _current.reset(trace._token)
+        except ValueError:
+            _current.set(None)  # завершена в другом контексте
+        trace._token = None
+    if discard:
+        return
+    duration_ms = round((time.perf_counter() - trace.started) * 1000, 3)
+    trace.attrs.update(attrs)
+    _count("traces")
+    slow = duration_ms >= TRACE_SLOW_MS
+    if slow:
+        _count("slow")
+    if trace.sampled or slow or trace.keep:
+        export(trace.to_dict(duration_ms))
+
+
+# Спан текущей трассы (with tracing.span("имя", атрибуты)); без трассы ничего не записывает
+class span:
+    __slots__ = ("name", "attrs", "_started")
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs or None
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        trace = _current.get()
+        if trace is not None:
+            attrs = self.attrs
+            if exc_type is not None:
+                attrs = dict(attrs or {}, error=exc_type.__name__)
+            trace.add_span(self.name, self._started, time.perf_counter() - self._started, attrs)
+        return False
+
+    def set(self, **attrs):
+        self.attrs = dict(self.attrs or {}, **attrs)
+
+
+# Атрибуты трассы вызова JSON-RPC: метод, транзакция PayMe, код результата
+def rpc_attrs(payload, response):
+    params = payload.get("params") if isinstance(payload, dict) else None
+    params = params if isinstance(params, dict) else {}
+    error = response.get("error") if isinstance(response, dict) else None
+    return {
+        "method": payload.get("method") if isinstance(payload, dict) else None,
+        "transaction_id": params.get("id"),
+        "code": error.get("code") if error else 0,
+    }
+
+
+# Медленный запрос: спан с SQL, параметрами и планом; трасса экспортируется
+# в любом случае, а без трассы запрос пишется в лог.
+def record_slow_sql(sql, params, duration, plan):
+    _count("slow_sql")
+    attrs = {"sql": " ".join(sql.split()), "params": [str(p) for p in params], "plan": plan}
+    trace = _current.get()
+    if trace is not None:
+        trace.keep = True
+        trace.add_span("sql.slow", time.perf_counter() - duration, duration, attrs)
+    logging.warning("Медленный SQL (%.1f мс, трасса %s): %s", duration * 1000, current_id(), attrs["sql"][:500])
+
+
+# План для медленного запроса (psycopg2): EXPLAIN без ANALYZE – запрос не выполняется повторно.
+# Соединение обычно внутри транзакции вызывающего: EXPLAIN идёт под SAVEPOINT,
+# и его ошибка откатывается только до него, не обрывая саму транзакцию.
+def explain(conn, sql, params=()):
+    cur = conn.cursor()
+    savepoint = not conn.autocommit
+    try:
+        if savepoint:
+            cur.execute("SAVEPOINT tracing_explain")
+        try:
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cur.fetchone()[0]
+        except Exception as e:
+            if savepoint:
+                cur.execute("ROLLBACK TO SAVEPOINT tracing_explain")
+            plan = f"EXPLAIN не выполнен: {e}"
+        if savepoint:
+            cur.execute("RELEASE SAVEPOINT tracing_explain")
+        return plan
+    finally:
+        cur.close()
+
+
+def is_slow(duration):
+    return duration * 1000 >= SLOW_SQL_MS
+
+
+# --- Экспорт ---
+
+class JsonLinesExporter:
+    def __init__(self, path=TRACE_FILE):
+        self.path = path
+        self._file = None
+
+    def export(self, trace):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(trace, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+
+
+class LogExporter:
+    def __init__(self):
+        self.logger = logging.getLogger("payme.trace")
+
+    def export(self, trace):
+        self.logger.info("trace", extra={"rpc": {"event": "trace", **trace}})
+
+
+def _load_exporter(spec):
+    if spec == "jsonl":
+        return JsonLinesExporter()
+    if spec == "log":
+        return LogExporter()
+    if spec in ("", "none"):
+        return None
+    module_name, _, attr = spec.partition(":")
+    exporter = getattr(importlib.import_module(module_name), attr)
+    return exporter() if callable(exporter) and not hasattr(exporter, "export") else exporter
+
+
+class _ExportThread:
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self.queue = queue.Queue(TRACE_QUEUE_SIZE)
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            trace = self.queue.get()
+            if trace is None:
+                return
+            try:
+                self.exporter.export(trace)
+                _count("exported")
+            except Exception as e:
+                logging.error("Трассировка: ошибка экспорта: %s", e)
+
+    def put(self, trace):
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            _count("dropped")
+
+    def close(self, timeout=2):
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+
+_exporter = None
+_export_thread = None
+_export_lock = threading.Lock()
+_configured = False
+
+
+# Подменяет экспортёр (например, в тестах или из кода приложения)
+def set_exporter(exporter):
+    global _exporter, _export_thread, _configured
+    with _export_lock:
+        if _export_thread is not None:
+            _export_thread.close()
+        _exporter = exporter
+        _export_thread = None
+        _configured = True
+
+
+def export(trace):
+    global _exporter, _export_thread, _configured
+    thread = _export_thread
+    if thread is None or thread.pid != os.getpid():
+        with _export_lock:
+            if not _configured:
+                _exporter = _load_exporter(TRACE_EXPORTER)
+                _configured = True
+            if _exporter is None:
+                return
+            # Поток создаётся лениво в каждом процессе (после fork у воркера gunicorn его нет)
+            if _export_thread is None or _export_thread.pid != os.getpid():
+                _export_thread = _ExportThread(_exporter)
+            thread = _export_thread
+    thread.put(trace)
+
+
+def shutdown():
+    if _export_thread is not None and _export_thread.pid == os.getpid():
+        _export_thread.close()
+
+
+atexit.register(shutdown)
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
@@ -0,0 +1,150 @@
+from collections import namedtuple
+import order_queries
+import order_states
+
+# Переходы статусов заказа. Каждый переход – один условный
+# UPDATE orders ... WHERE state = ANY(...) RETURNING за один round trip:
+# строка блокируется (FOR UPDATE), при подходящем статусе обновляется,
+# иначе возвращается как есть – по ней и разбирается идемпотентная ветка.
+#
+# Допустимые переходы и их статусы – из order_states.TRANSITIONS; SET меняет
+# только status, state пересчитывает триггер orders_set_state.
+# В выражениях SET и guard на текущие значения ссылаемся через cur.*.
+# Читаются и возвращаются только колонки order_queries.PAYME_COLUMNS, а само
+# выражение готовится (PREPARE) один раз на соединение.
+#
+# Как и поиск в order_queries, переход сначала ищет заказ в горячих секциях
+# orders, затем в остальных; заказ из архива перед переходом возвращается в orders.
+# Выражение для остальных секций заодно проверяет архив: если заказа нет в
+# orders, но он есть в архиве, возвращается строка с applied = NULL. Поэтому
+# для неизвестного ключа (ответ -31003) – два запроса и никакого DELETE из архива,
+# а возврат из архива (RESTORE_SQL) – только для заказа, который там точно есть.
+
+Transition = namedtuple("Transition", ["name", "key_column", "from_states", "set_sql", "guard_sql"])
+
+# Ожидаемая сумма в единицах callback'а (то же правило, что и в is_amount_correct)
+EXPECTED_AMOUNT_SQL = (
+    "CASE lower(coalesce(cur.payment_system, 'payme')) "
+    "WHEN 'click' THEN cur.payment_amount * 100 "
+    "WHEN 'payme' THEN cur.payme_amount "
+    "ELSE cur.payment_amount END"
+)
+
+CREATE = Transition(
+    "create",
+    "merchant_trans_id",
+    order_states.from_states("create"),
+    f"status = {order_states.next_status_sql('create')}, create_time = %(now)s, transaction_id = %(transaction_id)s",
+    EXPECTED_AMOUNT_SQL + " = %(amount)s",
+)
+
+PERFORM = Transition(
+    "perform",
+    "transaction_id",
+    order_states.from_states("perform"),
+    f"status = {order_states.next_status_sql('perform')}, perform_time = %(now)s",
+    None,
+)
+
+CANCEL = Transition(
+    "cancel",
+    "transaction_id",
+    order_states.from_states("cancel"),
+    f"status = {order_states.next_status_sql('cancel')}, cancel_time = %(now)s, cancel_reason = %(reason)s",
+    None,
+)
+
+_TEMPLATE = """
+WITH cur AS (
+    SELECT {columns}, order_time FROM orders WHERE {key_column} = %(key)s AND {scope} FOR UPDATE
+), upd AS (
+    UPDATE orders o SET {set_sql}
+    FROM cur
+    WHERE o.order_id = cur.order_id AND o.order_time = cur.order_time
+      AND cur.state = ANY(%(from_states)s){guard}
+    RETURNING {returning}
+)
+SELECT TRUE AS applied, {upd_columns} FROM upd
+UNION ALL
+SELECT FALSE AS applied, {cur_columns} FROM cur WHERE NOT EXISTS (SELECT 1 FROM upd){archive}
+"""
+
+# Признак заказа в архиве для выражения остальных секций (scope "cold")
+_ARCHIVE_TEMPLATE = """
+UNION ALL
+SELECT NULL AS applied, {nulls} FROM {archive_table}
+WHERE {key_column} = %(key)s AND NOT EXISTS (SELECT 1 FROM cur)
+LIMIT 1"""
+
+SCOPES = {"hot": order_queries.HOT_SQL, "cold": order_queries.COLD_SQL}
+
+_sql_cache = {}
+
+
+# SQL перехода с именованными параметрами psycopg2: %(key)s, %(from_states)s и параметры set/guard.
+# scope – "hot" или "cold", в каких секциях orders искать заказ.
+def build_sql(transition, scope="hot"):
+    sql = _sql_cache.get((transition.name, scope))
+    if sql is None:
+        sql = _TEMPLATE.format(
+            columns=order_queries.COLUMNS_SQL,
+            returning=", ".join("o." + column for column in order_queries.PAYME_COLUMNS),
+            upd_columns=", ".join("upd." + column for column in order_queries.PAYME_COLUMNS),
+            cur_columns=", ".join("cur." + column for column in order_queries.PAYME_COLUMNS),
+            key_column=transition.key_column,
+            scope=SCOPES[scope],
+            set_sql=transition.set_sql,
+            guard=("\n      AND " + transition.guard_sql) if transition.guard_sql else "",
+            archive=_ARCHIVE_TEMPLATE.format(
+                nulls=", ".join(["NULL"] * len(order_queries.PAYME_COLUMNS)),
+                archive_table=order_queries.ARCHIVE_TABLE,
+                key_column=transition.key_column,
+            ) if scope == "cold" else "",
+        )
+        _sql_cache[(transition.name, scope)] = sql
+    return sql
+
+
+_statements = {}
+
+
+def statement(transition, scope="hot"):
+    prepared = _statements.get((transition.name, scope))
+    if prepared is None:
+        prepared = _statements[(transition.name, scope)] = order_queries.Statement(
+            f"transition_{transition.name}_{scope}", build_sql(transition, scope)
+        )
+    return prepared
+
+
+def _execute(conn, transition, scope, params):
+    cur = conn.cursor()
+    try:
+        order_queries.execute(cur, statement(transition, scope), params)
+        return cur.fetchone()
+    finally:
+        cur.close()
+
+
+# Применяет переход и возвращает (applied, order):
+#   (True, новая строка)  – переход выполнен;
+#   (False, текущая строка) – статус не подходит, строка не изменена;
+#   (False, None) – заказ не найден.
+# Коммит – за вызывающим, чтобы в ту же транзакцию можно было добавить свои записи.
+def apply_transition(conn, transition, key, **params):
+    params["key"] = key
+    params["from_states"] = list(transition.from_states)
+    scope = "hot"
+    row = _execute(conn, transition, "hot", params)
+    if row is None:
+        scope = "cold"
+        row = _execute(conn, transition, "cold", params)
+        if row is not None and row[0] is None:
+            scope = "archive"
+            order_queries.restore_order(conn, transition.key_column, key)
+            row = _execute(conn, transition, "cold", params) or _execute(conn, transition, "hot", params)
+    if row is None:
+        order_queries.count_lookup("missing")
+        return False, None
+    order_queries.count_lookup(scope)
+    return row[0], order_queries.OrderRow._make(row[1:])